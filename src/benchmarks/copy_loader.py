@@ -0,0 +1,61 @@
+"""
+Benchmark: COPY ... FROM STDIN vs. execute_values for raw.raw_sensor_data.
+
+Both paths load the same synthetic frame into a TEMP copy of the raw table,
+so nothing is written to the real tables. Requires a reachable PostgreSQL
+configured in db_utils.
+
+    python -m src.benchmarks.copy_loader --rows 50000 --repeat 3 [--output result.json]
+"""
+import argparse
+import json
+import time
+from src.benchmarks.generator import generate
+from src.benchmarks.results import write_results
+from src.database.db_utils import db_connection
+from src.database.load_raw_data import prepare_raw_frame, insert_raw_values, copy_raw_rows
+
+BENCH_TABLE = "bench_raw_sensor_data"
+
+
+def make_frame(rows, seed=42):
+    """Clean synthetic incoming frame with the Kaggle schema."""
+    return generate(rows, seed=seed, missing_device=0, type_error=0, out_of_range=0, bad_boolean=0)
+
+
+def run(rows, repeat):
+    df = make_frame(rows)
+    results = {"rows": rows, "repeat": repeat}
+
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE TEMP TABLE {BENCH_TABLE} (LIKE raw.raw_sensor_data INCLUDING DEFAULTS)")
+            for method, load in [("execute_values", insert_raw_values), ("copy", copy_raw_rows)]:
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    frame, _, _ = prepare_raw_frame(df, "benchmark.csv")
+                    load(cur, frame, table=BENCH_TABLE)
+                    conn.commit()
+                    timings.append(time.perf_counter() - start)
+                    cur.execute(f"TRUNCATE {BENCH_TABLE}")
+                    conn.commit()
+                best = min(timings)
+                results[method] = {"best_s": round(best, 4), "rows_per_s": round(rows / best)}
+            # The pooled session outlives this run, so drop the TEMP table explicitly
+            cur.execute(f"DROP TABLE {BENCH_TABLE}")
+            conn.commit()
+
+    results["speedup"] = round(results["execute_values"]["best_s"] / results["copy"]["best_s"], 2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="JSON result path (default: benchmark_results/copy_loader-<timestamp>.json)")
+    args = parser.parse_args()
+    results = run(args.rows, args.repeat)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {write_results('copy_loader', vars(args), results, args.output)}")
@@ -0,0 +1,131 @@
+"""
+Seeded synthetic sensor data with the Kaggle schema
+(ts, device, co, humidity, light, lpg, motion, smoke, temp).
+
+Rows, device count and corruption rates are configurable, and the same
+seed always produces the same files, so benchmark runs are comparable
+without the Kaggle download.
+
+    python -m src.benchmarks.generator --files 10 --rows 50000 --devices 3 --out data_synthetic
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+# Default corruption rates, matching src/data_construction/corrupt_data_ingestion.py
+MISSING_DEVICE_PROB = 0.01     # device set to None
+TYPE_ERROR_PROB = 0.01         # numeric value replaced with "N/A" (per column)
+OUT_OF_RANGE_PROB = 0.01       # temp/humidity set outside the valid range
+BAD_BOOLEAN_PROB = 0.0         # light/motion set to "maybe"
+
+START_TS = 1594512094.3859746  # first timestamp of the Kaggle dataset
+TS_STEP = 1.3                  # seconds between readings across all devices
+
+TYPE_ERROR_COLS = ["co", "humidity", "light", "lpg", "smoke", "temp"]
+
+
+def device_ids(count):
+    """Deterministic MAC-style device ids."""
+    return [":".join(f"{(i * 2654435761 >> shift) & 0xFF:02x}" for shift in range(0, 48, 8)) for i in range(1, count + 1)]
+
+
+def generate(rows, devices=3, seed=42, start_ts=START_TS, missing_device=MISSING_DEVICE_PROB,
+             type_error=TYPE_ERROR_PROB, out_of_range=OUT_OF_RANGE_PROB, bad_boolean=BAD_BOOLEAN_PROB):
+    """
+    Builds one synthetic incoming frame.
+
+    Args:
+        rows (int): Number of rows.
+        devices (int): Device cardinality.
+        seed (int): Random seed; the same arguments always give the same frame.
+        start_ts (float): Epoch seconds of the first row.
+        missing_device, type_error, out_of_range, bad_boolean (float): Corruption rates (0..1).
+
+    Returns:
+        DataFrame: Rows in the raw incoming format.
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "ts": start_ts + np.arange(rows) * TS_STEP,
+        "device": rng.choice(device_ids(devices), rows),
+        "co": rng.uniform(0.001, 0.012, rows),
+        "humidity": rng.uniform(1, 99, rows),
+        "light": rng.choice([True, False], rows),
+        "lpg": rng.uniform(0.002, 0.010, rows),
+        "motion": rng.choice([True, False], rows),
+        "smoke": rng.uniform(0.005, 0.030, rows),
+        "temp": rng.uniform(0, 35, rows),
+    })
+
+    def pick(prob):
+        return rng.random(rows) < prob
+
+    if missing_device:
+        df["device"] = df["device"].astype(object)
+        df.loc[pick(missing_device), "device"] = None
+    if type_error:
+        for col in TYPE_ERROR_COLS:
+            mask = pick(type_error)
+            if mask.any():
+                df[col] = df[col].astype(object)
+                df.loc[mask, col] = "N/A"
+    if out_of_range:
+        mask = pick(out_of_range)
+        df.loc[mask, "temp"] = rng.choice([150, -120], int(mask.sum()))
+        mask = pick(out_of_range)
+        df.loc[mask, "humidity"] = rng.choice([250, -50], int(mask.sum()))
+    if bad_boolean:
+        for col in ["light", "motion"]:
+            mask = pick(bad_boolean)
+            if mask.any():
+                df[col] = df[col].astype(object)
+                df.loc[mask, col] = "maybe"
+    return df
+
+
+def write_files(out_dir, files, rows, devices=3, seed=42, prefix="sensor_data_synthetic", **rates):
+    """
+    Writes `files` consecutive CSVs (timestamps continue from file to file).
+
+    Returns:
+        list: Paths of the written files.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i in range(files):
+        df = generate(rows, devices, seed + i, start_ts=START_TS + i * rows * TS_STEP, **rates)
+        path = os.path.join(out_dir, f"{prefix}_{i + 1}.csv")
+        df.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def add_arguments(parser):
+    """Generator options shared by the benchmark CLIs."""
+    parser.add_argument("--rows", type=int, default=50000, help="rows per file")
+    parser.add_argument("--devices", type=int, default=3, help="device cardinality")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--missing-device", type=float, default=MISSING_DEVICE_PROB)
+    parser.add_argument("--type-error", type=float, default=TYPE_ERROR_PROB)
+    parser.add_argument("--out-of-range", type=float, default=OUT_OF_RANGE_PROB)
+    parser.add_argument("--bad-boolean", type=float, default=BAD_BOOLEAN_PROB)
+
+
+def rates(args):
+    return {
+        "missing_device": args.missing_device,
+        "type_error": args.type_error,
+        "out_of_range": args.out_of_range,
+        "bad_boolean": args.bad_boolean,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument("--files", type=int, default=1)
+    parser.add_argument("--out", default="data_synthetic")
+    args = parser.parse_args()
+    paths = write_files(args.out, args.files, args.rows, args.devices, args.seed, **rates(args))
+    print(f"Wrote {len(paths)} files to '{args.out}'")
@@ -0,0 +1,91 @@
+"""
+JSON result files shared by the benchmarks, so runs can be compared between releases.
+
+Every result file records the benchmark parameters, the measurements and
+the environment (git commit, Python/pandas versions, CPU count, storage format).
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import statistics
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+RESULTS_DIR = BASE_DIR / "benchmark_results"
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "storage_format": os.getenv("PIPELINE_STORAGE_FORMAT", "parquet"),
+        "load_method": os.getenv("DB_LOAD_METHOD", "copy"),
+    }
+
+
+def summarize(timings, rows=None):
+    """min/median/mean/max of a list of seconds, plus rows/sec at the median."""
+    median = statistics.median(timings)
+    out = {
+        "runs": len(timings),
+        "min_s": round(min(timings), 4),
+        "median_s": round(median, 4),
+        "mean_s": round(statistics.fmean(timings), 4),
+        "max_s": round(max(timings), 4),
+    }
+    if rows:
+        out["rows_per_s"] = round(rows / median) if median else None
+    return out
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile (pct in 0..100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def write_results(name, params, results, output=None):
+    """
+    Writes one benchmark run to JSON.
+
+    Args:
+        name (str): Benchmark name, used in the default file name.
+        params (dict): The arguments the benchmark ran with.
+        results (dict): The measurements.
+        output (str): Target path; defaults to benchmark_results/<name>-<timestamp>.json.
+
+    Returns:
+        Path: The written file.
+    """
+    started = datetime.now()
+    path = Path(output) if output else RESULTS_DIR / f"{name}-{started:%Y%m%d-%H%M%S}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "benchmark": name,
+        "created_at": started.isoformat(timespec="seconds"),
+        "environment": environment(),
+        "params": params,
+        "results": results,
+    }
+    path.write_text(json.dumps(payload, indent=2, default=str))
+    return path
@@ -0,0 +1,156 @@
+"""
+End-to-end soak test: drops synthetic files into incoming/ at a fixed rate.
+
+Files are generated up front and moved into incoming/ one by one, so the
+generator never slows the drop rate. A file's latency runs from its drop to
+the moment the watcher records it in the processed-file ledger, which happens
+after the DB commit. The run reports sustained throughput and p50/p90/p99
+latency and writes them to JSON.
+
+Run the watcher yourself, or pass --start-watcher to launch one for the
+duration of the test. Either way it loads into the configured PostgreSQL.
+
+    python -m src.benchmarks.soak --rate 2 --duration 60 --rows 20000 --start-watcher
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from src.benchmarks.generator import generate, add_arguments, rates, START_TS, TS_STEP
+from src.benchmarks.results import percentile, write_results
+from src.pipeline.ledger import LEDGER_FILE
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+INCOMING_DIR = BASE_DIR / "incoming"
+
+
+def _finished(ledger_path, names):
+    """file_name -> (stage, rows, finished_at epoch) for the files the watcher has finished."""
+    if not Path(ledger_path).exists():
+        return {}
+    conn = sqlite3.connect(f"file:{ledger_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT file_name, stage, rows, finished_at FROM files WHERE finished_at IS NOT NULL"
+        ).fetchall()
+    finally:
+        conn.close()
+    return {
+        name: (stage, count, datetime.fromisoformat(finished_at).timestamp())
+        for name, stage, count, finished_at in rows
+        if name in names
+    }
+
+
+def _start_watcher():
+    proc = subprocess.Popen([sys.executable, "-m", "src.pipeline.watcher"], cwd=BASE_DIR)
+    time.sleep(3)  # imports and startup backlog scan
+    return proc
+
+
+def _stop_watcher(proc):
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def run(rate, duration, rows, devices=3, seed=42, drain_timeout=120, start_watcher=False,
+        ledger_path=LEDGER_FILE, **corruption):
+    """
+    Drops rate * duration files into incoming/ and waits for the watcher to finish them.
+
+    Returns:
+        dict: Throughput and latency figures.
+    """
+    files = max(math.ceil(rate * duration), 1)
+    run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+    os.makedirs(INCOMING_DIR, exist_ok=True)
+
+    # Staged next to incoming/ so the move is an atomic rename on the same file system
+    staging = Path(tempfile.mkdtemp(prefix="soak_", dir=BASE_DIR))
+    names = []
+    for i in range(files):
+        name = f"soak_{run_id}_{i + 1:05d}.csv"
+        # Distinct seeds and timestamps, so the ledger never sees duplicate content
+        generate(rows, devices, seed + i, start_ts=START_TS + i * rows * TS_STEP, **corruption) \
+            .to_csv(staging / name, index=False)
+        names.append(name)
+
+    watcher = _start_watcher() if start_watcher else None
+    dropped_at = {}
+    try:
+        started = time.time()
+        for i, name in enumerate(names):
+            delay = started + i / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            os.replace(staging / name, INCOMING_DIR / name)
+            dropped_at[name] = time.time()
+        drop_seconds = time.time() - started
+
+        wanted = set(names)
+        deadline = time.time() + drain_timeout
+        done = {}
+        while time.time() < deadline:
+            done = _finished(ledger_path, wanted)
+            if len(done) == len(wanted):
+                break
+            time.sleep(0.5)
+    finally:
+        if watcher is not None:
+            _stop_watcher(watcher)
+        shutil.rmtree(staging, ignore_errors=True)
+
+    latencies = [done[name][2] - dropped_at[name] for name in done]
+    loaded = [name for name in done if done[name][0] == "loaded"]
+    loaded_rows = sum(done[name][1] or 0 for name in loaded)
+    elapsed = (max(done[name][2] for name in done) - started) if done else None
+    return {
+        "files_dropped": files,
+        "files_loaded": len(loaded),
+        "files_failed": sum(1 for name in done if done[name][0] != "loaded"),
+        "files_unfinished": files - len(done),
+        "target_files_per_s": rate,
+        "achieved_drop_files_per_s": round((files - 1) / drop_seconds, 3) if files > 1 and drop_seconds else None,
+        "elapsed_s": round(elapsed, 3) if elapsed else None,
+        "sustained_files_per_s": round(len(loaded) / elapsed, 3) if elapsed else None,
+        "sustained_rows_per_s": round(loaded_rows / elapsed) if elapsed else None,
+        "latency_p50_s": _round(percentile(latencies, 50)),
+        "latency_p90_s": _round(percentile(latencies, 90)),
+        "latency_p99_s": _round(percentile(latencies, 99)),
+        "latency_max_s": _round(max(latencies) if latencies else None),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument("--rate", type=float, default=1.0, help="files dropped per second")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of dropping files")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="seconds to wait for the backlog")
+    parser.add_argument("--start-watcher", action="store_true", help="run src.pipeline.watcher for the test")
+    parser.add_argument("--output", help="JSON result path (default: benchmark_results/soak-<timestamp>.json)")
+    args = parser.parse_args()
+
+    params = {"rate": args.rate, "duration": args.duration, "rows": args.rows, "devices": args.devices,
+              "seed": args.seed, **rates(args)}
+    results = run(args.rate, args.duration, args.rows, args.devices, args.seed, args.drain_timeout,
+                  args.start_watcher, **rates(args))
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {write_results('soak', params, results, args.output)}")
@@ -0,0 +1,136 @@
+"""
+Micro-benchmarks for the file-based pipeline stages.
+
+Times validate_file, transform_file and aggregate_file on a seeded
+synthetic file. With --db it also times load_raw_file and
+load_aggregated_file against the configured PostgreSQL; the benchmark rows
+are deleted before every repeat, so each one times a fresh load rather than
+the duplicate no-op path. Afterwards the rows are deleted again by file name,
+together with the synthetic devices the benchmark registered. Results are
+written to JSON.
+
+    python -m src.benchmarks.stages --rows 50000 --repeat 5 [--db] [--output result.json]
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from src.benchmarks.generator import generate, add_arguments, rates, device_ids
+from src.benchmarks.results import summarize, write_results
+from src.pipeline.validation import validate_file, reset_quarantine, ARCHIVE_DIR
+from src.pipeline.transformation import transform_file, TRANSFORMED_DIR
+from src.pipeline.aggregation import aggregate_file, AGGREGATES_DIR
+from src.pipeline.storage import find_output
+
+BENCH_FILE = "benchmark_stages.csv"
+
+
+def _time(func, repeat, setup=None):
+    """Times func `repeat` times; setup (untimed) runs before each call."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def _cleanup_outputs(file_name):
+    for directory in (ARCHIVE_DIR, TRANSFORMED_DIR, AGGREGATES_DIR):
+        path = find_output(directory, file_name)
+        if path is not None:
+            path.unlink()
+    reset_quarantine(file_name)
+
+
+def _registered_devices(ids):
+    """The subset of device ids already in raw.devices."""
+    from src.database.db_utils import db_connection
+    from src.database.devices import DEVICE_TABLE
+
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT device_id FROM {DEVICE_TABLE} WHERE device_id = ANY(%s)", (ids,))
+            return {row[0] for row in cur.fetchall()}
+
+
+def _delete_loaded_rows(file_name, devices=()):
+    """Deletes the rows loaded from file_name, then the given devices (registered by the benchmark)."""
+    from src.database.db_utils import db_connection
+    from src.database.devices import DEVICE_TABLE, DEVICES
+    from src.database.load_raw_data import RAW_TABLE
+    from src.database.load_aggregated_data import AGG_TABLE
+
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            for table in (RAW_TABLE, AGG_TABLE):
+                cur.execute(f"DELETE FROM {table} WHERE file_name = %s", (file_name,))
+            if devices:
+                cur.execute(f"DELETE FROM {DEVICE_TABLE} WHERE device_id = ANY(%s)", (list(devices),))
+        conn.commit()
+    if devices:
+        DEVICES.clear()
+
+
+def run(rows, repeat, devices=3, seed=42, db=False, **corruption):
+    """
+    Runs every stage `repeat` times on the same synthetic file.
+
+    Returns:
+        dict: Timing summary per stage.
+    """
+    df = generate(rows, devices, seed, **corruption)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        src_path = Path(tmp) / BENCH_FILE
+        df.to_csv(src_path, index=False)
+        results["file_bytes"] = src_path.stat().st_size
+
+        try:
+            timings, _ = _time(lambda: validate_file(src_path), repeat)
+            results["validate_file"] = summarize(timings, rows)
+
+            archive_path = find_output(ARCHIVE_DIR, BENCH_FILE)
+            timings, transformed_path = _time(lambda: transform_file(archive_path), repeat)
+            results["transform_file"] = summarize(timings, rows)
+
+            timings, aggregated_path = _time(lambda: aggregate_file(transformed_path), repeat)
+            results["aggregate_file"] = summarize(timings, rows)
+
+            if db:
+                from src.database.load_raw_data import load_raw_file
+                from src.database.load_aggregated_data import load_aggregated_file
+
+                ids = device_ids(devices)
+                registered = _registered_devices(ids)
+                fresh = lambda: _delete_loaded_rows(BENCH_FILE)
+                try:
+                    timings, _ = _time(lambda: load_raw_file(src_path), repeat, setup=fresh)
+                    results["load_raw_file"] = summarize(timings, rows)
+                    timings, _ = _time(lambda: load_aggregated_file(Path(aggregated_path)), repeat, setup=fresh)
+                    results["load_aggregated_file"] = summarize(timings)
+                finally:
+                    _delete_loaded_rows(BENCH_FILE, [d for d in ids if d not in registered])
+        finally:
+            _cleanup_outputs(BENCH_FILE)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", action="store_true", help="also benchmark the DB loaders")
+    parser.add_argument("--output", help="JSON result path (default: benchmark_results/stages-<timestamp>.json)")
+    args = parser.parse_args()
+
+    params = {"rows": args.rows, "repeat": args.repeat, "devices": args.devices, "seed": args.seed,
+              "db": args.db, **rates(args)}
+    results = run(args.rows, args.repeat, args.devices, args.seed, args.db, **rates(args))
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {write_results('stages', params, results, args.output)}")
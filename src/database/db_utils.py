@@ -1,26 +1,205 @@
+import io
+import os
+import time
+import threading
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import pool
 from psycopg2.extras import execute_values
 import pandas as pd
 from pathlib import Path
+from dotenv import load_dotenv
 from loguru import logger
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+from src.pipeline.metrics import METRICS
+
+# Connection settings come from the environment (or a .env file in the project root)
+load_dotenv(Path(__file__).resolve().parents[2] / ".env")
 
-#  Update with your local PostgreSQL credentials
 DB_CONFIG = {
-    "dbname": "sensor_db",       # Database name
-    "user": "postgres",          # Default postgres user
-    "password": "AdminPass123!", 
-    "host": "localhost",         # Database host
-    "port": 5432                # Default Postgres port
+    "dbname": os.getenv("DB_NAME", "sensor_db"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": int(os.getenv("DB_PORT", "5432")),
 }
 
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX", "8"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Connections idle longer than this are pinged before being handed out
+POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(POOL_MAX_SIZE)
+_last_used = {}
+
+# Consecutive connection failures that open the circuit breaker
+BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", "3"))
+# Seconds the breaker stays open before one probe is let through (doubles up to the max)
+BREAKER_RESET = float(os.getenv("DB_BREAKER_RESET", "5"))
+BREAKER_RESET_MAX = float(os.getenv("DB_BREAKER_RESET_MAX", "60"))
+
+
+class CircuitBreaker:
+    """
+    Tracks whether the database is reachable.
+
+    closed: calls go through. After `failures` consecutive connection errors
+    it opens, and callers are told to skip the database (and spool instead).
+    Once the reset timeout has passed, a single caller is allowed through as a
+    probe (half-open). A success closes the breaker again; a failure reopens
+    it with twice the timeout.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, reset=BREAKER_RESET, reset_max=BREAKER_RESET_MAX):
+        self.failures = max(failures, 1)
+        self.reset = reset
+        self.reset_max = reset_max
+        self.state = "closed"
+        self._count = 0
+        self._timeout = reset
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        return self.state != "closed"
+
+    def allow(self):
+        """True if the caller may use the database now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self._timeout:
+                self.state = "half_open"
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("Database reachable again, closing circuit breaker")
+            self.state = "closed"
+            self._count = 0
+            self._timeout = self.reset
+
+    def record_failure(self):
+        with self._lock:
+            self._count += 1
+            if self.state == "half_open":
+                self._timeout = min(self._timeout * 2, self.reset_max)
+            elif self.state == "open" or self._count < self.failures:
+                return
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            METRICS.inc("pipeline_db_breaker_open_total")
+            logger.error(f"Database unreachable, circuit breaker open for {self._timeout:g}s")
+
+
+DB_BREAKER = CircuitBreaker()
+
+def _count_retry(retry_state):
+    METRICS.inc("pipeline_db_retries_total", func=retry_state.fn.__name__)
+    logger.warning(
+        f"Retrying {retry_state.fn.__name__} after attempt {retry_state.attempt_number}: "
+        f"{retry_state.outcome.exception()}"
+    )
+
+# Only connection-level failures are worth retrying; data errors fail fast
+# (and are raised as-is) so callers can isolate the offending file.
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+# Errors that say nothing about the data: the database (or the pool) is unavailable
+DATABASE_DOWN = CONNECTION_ERRORS + (pool.PoolError,)
+
+def _stop_retrying(retry_state):
+    # An open breaker ends the retries early, so callers can spool instead of blocking
+    return stop_after_attempt(5)(retry_state) or DB_BREAKER.is_open()
+
+db_retry = retry(
+    retry=retry_if_exception_type(CONNECTION_ERRORS),
+    stop=_stop_retrying,
+    wait=wait_exponential(multiplier=1, min=2, max=30),
+    reraise=True,
+    after=lambda retry_state: DB_BREAKER.record_failure(),
+    before_sleep=_count_retry,
+)
+
 def get_connection():
     """
-    Establish a connection to PostgreSQL using psycopg2.
+    Establish a new, unpooled connection to PostgreSQL using psycopg2.
     """
     return psycopg2.connect(**DB_CONFIG)
 
-@retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=1, min=2, max=30))
+def get_pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = pool.ThreadedConnectionPool(POOL_MIN_SIZE, POOL_MAX_SIZE, **DB_CONFIG)
+            logger.info(f"Created DB connection pool (min={POOL_MIN_SIZE}, max={POOL_MAX_SIZE})")
+        return _pool
+
+def _is_healthy(conn):
+    """Checks a pooled connection before it is handed out."""
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < POOL_CHECK_IDLE:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+@contextmanager
+def db_connection():
+    """
+    Check out a pooled connection for the duration of a with-block.
+
+    Blocks while the pool is exhausted (up to DB_POOL_TIMEOUT seconds).
+    Broken connections are replaced on checkout. Uncommitted work is
+    rolled back when the block exits, and the connection goes back to the pool.
+    """
+    if not _pool_slots.acquire(timeout=POOL_TIMEOUT):
+        raise pool.PoolError(f"No DB connection available after {POOL_TIMEOUT}s")
+    conn = None
+    try:
+        db_pool = get_pool()
+        conn = db_pool.getconn()
+        if not _is_healthy(conn):
+            logger.warning("Discarding broken pooled DB connection")
+            db_pool.putconn(conn, close=True)
+            _last_used.pop(id(conn), None)
+            conn = db_pool.getconn()
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+    finally:
+        if conn is not None:
+            if conn.closed:
+                _last_used.pop(id(conn), None)
+            else:
+                _last_used[id(conn)] = time.monotonic()
+            get_pool().putconn(conn, close=bool(conn.closed))
+        _pool_slots.release()
+
+def close_pool():
+    """Closes every pooled connection (call on shutdown)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _last_used.clear()
+
+@db_retry
 def safe_execute_values(cur, sql, rows, template=None):
     """
     Execute a batch insert with retry logic.
@@ -30,3 +209,56 @@ def safe_execute_values(cur, sql, rows, template=None):
     logger.info(f"Inserted {len(rows)} rows (retry-safe).")
 
 
+@db_retry
+def safe_copy_expert(cur, sql, buffer):
+    """
+    Stream a buffer into Postgres with COPY ... FROM STDIN, with retry logic.
+    The buffer is rewound before every attempt.
+    """
+    buffer.seek(0)
+    cur.copy_expert(sql, buffer)
+    logger.info(f"Copied {cur.rowcount} rows (retry-safe).")
+
+
+def copy_dataframe(cur, table, df, columns):
+    """
+    Bulk load DataFrame columns into a table with COPY ... FROM STDIN (CSV format).
+
+    NaN/None become NULL, booleans are written as True/False and datetime
+    columns in ISO format, which Postgres parses natively.
+
+    Returns:
+        int: Number of rows sent.
+    """
+    buffer = io.StringIO()
+    df[columns].to_csv(buffer, index=False, header=False)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    safe_copy_expert(cur, sql, buffer)
+    return len(df)
+
+
+def session_timezone(cur):
+    """Returns the session TimeZone, falling back to UTC if pandas cannot use it."""
+    cur.execute("SHOW TIME ZONE")
+    tz = cur.fetchone()[0]
+    try:
+        pd.Timestamp(0, tz=tz)
+    except Exception:
+        logger.warning(f"Unknown session time zone {tz!r}, converting timestamps as UTC")
+        tz = "UTC"
+    return tz
+
+
+def epoch_to_timestamp(epochs, tz="UTC"):
+    """
+    Convert epoch seconds to naive timestamps in the given time zone, matching
+    what TO_TIMESTAMP(epoch) stores in a TIMESTAMP column for that session
+    (rounded to microseconds).
+    """
+    ts = pd.to_datetime(epochs, unit="s", utc=True).dt.round("us")
+    return ts.dt.tz_convert(tz).dt.tz_localize(None)
+
+
+def utc_to_session(ts, tz="UTC"):
+    """Naive UTC timestamps (as transform_df produces) -> naive timestamps in the given time zone."""
+    return ts.dt.tz_localize("UTC").dt.tz_convert(tz).dt.tz_localize(None)
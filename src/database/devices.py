@@ -0,0 +1,74 @@
+import threading
+import pandas as pd
+from loguru import logger
+
+from src.database.db_utils import db_connection, db_retry
+
+DEVICE_TABLE = "raw.devices"
+
+
+class DeviceRegistry:
+    """
+    Cached mapping from device ids (MAC-like strings) to small integer keys.
+
+    The whole raw.devices table is read on first use. Devices that are not
+    cached yet are inserted once (ON CONFLICT DO NOTHING, so concurrent
+    workers agree on the key) in their own committed transaction. A key is
+    therefore never cached for a row that a later rollback could remove.
+    """
+
+    def __init__(self, table=DEVICE_TABLE):
+        self.table = table
+        self._keys = None
+        self._lock = threading.Lock()
+
+    @db_retry
+    def _fetch(self, device_ids=None):
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                if device_ids:
+                    cur.execute(
+                        f"INSERT INTO {self.table} (device_id) SELECT unnest(%s::text[]) "
+                        f"ON CONFLICT (device_id) DO NOTHING",
+                        (device_ids,),
+                    )
+                    cur.execute(f"SELECT device_id, device_key FROM {self.table} WHERE device_id = ANY(%s)",
+                                (device_ids,))
+                else:
+                    cur.execute(f"SELECT device_id, device_key FROM {self.table}")
+                rows = cur.fetchall()
+            conn.commit()
+        return dict(rows)
+
+    def resolve(self, device_ids):
+        """
+        Makes sure every device id has a key, inserting unknown devices.
+
+        Args:
+            device_ids: Iterable of device ids (duplicates and missing values are ignored).
+
+        Returns:
+            dict: device_id -> device_key for the given ids.
+        """
+        wanted = {str(d) for d in device_ids if pd.notna(d)}
+        with self._lock:
+            if self._keys is None:
+                self._keys = self._fetch()
+            missing = sorted(wanted - self._keys.keys())
+            if missing:
+                self._keys.update(self._fetch(missing))
+                logger.info(f"Registered {len(missing)} new device(s) in {self.table}")
+            return {d: self._keys[d] for d in wanted}
+
+    def keys(self, devices):
+        """Maps a Series of device ids to their int16 keys (a categorical only maps its categories)."""
+        lookup = self.resolve(devices.unique())
+        return devices.map(lookup).astype("int16")
+
+    def clear(self):
+        """Drops the cache (e.g. after the devices table was rebuilt)."""
+        with self._lock:
+            self._keys = None
+
+
+DEVICES = DeviceRegistry()
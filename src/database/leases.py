@@ -0,0 +1,133 @@
+import os
+import socket
+import threading
+from loguru import logger
+
+from src.database.db_utils import db_connection, db_retry, DB_BREAKER, DATABASE_DOWN
+from src.pipeline.ledger import DONE_STAGES
+
+LEASE_TABLE = "raw.file_leases"
+
+# "1" claims every file in the shared lease table, so several watchers
+# (processes or hosts) can share one incoming directory
+LEASING = os.getenv("PIPELINE_LEASES", "0") == "1"
+# Name of this watcher in the lease table
+WORKER_ID = os.getenv("PIPELINE_WORKER_ID", f"{socket.gethostname()}:{os.getpid()}")
+# Seconds a lease is valid without a heartbeat; a dead worker's files are
+# taken over by others after this long
+LEASE_TTL = float(os.getenv("PIPELINE_LEASE_TTL", "60"))
+
+
+class LeaseManager:
+    """
+    Claims incoming files across watchers through a lease table in Postgres.
+
+    A file is keyed by its content hash. acquire() is a single
+    INSERT ... ON CONFLICT DO UPDATE that only succeeds when nobody holds a
+    live lease and the content was not loaded yet, so exactly one worker
+    gets each file. A heartbeat thread extends the leases this worker holds;
+    when a worker dies its leases run out and another worker takes the file
+    over on its next scan. A finished file keeps its row with the final
+    stage, so other watchers skip it.
+    """
+
+    def __init__(self, table=LEASE_TABLE, worker_id=WORKER_ID, ttl=LEASE_TTL, breaker=DB_BREAKER):
+        self.table = table
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.breaker = breaker
+        self._stop = threading.Event()
+        self._thread = None
+
+    @db_retry
+    def _execute(self, sql, params):
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                rows = cur.fetchall() if cur.description else cur.rowcount
+            conn.commit()
+        return rows
+
+    def acquire(self, content_hash, file_name, size, mtime):
+        """
+        Takes the lease on a file's content.
+
+        Returns:
+            bool: True if this worker now owns the file. False if another
+            worker holds a live lease, the content is already loaded, or the
+            database is unreachable (the file is then retried on a later scan).
+        """
+        if not self.breaker.allow():
+            return False
+        try:
+            rows = self._execute(
+                f"""
+                INSERT INTO {self.table} AS l (content_hash, file_name, size, mtime, worker_id, stage, lease_until)
+                VALUES (%s, %s, %s, %s, %s, 'leased', now() + %s * interval '1 second')
+                ON CONFLICT (content_hash) DO UPDATE
+                SET worker_id = EXCLUDED.worker_id, stage = 'leased', lease_until = EXCLUDED.lease_until,
+                    attempts = l.attempts + 1, file_name = EXCLUDED.file_name,
+                    size = EXCLUDED.size, mtime = EXCLUDED.mtime
+                WHERE l.stage <> ALL(%s) AND l.lease_until < now()
+                RETURNING attempts
+                """,
+                (content_hash, file_name, size, mtime, self.worker_id, self.ttl, list(DONE_STAGES)),
+            )
+        except DATABASE_DOWN as e:
+            logger.warning(f"Cannot lease {file_name}, database unavailable: {e}")
+            return False
+        if rows and rows[0][0] > 1:
+            logger.info(f"Took over {file_name} from an expired lease (attempt {rows[0][0]})")
+        return bool(rows)
+
+    def release(self, content_hash, stage):
+        """
+        Records the stage a leased file reached. Done stages keep the file
+        from being processed again; any other stage frees it at once.
+        """
+        try:
+            updated = self._execute(
+                f"UPDATE {self.table} SET stage = %s, lease_until = now(), finished_at = now() "
+                f"WHERE content_hash = %s AND worker_id = %s",
+                (stage, content_hash, self.worker_id),
+            )
+        except DATABASE_DOWN as e:
+            # The lease runs out on its own; the local ledger still has the stage
+            logger.warning(f"Could not release lease {content_hash[:12]}: {e}")
+            return
+        if not updated:
+            logger.warning(f"Lease on {content_hash[:12]} was lost before it was released")
+
+    def finished(self):
+        """(file_name, size, mtime) of every file any worker has finished."""
+        rows = self._execute(
+            f"SELECT file_name, size, mtime FROM {self.table} WHERE stage = ANY(%s)",
+            (list(DONE_STAGES),),
+        )
+        return {(name, size, mtime) for name, size, mtime in rows}
+
+    # Heartbeat
+
+    def start(self):
+        self._thread = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+        return self
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                self._execute(
+                    f"UPDATE {self.table} SET lease_until = now() + %s * interval '1 second' "
+                    f"WHERE worker_id = %s AND stage = 'leased'",
+                    (self.ttl, self.worker_id),
+                )
+            except Exception as e:
+                logger.error(f"Lease heartbeat failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+LEASES = LeaseManager() if LEASING else None
@@ -1,62 +1,123 @@
 import pandas as pd
 from pathlib import Path
+from loguru import logger
 from psycopg2.extras import execute_values
-from src.database.db_utils import get_connection, safe_execute_values
+from src.database.db_utils import db_connection, safe_execute_values, copy_dataframe
+from src.database.load_raw_data import LOAD_METHOD
+from src.pipeline.storage import read_frame, list_outputs
+from src.pipeline.metrics import stage
+from src.pipeline.schema import AGGREGATE_DTYPES
+from src.database.devices import DEVICES
 
 
 AGG_DIR = Path(__file__).resolve().parent.parent.parent / "aggregated_data"
+AGG_TABLE = "analytics.aggregated_sensor_data"
+# Natural key of an aggregate row; loading a file again replaces its rows
+AGG_KEY = ["file_name", "device_key"]
 
 def load_aggregated_file(csv_path: Path):
-    """Loads a single aggregated data CSV file into the database."""
-    try:
-        df = pd.read_csv(csv_path)
+    """Loads a single aggregated data file (CSV or Parquet) into the database."""
+    load_aggregated_df(read_frame(csv_path, dtypes=AGGREGATE_DTYPES), csv_path)
+
+def _prepare_aggregates(df: pd.DataFrame):
+    """Names the metadata columns, parses processed_at and swaps device_id for its key."""
+    df = df.rename(columns={df.columns[0]: "file_name", df.columns[1]: "processed_at"})
+
+    # Ensure processed_at is a proper datetime object
+    df["processed_at"] = pd.to_datetime(df["processed_at"], errors="coerce")
+
+    df.insert(2, "device_key", DEVICES.keys(df["device_id"]))
+    return df.drop(columns="device_id")
+
+def insert_aggregates(cur, df: pd.DataFrame, method=None, table=AGG_TABLE):
+    """Inserts prepared aggregate rows on an open cursor (no commit)."""
+    method = method or LOAD_METHOD
 
-        
-        df = df.rename(columns={df.columns[0]: "file_name", df.columns[1]: "processed_at"})
+    # The columns to insert into the database
+    # This list must match the columns in your database table exactly
+    cols = list(df.columns)
 
-        # Ensure processed_at is a proper datetime object
-        df["processed_at"] = pd.to_datetime(df["processed_at"], errors="coerce")
+    if method == "copy":
+        # COPY streams the frame as CSV; NaN is written as NULL
+        return copy_dataframe(cur, table, df, cols)
 
-        # Ensure NaN values are converted to None for database insertion
-        df = df.where(pd.notnull(df), None)
+    # Ensure NaN values are converted to None for database insertion
+    df = df.astype(object).where(pd.notnull(df), None)
 
-        # The columns to insert into the database
-        # This list must match the columns in your database table exactly
-        cols = list(df.columns)
-        
-        # Prepare rows as tuples for bulk insertion
-        
-        rows = [tuple(row) for row in df[cols].values.tolist()]
+    # Prepare rows as tuples for bulk insertion
+    rows = [tuple(row) for row in df[cols].values.tolist()]
 
-        conn = get_connection()
-        cur = conn.cursor()
+    # Construct the SQL INSERT statement with dynamic columns
+    sql = f"""
+        INSERT INTO {table} ({", ".join(cols)})
+        VALUES %s
+    """
 
-        # Construct the SQL INSERT statement with dynamic columns
-        sql = f"""
-            INSERT INTO analytics.aggregated_sensor_data ({", ".join(cols)})
-            VALUES %s
-        """
-        
-        # Use execute_values for efficient bulk insertion
-        safe_execute_values(cur, sql, rows) 
+    # Use execute_values for efficient bulk insertion
+    safe_execute_values(cur, sql, rows)
+    return len(rows)
 
-        conn.commit()
-        print(f"[SUCCESS] Inserted {len(rows)} aggregate rows from {csv_path}")
+def merge_aggregates(cur, df: pd.DataFrame, method=None, table=AGG_TABLE):
+    """
+    Bulk loads prepared aggregate rows into a temp staging table and merges
+    them on (file_name, device_key): rows of a file loaded again replace the
+    stored ones instead of being added next to them (no commit).
+
+    Returns:
+        int: Aggregate rows merged.
+    """
+    staging = f"tmp_{table.split('.')[-1]}"
+    cols = list(df.columns)
+    cur.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DELETE ROWS AS "
+        f"SELECT {', '.join(cols)} FROM {table} WITH NO DATA"
+    )
+    cur.execute(f"TRUNCATE {staging}")
+    insert_aggregates(cur, df, method, staging)
+    updates = [f"{col} = EXCLUDED.{col}" for col in cols if col not in AGG_KEY] + ["inserted_at = now()"]
+    # One row per key (the latest), as ON CONFLICT DO UPDATE may touch a row only once
+    cur.execute(
+        f"INSERT INTO {table} ({', '.join(cols)}) "
+        f"SELECT DISTINCT ON ({', '.join(AGG_KEY)}) {', '.join(cols)} FROM {staging} "
+        f"ORDER BY {', '.join(AGG_KEY)}, processed_at DESC "
+        f"ON CONFLICT ({', '.join(AGG_KEY)}) DO UPDATE SET {', '.join(updates)}"
+    )
+    return cur.rowcount
+
+def load_aggregated_batch(cur, frames, method=None):
+    """Merges the aggregates of several files in one bulk statement (no commit)."""
+    frames = [_prepare_aggregates(df) for df in frames if df is not None and not df.empty]
+    if not frames:
+        return 0
+    return merge_aggregates(cur, pd.concat(frames, ignore_index=True), method)
+
+@stage("load_aggregated")
+def load_aggregated_df(df: pd.DataFrame, source, method=None):
+    """Loads an aggregates DataFrame (as built by aggregate_df) into the database."""
+    try:
+        df = _prepare_aggregates(df)
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                inserted = merge_aggregates(cur, df, method)
+            conn.commit()
+        logger.info(f"Merged {inserted} aggregate rows from {source}")
 
     except Exception as e:
-        conn.rollback()
-        print(f"[ERROR] Failed to insert data from {csv_path}: {e}")
-    finally:
-        cur.close()
-        conn.close()
+        # db_connection() has already rolled back and returned the connection
+        logger.error(f"Failed to insert data from {source}: {e}")
+        raise
 
 if __name__ == "__main__":
     if not AGG_DIR.is_dir():
-        print(f"[WARNING] Directory not found: {AGG_DIR}. Please check the path.")
+        logger.warning(f"Directory not found: {AGG_DIR}. Please check the path.")
     
-    csv_files = list(AGG_DIR.glob("*.csv"))
+    csv_files = list_outputs(AGG_DIR)
     if not csv_files:
-        print(f"[WARNING] No CSV files found in directory: {AGG_DIR}")
+        logger.warning(f"No aggregate files found in directory: {AGG_DIR}")
 
     for csv_file in csv_files:
-        load_aggregated_file(csv_file)
+        try:
+            load_aggregated_file(csv_file)
+        except Exception:
+            # Already logged by load_aggregated_df; carry on with the other files
+            continue
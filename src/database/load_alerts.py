@@ -0,0 +1,19 @@
+import pandas as pd
+
+from src.database.db_utils import copy_dataframe, session_timezone, utc_to_session
+from src.database.devices import DEVICES
+
+ALERT_TABLE = "analytics.sensor_alerts"
+ALERT_COLUMNS = ["ts", "device_key", "sensor", "value", "expected", "std", "z_score", "file_name"]
+
+
+def insert_alerts(cur, df: pd.DataFrame, source):
+    """Inserts readings flagged by the anomaly detector on an open cursor (no commit)."""
+    if df is None or df.empty:
+        return 0
+    df = df.assign(
+        ts=utc_to_session(pd.to_datetime(df["ts"]), session_timezone(cur)),
+        device_key=DEVICES.keys(df["device_id"]),
+        file_name=source,
+    )
+    return copy_dataframe(cur, ALERT_TABLE, df, ALERT_COLUMNS)
@@ -1,95 +1,282 @@
 # src/database/load_raw_data.py
 
+import os
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from loguru import logger
 from psycopg2.extras import execute_values
-from src.database.db_utils import get_connection, safe_execute_values
+from src.pipeline.metrics import METRICS, stage
+from src.pipeline import schema
+from src.database.devices import DEVICES
+from src.database.partitions import PARTITIONS
+from src.database.db_utils import (
+    db_connection,
+    safe_execute_values,
+    copy_dataframe,
+    session_timezone,
+    epoch_to_timestamp,
+)
 
 # project root = two levels up from this file (src/database/)
 BASE_DIR = Path(__file__).resolve().parents[2]
 INCOMING_DIR = BASE_DIR / "incoming"
 
-BOOL_MAP = {"TRUE": True, "FALSE": False, "1": True, "0": False}
+BOOL_MAP = schema.BOOL_VALUES
 
-def _to_bool(val):
-    if pd.isna(val):
-        return None
-    s = str(val).strip().upper()
-    return BOOL_MAP.get(s, None)
+RAW_TABLE = "raw.raw_sensor_data"
+RAW_COLUMNS = ["ts", "device_key", "co", "humidity", "light", "lpg", "motion", "smoke", "temp", "file_name"]
+# Natural key of a reading; a row whose key is already stored is a duplicate
+RAW_KEY = ["device_key", "ts"]
+
+# "copy": COPY ... FROM STDIN with timestamps converted client side
+# "values": legacy execute_values with a TO_TIMESTAMP(%s) template
+LOAD_METHOD = os.getenv("DB_LOAD_METHOD", "copy")
+
+def _to_bool_series(col):
+    """Maps TRUE/FALSE/1/0 (any case); unknown and missing values become None."""
+    mapped = col.astype(str).str.strip().str.upper().map(BOOL_MAP)
+    return mapped.astype(object).where(mapped.notna(), None)
 
 def load_raw_file(file_path: Path):
-    print(f"[INFO] Loading raw data from {file_path}")
+    logger.info(f"Loading raw data from {file_path}")
+
+    # Same column types and NA tokens as every other stage
+    df = schema.read_csv(file_path)
+
+    load_raw_df(df, file_path.name)
+
+def prepare_raw_frame(df: pd.DataFrame, file_name: str):
+    """
+    Builds the rows for raw.raw_sensor_data from a parsed incoming DataFrame.
 
-    # Read CSV; treat these as missing
-    df = pd.read_csv(file_path, na_values=["N/A", "", "null", "NULL"])
+    Device ids are replaced by their raw.devices keys; unknown devices are
+    registered on the way, as are missing ts partitions of the raw table.
 
+    Returns:
+        tuple: (frame, skipped_no_ts, skipped_no_device). The frame keeps the
+        epoch seconds in ts_epoch; the insert path decides how to convert them.
+    """
     # Ensure expected columns exist
-    expected = ["ts", "device", "co", "humidity", "light", "lpg", "motion", "smoke", "temp"]
-    missing = [c for c in expected if c not in df.columns]
+    missing = [c for c in schema.COLUMNS if c not in df.columns]
     if missing:
-        raise ValueError(f"Missing columns in {file_path.name}: {missing}")
+        raise ValueError(f"Missing columns in {file_name}: {missing}")
 
-    # Attach file lineage
-    df["file_name"] = file_path.name
+    out = pd.DataFrame(index=df.index)
+
+    # Parse epoch seconds as numeric; the fraction is kept, as (device_key, ts) identifies a reading
+    ts_epoch = pd.to_numeric(df["ts"], errors="coerce")
+    # Epochs outside the accepted range count as invalid; they never reach partition DDL
+    has_ts = schema.ts_in_window(ts_epoch.to_numpy(dtype="float64", na_value=np.nan))
+    has_device = df["device"].notna().to_numpy()
+    keep = has_ts & has_device
+    skipped_no_ts = int((~has_ts).sum())
+    skipped_no_device = int((has_ts & ~has_device).sum())
 
-    # Parse epoch seconds as numeric (keep as numbers, do NOT convert to datetime here)
-    df["ts_epoch"] = pd.to_numeric(df["ts"], errors="coerce")
+    out["ts_epoch"] = ts_epoch.to_numpy(dtype="float64", na_value=np.nan)
+    out["device_id"] = df["device"]
 
     # Numeric columns (keep raw — no rounding)
-    for col in ["co", "humidity", "lpg", "smoke", "temp"]:
-        df[col] = pd.to_numeric(df[col], errors="coerce")
+    for col in schema.SENSOR_COLS:
+        out[col] = pd.to_numeric(df[col], errors="coerce")
 
     # Booleans
-    df["light"] = df["light"].apply(_to_bool)
-    df["motion"] = df["motion"].apply(_to_bool)
-
-    # Prepare rows;to convert epoch to plain Python int for TO_TIMESTAMP(%s)
-    rows = []
-    skipped_no_ts = 0
-    for _, r in df.iterrows():
-        ts_val = r["ts_epoch"]
-        if pd.isna(ts_val):
-            
-            skipped_no_ts += 1
-            continue
-        try:
-            # handle scientific notation / floats safely
-            ts_int = int(float(ts_val))
-        except Exception:
-            skipped_no_ts += 1
-            continue
-
-        rows.append((
-            ts_int,                # TO_TIMESTAMP(%s)
-            r["device"],           # device_id
-            r["co"],
-            r["humidity"],
-            r["light"],
-            r["lpg"],
-            r["motion"],
-            r["smoke"],
-            r["temp"],
-            r["file_name"]
-        ))
-
-    if not rows:
-        print(f"[WARN] No rows to insert from {file_path} (invalid/missing ts?). Skipped: {skipped_no_ts}")
-        return
+    out["light"] = _to_bool_series(df["light"])
+    out["motion"] = _to_bool_series(df["motion"])
+
+    # Attach file lineage
+    out["file_name"] = file_name
+
+    out = out[keep]
+    out["device_key"] = DEVICES.keys(out["device_id"])
+    if PARTITIONS is not None:
+        PARTITIONS.ensure_epochs(out["ts_epoch"])
+    return out, skipped_no_ts, skipped_no_device
+
+def register_targets(df: pd.DataFrame):
+    """
+    Registers the devices and ts partitions an incoming DataFrame needs.
+
+    Callers that already hold a connection run this first, so the
+    registries never need a second connection in the middle of a load.
+    """
+    DEVICES.resolve(df["device"].unique())
+    if PARTITIONS is not None:
+        PARTITIONS.ensure_epochs(pd.to_numeric(df["ts"], errors="coerce"))
+
+def raw_indexes(cur, table=RAW_TABLE):
+    """
+    (name, CREATE INDEX statement) of every index defined on the raw table
+    itself, except those backing a primary key or unique constraint.
+    """
+    schema_name, table_name = table.split(".")
+    cur.execute(
+        "SELECT i.indexname, i.indexdef FROM pg_indexes i "
+        "WHERE i.schemaname = %s AND i.tablename = %s AND NOT EXISTS ("
+        "SELECT 1 FROM pg_constraint c WHERE c.conindid = format('%%I.%%I', i.schemaname, i.indexname)::regclass) "
+        "ORDER BY i.indexname",
+        (schema_name, table_name),
+    )
+    return cur.fetchall()
+
+def drop_raw_indexes(cur, table=RAW_TABLE):
+    """
+    Drops the raw table's indexes (on a partitioned table this removes them
+    from every partition) and returns their definitions for rebuild_raw_indexes.
+    """
+    schema_name = table.split(".")[0]
+    indexes = raw_indexes(cur, table)
+    for name, _ in indexes:
+        cur.execute(f"DROP INDEX IF EXISTS {schema_name}.{name}")
+    return indexes
+
+def rebuild_raw_indexes(cur, indexes, table=RAW_TABLE):
+    """Recreates dropped indexes that do not exist (again); returns their names."""
+    existing = {name for name, _ in raw_indexes(cur, table)}
+    rebuilt = []
+    for name, definition in indexes:
+        if name not in existing:
+            cur.execute(definition)
+            rebuilt.append(name)
+    return rebuilt
 
-    insert_sql = """
-        INSERT INTO raw.raw_sensor_data
-        (ts, device_id, co, humidity, light, lpg, motion, smoke, temp, file_name)
+def insert_raw_values(cur, frame: pd.DataFrame, table=RAW_TABLE, columns=RAW_COLUMNS):
+    """Legacy path: execute_values with the timestamp converted inside Postgres."""
+    insert_sql = f"""
+        INSERT INTO {table}
+        ({', '.join(columns)})
         VALUES %s
     """
     # Use a template so ts is converted inside Postgres
-    tpl = "(TO_TIMESTAMP(%s), %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+    tpl = "(TO_TIMESTAMP(%s), " + ", ".join(["%s"] * (len(columns) - 1)) + ")"
+    cols = ["ts_epoch"] + columns[1:]
+    rows = [tuple(row) for row in frame[cols].astype(object).where(frame[cols].notna(), None).values.tolist()]
+    safe_execute_values(cur, insert_sql, rows, template=tpl)
+    return len(rows)
+
+def copy_raw_rows(cur, frame: pd.DataFrame, table=RAW_TABLE, columns=RAW_COLUMNS):
+    """COPY path: timestamps are converted client side in the session time zone."""
+    if "ts" not in frame.columns:
+        frame = frame.assign(ts=epoch_to_timestamp(frame["ts_epoch"], session_timezone(cur)))
+    return copy_dataframe(cur, table, frame, columns)
+
+def _staging_table(cur, table=RAW_TABLE):
+    """
+    Session temp table with the raw load columns plus row_idx (the row's
+    index in its source frame), emptied on every commit.
+    """
+    staging = f"tmp_{table.split('.')[-1]}"
+    cur.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DELETE ROWS AS "
+        f"SELECT {', '.join(RAW_COLUMNS)}, NULL::bigint AS row_idx FROM {table} WITH NO DATA"
+    )
+    return staging
+
+def merge_raw_rows(cur, frame: pd.DataFrame, method=None, table=RAW_TABLE):
+    """
+    Bulk loads prepared raw rows into a temp staging table and merges them
+    into the raw table, skipping readings whose (device_key, ts) is stored.
+
+    Loading a file again, or replaying a write after a crash, therefore adds
+    nothing. Duplicates within the frame itself are kept once. The rows that
+    were skipped are reported by their index in the source frame (the
+    row_idx column when there is one, as load_raw_batch sets it), so callers
+    can derive rollups, sketches, alerts and windows from the inserted rows
+    only.
+
+    Returns:
+        dict: {file_name: {"new": rows inserted, "duplicates": rows skipped,
+        "duplicate_index": source frame index of the skipped rows}}.
+    """
+    method = method or LOAD_METHOD
+    if "row_idx" not in frame.columns:
+        frame = frame.assign(row_idx=frame.index)
+    # The key as it is stored, so readings that collide only after the conversion count as duplicates too
+    frame = frame.assign(ts=epoch_to_timestamp(frame["ts_epoch"], session_timezone(cur)))
+    repeated = frame.duplicated(RAW_KEY)
+    staging = _staging_table(cur, table)
+    cur.execute(f"TRUNCATE {staging}")
+    if method == "copy":
+        copy_raw_rows(cur, frame[~repeated], staging, RAW_COLUMNS + ["row_idx"])
+    else:
+        insert_raw_values(cur, frame[~repeated], staging, RAW_COLUMNS + ["row_idx"])
+    cols = ", ".join(RAW_COLUMNS)
+    key = ", ".join(RAW_KEY)
+    # Key order, so concurrent merges lock index entries in the same order. Only the
+    # staged rows that were not inserted come back, which is none on a fresh load.
+    cur.execute(
+        f"WITH merged AS ("
+        f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {staging} ORDER BY {key} "
+        f"ON CONFLICT ({key}) DO NOTHING RETURNING {key}) "
+        f"SELECT s.file_name, s.row_idx FROM {staging} s "
+        f"WHERE NOT EXISTS (SELECT 1 FROM merged m WHERE m.device_key = s.device_key AND m.ts = s.ts)"
+    )
+    skipped = {}
+    for file_name, row_idx in cur.fetchall():
+        skipped.setdefault(file_name, []).append(row_idx)
+    for file_name, row_idx in frame.loc[repeated, ["file_name", "row_idx"]].itertuples(index=False):
+        skipped.setdefault(file_name, []).append(row_idx)
+
+    counts = {}
+    for file_name, sent in frame.groupby("file_name", sort=False).size().items():
+        duplicate_index = skipped.get(file_name, [])
+        counts[file_name] = {"new": int(sent) - len(duplicate_index), "duplicates": len(duplicate_index),
+                             "duplicate_index": duplicate_index}
+    new = sum(c["new"] for c in counts.values())
+    METRICS.inc("pipeline_raw_rows_total", new, outcome="new")
+    METRICS.inc("pipeline_raw_rows_total", len(frame) - new, outcome="duplicate")
+    return counts
+
+def load_raw_batch(cur, items, method=None):
+    """
+    Loads several parsed raw frames with one bulk merge on an open cursor.
+
+    The caller owns the transaction (nothing is committed here).
+
+    Args:
+        cur: psycopg2 cursor.
+        items (list): (DataFrame, file_name) pairs; file_name is kept per row.
+
+    Returns:
+        dict: {file_name: {"new": n, "duplicates": n, "duplicate_index": [...]}}
+        for every file with rows to load (see merge_raw_rows).
+    """
+    frames = []
+    skipped = {}
+    for df, file_name in items:
+        frame, skipped_no_ts, skipped_no_device = prepare_raw_frame(df, file_name)
+        skipped[file_name] = (skipped_no_ts, skipped_no_device)
+        # The index is unique per file only; row_idx keeps it through the concat
+        frames.append(frame.assign(row_idx=frame.index))
+    frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if frame.empty:
+        return {}
+    counts = merge_raw_rows(cur, frame, method)
+    for file_name, c in counts.items():
+        skipped_no_ts, skipped_no_device = skipped[file_name]
+        logger.info(f"Merged {c['new']} new rows from {file_name}, {c['duplicates']} duplicates. "
+                    f"Skipped (no/invalid ts): {skipped_no_ts}, (no device): {skipped_no_device}")
+    return counts
+
+@stage("load_raw")
+def load_raw_df(df: pd.DataFrame, file_name: str, method=None):
+    """Loads an already parsed raw DataFrame into raw.raw_sensor_data."""
+    method = method or LOAD_METHOD
+    frame, skipped_no_ts, skipped_no_device = prepare_raw_frame(df, file_name)
+
+    if frame.empty:
+        logger.warning(f"No rows to insert from {file_name} (invalid/missing ts?). Skipped: {skipped_no_ts}")
+        return
 
-    with get_connection() as conn:
+    with db_connection() as conn:
         with conn.cursor() as cur:
-            safe_execute_values(cur, insert_sql, rows, template=tpl)
+            counts = merge_raw_rows(cur, frame, method)[file_name]
         conn.commit()
 
-    print(f"[SUCCESS] Inserted {len(rows)} rows from {file_path}. Skipped (no/invalid ts): {skipped_no_ts}")
+    logger.info(
+        f"Inserted {counts['new']} rows from {file_name}, {counts['duplicates']} duplicates. "
+        f"Skipped (no/invalid ts): {skipped_no_ts}, (no device): {skipped_no_device}"
+    )
 
 if __name__ == "__main__":
     any_loaded = False
@@ -98,6 +285,6 @@ if __name__ == "__main__":
         try:
             load_raw_file(csv_file)
         except Exception as e:
-            print(f"[ERROR] Failed to load {csv_file.name}: {e}")
+            logger.error(f"Failed to load {csv_file.name}: {e}")
     if not any_loaded:
-        print(f"[INFO] No CSV files found in {INCOMING_DIR}")
+        logger.info(f"No CSV files found in {INCOMING_DIR}")
@@ -0,0 +1,100 @@
+import pandas as pd
+
+from src.database.db_utils import copy_dataframe, session_timezone, utc_to_session
+from src.database.devices import DEVICES
+from src.pipeline.aggregation import NUMERIC_COLS, merge_stats
+
+# Bucket size -> rollup table
+ROLLUP_TABLES = {
+    "hour": "analytics.sensor_rollup_hourly",
+    "day": "analytics.sensor_rollup_daily",
+}
+KEY_COLUMNS = ["device_key", "bucket_start"]
+# Statistics stored per sensor; count and the sums merge by plain addition in the upsert
+STAT_FIELDS = ["count", "sum", "sumsq", "min", "max"]
+STAT_COLUMNS = [f"{col}_{field}" for col in NUMERIC_COLS for field in STAT_FIELDS]
+
+
+def _combine(field):
+    """How an upsert folds a new value into the stored one."""
+    return {"min": "LEAST({t}.{c}, EXCLUDED.{c})", "max": "GREATEST({t}.{c}, EXCLUDED.{c})"}.get(
+        field, "{t}.{c} + EXCLUDED.{c}"
+    )
+
+
+def _to_sums(stats):
+    """count/mean/M2 statistics (see partial_stats) -> the sum and sum of squares the tables store."""
+    stats = stats.copy()
+    for col in NUMERIC_COLS:
+        n = stats[f"{col}_count"]
+        mean = stats[f"{col}_mean"].where(n > 0, 0.0)
+        stats[f"{col}_sum"] = n * mean
+        stats[f"{col}_sumsq"] = stats[f"{col}_m2"].fillna(0) + n * mean ** 2
+    return stats
+
+
+def _prepare_rollups(stats, tz):
+    """
+    Turns rollup_stats frames (UTC hours) into hourly and daily rows keyed by
+    device_key and bucket_start in the session time zone, like raw ts values.
+    """
+    stats = _to_sums(stats).reset_index()
+    stats["bucket"] = utc_to_session(stats["bucket"], tz)
+    stats["device_key"] = DEVICES.keys(stats["device_id"])
+    how = {f"{col}_{field}": ("sum" if field in ("count", "sum", "sumsq") else field)
+           for col in NUMERIC_COLS for field in STAT_FIELDS}
+    how["rows"] = "sum"
+
+    frames = {}
+    for size in ROLLUP_TABLES:
+        bucket = stats["bucket"] if size == "hour" else stats["bucket"].dt.floor("D")
+        rolled = stats.groupby([stats["device_key"], bucket.rename("bucket_start")]).agg(how)
+        rolled = rolled.rename(columns={"rows": "row_count"}).reset_index()
+        # Key order, so concurrent upserts lock rows in the same order
+        frames[size] = rolled.sort_values(KEY_COLUMNS)[KEY_COLUMNS + ["row_count"] + STAT_COLUMNS]
+    return frames
+
+
+def _upsert(cur, table, df):
+    """COPYs rows into a temp table and adds them to the stored buckets."""
+    staging = f"tmp_{table.split('.')[-1]}"
+    cur.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    )
+    # Several upserts can share a transaction (batched spool writes, backfill shards)
+    cur.execute(f"TRUNCATE {staging}")
+    cols = list(df.columns)
+    copy_dataframe(cur, staging, df, cols)
+    updates = ["row_count = t.row_count + EXCLUDED.row_count", "updated_at = now()"] + [
+        f"{col}_{field} = " + _combine(field).format(t="t", c=f"{col}_{field}")
+        for col in NUMERIC_COLS for field in STAT_FIELDS
+    ]
+    cur.execute(
+        f"INSERT INTO {table} AS t ({', '.join(cols)}) "
+        f"SELECT {', '.join(cols)} FROM {staging} ORDER BY {', '.join(KEY_COLUMNS)} "
+        f"ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET {', '.join(updates)}"
+    )
+    return len(df)
+
+
+def upsert_rollups(cur, frames):
+    """
+    Adds the rollup_stats of one or more files to the hourly and daily
+    rollup tables on an open cursor (no commit).
+
+    Count, sum, sum of squares, min and max merge exactly, so the mean and
+    std of any range of buckets can be computed from the stored rows. The
+    upsert adds to what is stored, so the frames must only cover raw rows
+    inserted in the same transaction (see spool.derive_inserted); a replay
+    then adds nothing.
+
+    Returns:
+        int: Hourly rows upserted.
+    """
+    frames = [f for f in frames if f is not None and not f.empty]
+    if not frames:
+        return 0
+    rollups = _prepare_rollups(merge_stats(frames), session_timezone(cur))
+    for size, table in ROLLUP_TABLES.items():
+        _upsert(cur, table, rollups[size])
+    return len(rollups["hour"])
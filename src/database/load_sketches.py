@@ -0,0 +1,78 @@
+import argparse
+import pandas as pd
+
+from src.database.db_utils import copy_dataframe, session_timezone, utc_to_session, db_connection, db_retry
+from src.database.devices import DEVICES
+from src.pipeline.sketches import merge_sketch_frames, merge_sketches
+
+SKETCH_TABLE = "analytics.sensor_sketches"
+SKETCH_COLUMNS = ["file_name", "device_key", "bucket_start", "sensor", "value_count", "sketch"]
+
+
+def _prepare_sketches(stats, source, tz):
+    """sketch_stats frame -> rows for the sketch table, buckets in the session time zone."""
+    stats = stats.reset_index()
+    return pd.DataFrame({
+        "file_name": source,
+        "device_key": DEVICES.keys(stats["device_id"]),
+        "bucket_start": utc_to_session(pd.to_datetime(stats["bucket"]), tz),
+        "sensor": stats["sensor"],
+        "value_count": [s.count for s in stats["sketch"]],
+        # bytea in COPY's text form
+        "sketch": ["\\x" + s.to_bytes().hex() for s in stats["sketch"]],
+    })[SKETCH_COLUMNS]
+
+
+def insert_sketches(cur, frames, source):
+    """
+    Inserts the quantile sketches of a file (sketch_stats frames) on an open
+    cursor (no commit). One row per device, hour and sensor.
+
+    Returns:
+        int: Rows inserted.
+    """
+    stats = merge_sketch_frames(frames)
+    if stats is None or stats.empty:
+        return 0
+    df = _prepare_sketches(stats, source, session_timezone(cur))
+    return copy_dataframe(cur, SKETCH_TABLE, df, SKETCH_COLUMNS)
+
+
+@db_retry
+def query_sketch(device_id, sensor, start, end):
+    """
+    Merged sketch of one device and sensor for buckets in [start, end)
+    (session time zone), or None if nothing was stored.
+    """
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT s.sketch FROM {SKETCH_TABLE} s JOIN raw.devices d USING (device_key) "
+                f"WHERE d.device_id = %s AND s.sensor = %s AND s.bucket_start >= %s AND s.bucket_start < %s",
+                (device_id, sensor, pd.Timestamp(start).to_pydatetime(), pd.Timestamp(end).to_pydatetime()),
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    return merge_sketches(row[0] for row in rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Percentiles of a device's readings from the stored sketches")
+    parser.add_argument("device_id")
+    parser.add_argument("sensor")
+    parser.add_argument("--start", required=True, help="First bucket (session time zone)")
+    parser.add_argument("--end", default=None, help="End of the range, exclusive (default: now)")
+    parser.add_argument("--q", default="0.5,0.95,0.99", help="Comma separated quantiles")
+    args = parser.parse_args(argv)
+
+    sketch = query_sketch(args.device_id, args.sensor, args.start, args.end or pd.Timestamp.now())
+    if sketch is None:
+        print("No sketches in range")
+        return
+    print(f"count={sketch.count} min={sketch.min} max={sketch.max}")
+    for q, value in sketch.quantiles(float(q) for q in args.q.split(",")).items():
+        print(f"p{q * 100:g}={value}")
+
+
+if __name__ == "__main__":
+    main()
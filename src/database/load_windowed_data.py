@@ -0,0 +1,21 @@
+import pandas as pd
+from datetime import datetime
+from src.database.db_utils import copy_dataframe, session_timezone, utc_to_session
+from src.database.devices import DEVICES
+
+WINDOW_TABLE = "analytics.windowed_sensor_data"
+
+def _prepare_windows(df: pd.DataFrame, tz="UTC"):
+    """Adds emitted_at, swaps device_id for its key and moves the UTC window bounds to the session time zone."""
+    df = df.assign(
+        emitted_at=datetime.now(),
+        device_id=DEVICES.keys(df["device_id"]),
+        window_start=utc_to_session(pd.to_datetime(df["window_start"]), tz),
+        window_end=utc_to_session(pd.to_datetime(df["window_end"]), tz),
+    )
+    return df.rename(columns={"device_id": "device_key"})
+
+def insert_windows(cur, df: pd.DataFrame):
+    """Inserts closed windows on an open cursor (no commit)."""
+    df = _prepare_windows(df, session_timezone(cur))
+    return copy_dataframe(cur, WINDOW_TABLE, df, list(df.columns))
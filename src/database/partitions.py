@@ -0,0 +1,226 @@
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from src.pipeline import schema
+from src.database.db_utils import db_connection, db_retry, session_timezone
+
+PARENT_TABLE = "raw.raw_sensor_data"
+
+# Set to 0 while raw.raw_sensor_data is still an unpartitioned table
+PARTITIONING = os.getenv("DB_PARTITIONING", "1") == "1"
+# "day" or "week" (weeks start on Monday)
+PARTITION_INTERVAL = os.getenv("DB_PARTITION_INTERVAL", "day")
+# Partitions created ahead of the current date by maintain()
+PARTITION_PREMAKE = int(os.getenv("DB_PARTITION_PREMAKE", "7"))
+# Partitions ending more than this many days ago are retired; 0 keeps everything
+PARTITION_RETENTION_DAYS = int(os.getenv("DB_PARTITION_RETENTION_DAYS", "0"))
+# "detach" keeps a retired partition as a plain table, "drop" deletes it
+PARTITION_RETENTION_ACTION = os.getenv("DB_PARTITION_RETENTION_ACTION", "detach")
+# Seconds between maintain() runs of the PartitionMaintainer thread
+PARTITION_MAINTAIN_INTERVAL = float(os.getenv("DB_PARTITION_MAINTAIN_INTERVAL", "3600"))
+
+STEPS = {"day": timedelta(days=1), "week": timedelta(weeks=1)}
+
+
+class PartitionManager:
+    """
+    Creates and retires the daily or weekly ts range partitions of the raw table.
+
+    Partitions are named <table>_pYYYYMMDD after their first day. The ones
+    known to exist are cached, so ensure() only goes to the database when a
+    load touches a new period. DDL runs in its own committed transaction
+    (serialised across processes with an advisory lock), before the load
+    that needs the partition opens its connection.
+    Indexes are defined on the parent table, so every partition gets the
+    BRIN index on ts and the (device_key, ts) B-tree automatically.
+    """
+
+    def __init__(self, parent=PARENT_TABLE, interval=PARTITION_INTERVAL,
+                 retention_days=PARTITION_RETENTION_DAYS, retention_action=PARTITION_RETENTION_ACTION):
+        if interval not in STEPS:
+            raise ValueError(f"Unknown partition interval: {interval}")
+        if retention_action not in ("detach", "drop"):
+            raise ValueError(f"Unknown retention action: {retention_action}")
+        self.parent = parent
+        self.schema, self.table = parent.split(".")
+        self.interval = interval
+        self.step = STEPS[interval]
+        self.retention_days = retention_days
+        self.retention_action = retention_action
+        self._pattern = re.compile(rf"^{re.escape(self.table)}_p(\d{{8}})$")
+        self._existing = None
+        self._tz = None
+        self._lock = threading.Lock()
+
+    def period_start(self, day):
+        """First day of the partition holding a given date."""
+        return day - timedelta(days=day.weekday()) if self.interval == "week" else day
+
+    def partition_name(self, start):
+        return f"{self.table}_p{start:%Y%m%d}"
+
+    def _periods(self, first, last):
+        start = self.period_start(first)
+        while start <= last:
+            yield start
+            start += self.step
+
+    def _load_existing(self, cur):
+        cur.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            (self.parent,),
+        )
+        found = set()
+        for (name,) in cur.fetchall():
+            match = self._pattern.match(name)
+            if match:
+                found.add(pd.Timestamp(match.group(1)).date())
+        return found
+
+    @db_retry
+    def _run(self, func):
+        """Runs func(cur) in its own transaction, holding the partition DDL lock."""
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (self.parent,))
+                    if self._tz is None:
+                        self._tz = session_timezone(cur)
+                    self._existing = self._load_existing(cur)
+                    result = func(cur)
+                conn.commit()
+        except Exception:
+            # The cache may list partitions that were rolled back; re-read it next time
+            self._existing = None
+            raise
+        return result
+
+    def _create(self, cur, starts):
+        created = []
+        for start in sorted(set(starts) - self._existing):
+            name = self.partition_name(start)
+            cur.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.schema}.{name} PARTITION OF {self.parent} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                (start, start + self.step),
+            )
+            self._existing.add(start)
+            created.append(name)
+        if created:
+            logger.info(f"Created {len(created)} partition(s) of {self.parent}: {', '.join(created)}")
+        return created
+
+    def ensure_periods(self, starts):
+        """Makes sure partitions exist for the given period start dates."""
+        with self._lock:
+            starts = set(starts)
+            if self._existing is not None and starts <= self._existing:
+                return []
+            return self._run(lambda cur: self._create(cur, starts))
+
+    def ensure_days(self, first, last):
+        """Makes sure partitions exist for every date from first to last (inclusive)."""
+        return self.ensure_periods(self._periods(first, last))
+
+    def ensure_epochs(self, epochs):
+        """
+        Makes sure the partitions for a batch of epoch-second timestamps exist.
+
+        Only the periods that hold a timestamp are created, never the gaps
+        between them. Epochs outside the accepted range (schema.TS_MIN and
+        TS_MAX_FUTURE_DAYS) are ignored; the loaders skip those rows. The
+        epochs are converted in the session time zone, like the loaders do,
+        so the partition matches the TIMESTAMP value Postgres will store.
+        """
+        epochs = np.asarray(epochs, dtype="float64")
+        epochs = epochs[schema.ts_in_window(epochs)]
+        if epochs.size == 0:
+            return []
+        if self._tz is None:
+            with self._lock:
+                self._run(lambda cur: None)
+        days = pd.to_datetime(epochs, unit="s", utc=True).tz_convert(self._tz).tz_localize(None).normalize().unique()
+        return self.ensure_periods({self.period_start(day.date()) for day in days})
+
+    def _retire(self, cur, today):
+        cutoff = today - timedelta(days=self.retention_days)
+        retired = []
+        for start in sorted(self._existing):
+            if start + self.step > cutoff:
+                break
+            name = f"{self.schema}.{self.partition_name(start)}"
+            if self.retention_action == "drop":
+                cur.execute(f"DROP TABLE {name}")
+            else:
+                cur.execute(f"ALTER TABLE {self.parent} DETACH PARTITION {name}")
+                # Frees the name, so late rows for this period can get a new partition. That
+                # partition may be retired again later, so an existing _detached table gets a suffix
+                detached = f"{self.partition_name(start)}_detached"
+                cur.execute("SELECT to_regclass(%s)", (f"{self.schema}.{detached}",))
+                if cur.fetchone()[0] is not None:
+                    detached += f"_{datetime.now():%Y%m%d%H%M%S}"
+                cur.execute(f"ALTER TABLE {name} RENAME TO {detached}")
+            self._existing.discard(start)
+            retired.append(name)
+        if retired:
+            logger.info(f"Retention ({self.retention_action}, {self.retention_days} days) on {self.parent}: "
+                        f"{', '.join(retired)}")
+        return retired
+
+    def maintain(self, premake=PARTITION_PREMAKE, today=None):
+        """
+        Creates the partitions for today and the next `premake` periods and
+        applies the retention policy.
+
+        Returns:
+            dict: Names of the created and retired partitions.
+        """
+        def run(cur):
+            day = today or pd.Timestamp.now(tz=self._tz).date()
+            created = self._create(cur, list(self._periods(day, day + premake * self.step)))
+            retired = self._retire(cur, day) if self.retention_days > 0 else []
+            return {"created": created, "retired": retired}
+
+        with self._lock:
+            return self._run(run)
+
+
+class PartitionMaintainer:
+    """Runs PartitionManager.maintain() at start-up and then periodically in a thread."""
+
+    def __init__(self, manager=None, interval=PARTITION_MAINTAIN_INTERVAL):
+        self.manager = manager or PARTITIONS
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def start(self):
+        self._maintain()
+        threading.Thread(target=self._loop, name="partition-maintainer", daemon=True).start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._maintain()
+
+    def _maintain(self):
+        try:
+            self.manager.maintain()
+        except Exception as e:
+            logger.error(f"Partition maintenance failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+
+PARTITIONS = PartitionManager() if PARTITIONING else None
+
+
+if __name__ == "__main__":
+    # One maintenance pass, e.g. from cron when the watcher is not running
+    print((PARTITIONS or PartitionManager()).maintain())
@@ -0,0 +1,363 @@
+import os
+import pickle
+import struct
+import threading
+from pathlib import Path
+from loguru import logger
+
+from src.pipeline.metrics import METRICS, timed
+from src.database.db_utils import db_connection, DB_BREAKER, DATABASE_DOWN
+from src.database.load_raw_data import load_raw_batch, register_targets
+from src.database.load_aggregated_data import load_aggregated_batch
+from src.database.load_windowed_data import insert_windows
+from src.database.load_rollups import upsert_rollups
+from src.database.load_sketches import insert_sketches
+from src.database.load_alerts import insert_alerts
+from src.pipeline.validation import evaluate_rules
+from src.pipeline.transformation import transform_df
+from src.pipeline.aggregation import rollup_stats
+from src.pipeline.sketches import sketch_stats
+from src.pipeline.anomaly import DETECTOR, detect_anomalies
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+SPOOL_DIR = Path(os.getenv("PIPELINE_SPOOL_DIR", BASE_DIR / "state" / "spool"))
+FAILED_DIR = BASE_DIR / "failed"
+
+# "0" disables the spool: connection errors then fail the file as before
+SPOOL_ENABLED = os.getenv("PIPELINE_SPOOL", "1") == "1"
+# A new segment file is started once the current one reaches this size
+SEGMENT_BYTES = int(float(os.getenv("PIPELINE_SPOOL_SEGMENT_MB", "64")) * 1024 * 1024)
+# Seconds the drainer sleeps when there is nothing it can do
+DRAIN_INTERVAL = float(os.getenv("PIPELINE_SPOOL_DRAIN_INTERVAL", "1"))
+
+_HEADER = struct.Struct(">Q")
+_CURSOR = "cursor"
+
+# Write kind -> (stage name for the metrics, insert on an open cursor)
+WRITERS = {
+    "raw": ("load_raw", lambda cur, df, source: load_raw_batch(cur, [(df, source)])),
+    "aggregated": ("load_aggregated", lambda cur, df, source: load_aggregated_batch(cur, [df])),
+    "windowed": ("load_windowed", lambda cur, df, source: insert_windows(cur, df)),
+    "rollup": ("load_rollups", lambda cur, df, source: upsert_rollups(cur, [df])),
+    "sketch": ("load_sketches", lambda cur, df, source: insert_sketches(cur, [df], source)),
+    "alert": ("load_alerts", lambda cur, df, source: insert_alerts(cur, df, source)),
+}
+# Writes derived from a source's raw rows; only the rows the raw merge inserted count towards them
+DERIVED_KINDS = {"rollup", "sketch", "alert"}
+
+
+def _non_empty(writes):
+    return [w for w in writes if w[1] is not None and not w[1].empty]
+
+
+def inserted_rows(df, merged):
+    """
+    The rows of df (indexed like the source's raw rows) whose raw row the
+    merge inserted; merged is the source's entry of the merge_raw_rows counts,
+    None when unknown (all rows are kept). Returns None when none were inserted.
+    """
+    if df is None or not merged or not merged["duplicates"]:
+        return df
+    if not merged["new"]:
+        return None
+    return df.drop(index=df.index.intersection(merged["duplicate_index"]))
+
+
+def derive_inserted(kind, df, raw, source, merged):
+    """
+    A rollup, sketch or alert write of `source` restricted to the raw rows
+    the merge inserted, so a file that partly overlaps what is stored does
+    not count its duplicates twice.
+
+    Returns df as it is when every row was new and None when none was. On
+    a partial overlap the rows to score are filtered by index, and rollups
+    and sketches are rebuilt from the inserted raw rows (validated and
+    transformed again, which is what prepare_frame did for the whole file).
+    """
+    if not merged or not merged["duplicates"]:
+        return df
+    if not merged["new"]:
+        return None
+    if kind == "alert":
+        return inserted_rows(df, merged)
+    rows = inserted_rows(raw, merged)
+    valid_mask, _ = evaluate_rules(rows, source)
+    transformed = transform_df(rows[valid_mask])
+    if transformed.empty:
+        return None
+    return rollup_stats(transformed) if kind == "rollup" else sketch_stats(transformed)
+
+
+def apply_writes(writes):
+    """
+    Applies a list of (kind, DataFrame, source) writes in one transaction.
+
+    kind is "raw" (incoming rows), "aggregated", "windowed", "rollup", "sketch" or "alert". Devices and
+    partitions are registered before the connection is taken. Raw rows are
+    merged on their natural key, and a source's rollup, sketch and alert
+    writes are then restricted to the raw rows that were inserted (see
+    derive_inserted), so replays and overlapping files are not counted
+    twice. An alert write holds the rows to score (see anomaly_rows); they
+    are scored here, and the detector's update is taken back if the
+    transaction fails.
+
+    Returns:
+        dict: {source: {"new": n, "duplicates": n, "duplicate_index": [...]}} for the raw writes.
+    """
+    for kind, df, _ in writes:
+        if kind not in WRITERS:
+            raise ValueError(f"Unknown spool write: {kind}")
+        if kind == "raw":
+            register_targets(df)
+    raw = {source: df for kind, df, source in writes if kind == "raw"}
+    counts = {}
+    undo = []
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                for kind, df, source in writes:
+                    # Records spooled before alerts were scored at load time hold the alerts themselves
+                    legacy_alerts = kind == "alert" and "sensor" in df.columns
+                    if kind in DERIVED_KINDS and not legacy_alerts:
+                        df = derive_inserted(kind, df, raw.get(source), source, counts.get(source))
+                        if df is None:
+                            logger.info(f"Skipping {kind} write of {source}: its rows are already loaded")
+                            continue
+                        if kind == "alert":
+                            df = detect_anomalies(df, undo)
+                            if df is None:
+                                continue
+                    name, insert = WRITERS[kind]
+                    with timed(name, len(df)):
+                        result = insert(cur, df, source)
+                    if kind == "raw":
+                        counts.update(result)
+            conn.commit()
+    except Exception:
+        for token in reversed(undo):
+            DETECTOR.revert(token)
+        raise
+    return counts
+
+
+class Spool:
+    """
+    Local durable queue for database writes while the database is down.
+
+    Writes are appended as length-prefixed pickles to numbered segment files
+    (append-only, fsynced). A drainer thread replays them in order once the
+    circuit breaker lets a probe through, and records its position in a
+    cursor file after every committed record. Replay is at-least-once: a
+    crash between the commit and the cursor update replays that record.
+    While anything is spooled, new writes are spooled too, so the database
+    receives them in order.
+    """
+
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SEGMENT_BYTES, breaker=DB_BREAKER,
+                 enabled=SPOOL_ENABLED, apply=apply_writes):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.breaker = breaker
+        self.enabled = enabled
+        self.apply = apply
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._writer = None
+        self._writer_seq = None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.pending = self._count_pending()
+
+    # Segments
+
+    def _segments(self):
+        return sorted(int(p.stem) for p in self.directory.glob("*.seg"))
+
+    def _segment_path(self, seq):
+        return self.directory / f"{seq:012d}.seg"
+
+    def _read_cursor(self):
+        try:
+            seq, offset = (self.directory / _CURSOR).read_text().split()
+            return int(seq), int(offset)
+        except (OSError, ValueError):
+            return None, 0
+
+    def _write_cursor(self, seq, offset):
+        tmp = self.directory / f"{_CURSOR}.tmp"
+        tmp.write_text(f"{seq} {offset}")
+        os.replace(tmp, self.directory / _CURSOR)
+
+    def _records(self, seq, offset=0):
+        """Yields (payload, next_offset) for the complete records of a segment."""
+        with open(self._segment_path(seq), "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                payload = f.read(_HEADER.unpack(header)[0])
+                if len(payload) < _HEADER.unpack(header)[0]:
+                    # Torn write from a crash: the rest of the segment is unusable
+                    return
+                offset += _HEADER.size + len(payload)
+                yield payload, offset
+
+    def _count_pending(self):
+        cursor_seq, cursor_offset = self._read_cursor()
+        count = 0
+        for seq in self._segments():
+            offset = cursor_offset if seq == cursor_seq else 0
+            count += sum(1 for _ in self._records(seq, offset))
+        if count:
+            logger.warning(f"{count} spooled DB write(s) waiting in {self.directory}")
+        return count
+
+    def append(self, writes):
+        """Durably appends one record (a list of writes) to the current segment."""
+        writes = _non_empty(writes)
+        if not writes:
+            return
+        payload = pickle.dumps(writes, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if self._writer is None or self._writer.tell() >= self.segment_bytes:
+                if self._writer is not None:
+                    self._writer.close()
+                segments = self._segments()
+                self._writer_seq = (segments[-1] + 1) if segments else 1
+                self._writer = open(self._segment_path(self._writer_seq), "ab")
+            self._writer.write(_HEADER.pack(len(payload)) + payload)
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self.pending += 1
+        METRICS.inc("pipeline_spool_records_total", event="spooled")
+        self._wake.set()
+
+    # Writers
+
+    def bypass(self):
+        """True if writes must go to the spool instead of the database right now."""
+        return self.enabled and (self.pending > 0 or not self.breaker.allow())
+
+    def write(self, writes, counts=None):
+        """
+        Sends writes to the database, or to the spool when it is unreachable.
+
+        Data errors are raised, so the caller can fail the file as before.
+        When loaded, the new and duplicate raw row counts per source (and
+        the index of the duplicate rows) are added to the `counts` dict, if
+        one is given.
+
+        Returns:
+            str: "loaded" or "spooled".
+        """
+        writes = _non_empty(writes)
+        if not writes:
+            return "loaded"
+        if self.bypass():
+            self.append(writes)
+            return "spooled"
+        try:
+            result = self.apply(writes)
+        except DATABASE_DOWN as e:
+            self.breaker.record_failure()
+            if not self.enabled:
+                raise
+            logger.warning(f"Database unavailable ({e}); spooling {len(writes)} write(s)")
+            self.append(writes)
+            return "spooled"
+        self.breaker.record_success()
+        if counts is not None and result:
+            for source, c in result.items():
+                total = counts.setdefault(source, {"new": 0, "duplicates": 0, "duplicate_index": []})
+                total["new"] += c["new"]
+                total["duplicates"] += c["duplicates"]
+                total["duplicate_index"].extend(c["duplicate_index"])
+        return "loaded"
+
+    # Drainer
+
+    def start(self):
+        self._thread = threading.Thread(target=self._drain_loop, name="spool-drainer", daemon=True)
+        self._thread.start()
+        return self
+
+    def _drain_loop(self):
+        while not self._stop.is_set():
+            if self.pending == 0 or not self.breaker.allow():
+                self._wake.wait(DRAIN_INTERVAL)
+                self._wake.clear()
+                continue
+            try:
+                self.drain()
+            except Exception as e:
+                logger.error(f"Spool drainer failed: {e}")
+                self._stop.wait(DRAIN_INTERVAL)
+
+    def drain(self):
+        """
+        Replays spooled records in order until the spool is empty or the
+        database goes away again.
+
+        Returns:
+            int: Records applied.
+        """
+        applied = 0
+        cursor_seq, cursor_offset = self._read_cursor()
+        for seq in self._segments():
+            offset = cursor_offset if seq == cursor_seq else 0
+            for payload, next_offset in self._records(seq, offset):
+                try:
+                    self.apply(pickle.loads(payload))
+                except DATABASE_DOWN as e:
+                    self.breaker.record_failure()
+                    logger.warning(f"Spool replay paused, database unavailable: {e}")
+                    return applied
+                except Exception as e:
+                    self._dead_letter(payload, seq, offset, e)
+                else:
+                    self.breaker.record_success()
+                    applied += 1
+                    METRICS.inc("pipeline_spool_records_total", event="replayed")
+                self._write_cursor(seq, next_offset)
+                offset = next_offset
+                with self._lock:
+                    self.pending -= 1
+            if not self._retire(seq):
+                break
+        if applied:
+            logger.info(f"Replayed {applied} spooled DB write(s)")
+        return applied
+
+    def _retire(self, seq):
+        """Deletes a fully replayed segment; the writer then starts a new one."""
+        with self._lock:
+            if seq == self._writer_seq:
+                if self._writer.tell() != self._read_cursor()[1]:
+                    return False  # written to while it was being replayed
+                self._writer.close()
+                self._writer = self._writer_seq = None
+            self._segment_path(seq).unlink()
+        return True
+
+    def _dead_letter(self, payload, seq, offset, error):
+        """Moves a record that fails on its data out of the spool, into failed/."""
+        FAILED_DIR.mkdir(exist_ok=True)
+        path = FAILED_DIR / f"spool-{seq:012d}-{offset}.pkl"
+        path.write_bytes(payload)
+        METRICS.inc("pipeline_spool_records_total", event="failed")
+        logger.error(f"Spooled write failed on replay ({error}); moved to {path}")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = self._writer_seq = None
+
+
+SPOOL = Spool()
@@ -4,62 +4,210 @@ from datetime import datetime
 import numpy as np
 from loguru import logger
 
+from src.pipeline.storage import write_frame, read_frame, list_outputs
+from src.pipeline.metrics import stage
+from src.pipeline.schema import SENSOR_COLS, STAGE_DTYPES
+
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 TRANSFORMED_DIR = BASE_DIR / "transformed_data"
 AGGREGATES_DIR = BASE_DIR / "aggregated_data"
 AGGREGATES_DIR.mkdir(exist_ok=True)
 
-def aggregate_file(file_path):
+NUMERIC_COLS = SENSOR_COLS
+
+@stage("aggregate")
+def aggregate_df(df, file_name, device_col="device"):
     """
-    Calculates and stores aggregated metrics for each unique device in a file.
-    
+    Calculates aggregated metrics for each unique device in a DataFrame.
+
     Args:
-        file_path (Path): The path to the transformed CSV file.
-    
+        df (DataFrame): The transformed sensor rows.
+        file_name (str): Source file name stored with every aggregate row.
+        device_col (str): Name of the device column.
+
     Returns:
-        Path: The path to the output aggregates file.
+        DataFrame: One row of metrics per device.
     """
-    df = pd.read_csv(file_path)
+    numeric_cols = NUMERIC_COLS
 
-    device_col = df.columns[1]
-    
-    # Define the numeric columns for aggregation
-    numeric_cols = ["temp", "humidity", "co", "lpg", "smoke"]
-    
     # Check if the device column exists and if it's the right one
     if not isinstance(device_col, str) or len(df[device_col].unique()) == len(df):
         raise ValueError(f"Could not identify a suitable device column. Found: {device_col}")
 
-    # Group the DataFrame by the device column and calculate statistics
-    agg_df = df.groupby(device_col)[numeric_cols].agg([
+    # Group the DataFrame by the device column and calculate statistics.
+    # Readings are float32 in memory; the statistics are computed in float64.
+    # observed=True skips devices of the categorical whose rows were all filtered out.
+    agg_df = df[numeric_cols].astype("float64").groupby(df[device_col], observed=True).agg([
         'min', 'max', 'mean', 'std'
     ])
     
     # Flatten the multi-level column names to save
     agg_df.columns = ['_'.join(col).strip() for col in agg_df.columns.values]
 
+    return _with_metadata(agg_df, file_name)
+
+def _with_metadata(agg_df, file_name):
+    """Rounds per-device metrics (indexed by device) and adds the metadata columns."""
     #round off numeric columns to 4 decimal places
     agg_df = agg_df.round(4)
     
     # Add metadata columns
-    agg_df.reset_index(inplace=True)
-    agg_df.rename(columns={device_col: 'device_id'}, inplace=True)
-    output_file_name = file_path.name
-    output_file = AGGREGATES_DIR / output_file_name
-    agg_df['file_name'] = output_file.name
+    agg_df = agg_df.rename_axis('device_id').reset_index()
+    agg_df['file_name'] = file_name
     agg_df['processed_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
     # Rearrange columns to put metadata at the front
     cols = ['file_name', 'processed_at', 'device_id'] + [col for col in agg_df.columns if col not in ['file_name', 'processed_at', 'device_id']]
-    agg_df = agg_df[cols]
+    return agg_df[cols]
+
+def save_aggregates(agg_df, file_name):
+    """Writes aggregated metrics to the aggregated_data folder."""
+    return write_frame(agg_df, AGGREGATES_DIR, file_name)
 
-    # Save to a new CSV file
-    agg_df.to_csv(output_file, index=False)
+STAT_FIELDS = ["count", "mean", "m2", "min", "max"]
+
+def partial_stats(df, by, numeric_cols=NUMERIC_COLS):
+    """
+    Mergeable statistics of the numeric columns per group: count, mean,
+    M2 (the sum of squared deviations from the mean), min and max.
+
+    Args:
+        df (DataFrame): Rows to summarise.
+        by: Grouping key(s), anything DataFrame.groupby accepts.
+        numeric_cols (list): Columns to summarise.
+
+    Returns:
+        DataFrame: One row per group with flat columns such as temp_count,
+        temp_m2, plus "rows" (the group size).
+    """
+    values = df[numeric_cols].astype("float64")
+    grouped = values.groupby(by, observed=True)
+    count = grouped.count()
+    parts = {
+        "count": count,
+        "mean": grouped.mean(),
+        "m2": grouped.var(ddof=0) * count,
+        "min": grouped.min(),
+        "max": grouped.max(),
+    }
+    stats = pd.concat([parts[field].add_suffix(f"_{field}") for field in STAT_FIELDS], axis=1)
+    stats["rows"] = grouped.size()
+    return stats
+
+def merge_stats(frames, numeric_cols=NUMERIC_COLS):
+    """
+    Combines partial_stats frames that share the same group keys.
+
+    Means and M2 are combined with Chan et al.'s parallel formula,
+    M2 = sum(M2_i) + sum(n_i * (mean_i - mean)^2), which does not suffer
+    the cancellation of a sum-of-squares formula when the spread is small
+    compared with the mean.
+    """
+    frames = [f for f in frames if f is not None]
+    if len(frames) == 1:
+        return frames[0]
+    combined = pd.concat(frames)
+    levels = list(range(combined.index.nlevels))
+    grouped = combined.groupby(level=levels, observed=True)
+    how = {f"{col}_{field}": ("sum" if field == "count" else field)
+           for col in numeric_cols for field in ("count", "min", "max")}
+    how["rows"] = "sum"
+    out = grouped.agg(how)
+    for col in numeric_cols:
+        n_i = combined[f"{col}_count"]
+        mean_i = combined[f"{col}_mean"].where(n_i > 0, 0.0)
+        n = out[f"{col}_count"]
+        mean = ((n_i * mean_i).groupby(level=levels, observed=True).sum() / n).where(n > 0)
+        spread = n_i * (mean_i - mean.reindex(combined.index).to_numpy()) ** 2
+        m2 = (combined[f"{col}_m2"].fillna(0) + spread.fillna(0)).groupby(level=levels, observed=True).sum()
+        out[f"{col}_mean"] = mean
+        out[f"{col}_m2"] = m2.where(n > 0)
+    return out[[f"{col}_{field}" for field in STAT_FIELDS for col in numeric_cols] + ["rows"]]
+
+def rollup_stats(df, device_col="device", freq="h"):
+    """
+    partial_stats per device and UTC hour of ts, for the rollup tables.
+
+    Returns:
+        DataFrame: Indexed by (device_id, bucket); rows without ts are left out.
+    """
+    keys = [df[device_col].rename("device_id"), df["ts"].dt.floor(freq).rename("bucket")]
+    return partial_stats(df, keys)
+
+def finalize_stats(stats, numeric_cols=NUMERIC_COLS):
+    """Turns merged statistics into min/max/mean/std columns (unrounded)."""
+    out = pd.DataFrame(index=stats.index)
+    for col in numeric_cols:
+        n = stats[f"{col}_count"]
+        var = (stats[f"{col}_m2"] / (n - 1)).where(n > 1)
+        out[f"{col}_min"] = stats[f"{col}_min"]
+        out[f"{col}_max"] = stats[f"{col}_max"]
+        out[f"{col}_mean"] = stats[f"{col}_mean"].where(n > 0)
+        out[f"{col}_std"] = np.sqrt(var.clip(lower=0))
+    return out
+
+class AggregateState:
+    """
+    Mergeable per-device statistics: count, mean, M2, min and max.
+
+    Chunks can be folded in one at a time (update) and states built in
+    parallel can be combined (merge). finalize() returns the same frame that
+    aggregate_df would have produced for all rows at once.
+    """
+
+    def __init__(self, numeric_cols=NUMERIC_COLS):
+        self.numeric_cols = list(numeric_cols)
+        self.rows = 0
+        # One row per device, see partial_stats
+        self.state = None
+
+    def update(self, df, device_col="device"):
+        """Folds a chunk of transformed rows into the state."""
+        if df.empty:
+            return self
+        self._merge(partial_stats(df, df[device_col], self.numeric_cols), len(df))
+        return self
+
+    def merge(self, other):
+        """Combines another state into this one."""
+        self._merge(other.state, other.rows)
+        return self
+
+    def _merge(self, part, rows):
+        self.rows += rows
+        if part is not None:
+            self.state = merge_stats([self.state, part], self.numeric_cols)
+
+    def finalize(self, file_name):
+        """Returns min/max/mean/std per device, formatted like aggregate_df."""
+        if self.state is None or len(self.state) == self.rows:
+            raise ValueError("Could not identify a suitable device column. Found: device")
+
+        out = finalize_stats(self.state.sort_index(), self.numeric_cols)
+        return _with_metadata(out, file_name)
+
+def aggregate_file(file_path):
+    """
+    Calculates and stores aggregated metrics for each unique device in a file.
+    
+    Args:
+        file_path (Path): The path to the transformed file (CSV or Parquet).
     
-    return output_file
+    Returns:
+        Path: The path to the output aggregates file.
+    """
+    # Only the columns that are aggregated are read
+    df = read_frame(file_path, columns=["device"] + NUMERIC_COLS, dtypes=STAGE_DTYPES)
+
+    # Lineage points at the incoming CSV, whatever format the stage files use
+    source_name = Path(file_path).with_suffix(".csv").name
+    agg_df = aggregate_df(df, source_name)
+
+    # Save to the aggregates folder
+    return save_aggregates(agg_df, source_name)
 
 if __name__ == "__main__":
-    for file in TRANSFORMED_DIR.glob("*.csv"):
+    for file in list_outputs(TRANSFORMED_DIR):
         try:
             out = aggregate_file(file)
             print(f"Aggregates by device saved to {out}")
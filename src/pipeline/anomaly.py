@@ -0,0 +1,195 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from loguru import logger
+
+from src.pipeline.aggregation import NUMERIC_COLS
+from src.pipeline.metrics import METRICS, timed
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+STATE_DIR = BASE_DIR / "state"
+STATE_DIR.mkdir(exist_ok=True)
+ANOMALY_STATE_FILE = STATE_DIR / "anomaly.pkl"
+
+# "0" disables anomaly detection
+ANOMALY_ENABLED = os.getenv("PIPELINE_ANOMALY", "1") == "1"
+# Sensors that are scored
+ANOMALY_COLUMNS = [c.strip() for c in os.getenv("PIPELINE_ANOMALY_COLUMNS", ",".join(NUMERIC_COLS)).split(",")
+                   if c.strip()]
+# Weight of a new reading in the running mean and variance
+ANOMALY_ALPHA = float(os.getenv("PIPELINE_ANOMALY_ALPHA", "0.05"))
+# |z| above which a reading is flagged
+ANOMALY_THRESHOLD = float(os.getenv("PIPELINE_ANOMALY_THRESHOLD", "4"))
+# Readings a device must have had before its readings are scored
+ANOMALY_WARMUP = int(os.getenv("PIPELINE_ANOMALY_WARMUP", "30"))
+
+ALERT_COLUMNS = ["ts", "device_id", "sensor", "value", "expected", "std", "z_score"]
+
+
+class AnomalyDetector:
+    """
+    Per-device EWMA mean and variance of each sensor, used to flag spikes.
+
+    The state is one row per device (mean, variance and count per sensor),
+    so memory is constant per device whatever the volume. A chunk is scored
+    in ts order with vectorized pandas EWMs: the device's stored mean and
+    variance are prepended as a seed row, so the recurrence continues
+    exactly from the previous chunk. Each reading is compared with the mean
+    and variance before it; |z| above the threshold is flagged once the
+    device has seen `warmup` readings. Flagged readings still update the
+    state, so a lasting level shift stops being flagged.
+    """
+
+    def __init__(self, columns=ANOMALY_COLUMNS, alpha=ANOMALY_ALPHA, threshold=ANOMALY_THRESHOLD,
+                 warmup=ANOMALY_WARMUP):
+        if not 0 < alpha < 1:
+            raise ValueError(f"Anomaly alpha must be between 0 and 1: {alpha}")
+        self.columns = list(columns)
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        # Indexed by device_id: mean_<col>, var_<col>, n_<col>
+        self.state = pd.DataFrame(columns=self._state_columns(), dtype="float64")
+        self._lock = threading.Lock()
+
+    def _state_columns(self):
+        return [f"{kind}_{col}" for col in self.columns for kind in ("mean", "var", "n")]
+
+    def _ewm(self, frame, value_col):
+        return (frame.groupby("device_id", sort=False)[value_col]
+                .ewm(alpha=self.alpha, adjust=False, ignore_na=True).mean()
+                .reset_index(level=0, drop=True).sort_index())
+
+    def score(self, df, device_col="device", undo=None):
+        """
+        Scores transformed rows and folds them into the state.
+
+        Args:
+            undo (list): If given, a token for revert() is appended, so the
+                caller can take the update back when the rows are not stored.
+
+        Returns:
+            DataFrame: One row per flagged reading (ALERT_COLUMNS).
+        """
+        rows = df[df["ts"].notna()].sort_values("ts", kind="stable")
+        if rows.empty:
+            return pd.DataFrame(columns=ALERT_COLUMNS)
+
+        with timed("anomaly", len(rows)), self._lock:
+            chunk = pd.DataFrame({"device_id": rows[device_col].astype(str).to_numpy(),
+                                  "ts": rows["ts"].to_numpy()})
+            for col in self.columns:
+                chunk[col] = rows[col].to_numpy(dtype="float64", na_value=np.nan)
+            chunk["seed"] = False
+
+            prior = self.state.reindex(chunk["device_id"].unique())
+            seeds = prior.dropna(how="all")
+            seed = pd.DataFrame({"device_id": seeds.index, "ts": pd.NaT, "seed": True})
+            for col in self.columns:
+                seed[col] = seeds[f"mean_{col}"].to_numpy()
+
+            # Seed row first, then the chunk in ts order, per device
+            frame = pd.concat([seed, chunk], ignore_index=True) if len(seed) else chunk
+            frame["seed"] = frame["seed"].astype(bool)
+            frame["order"] = np.where(frame["seed"], -1, np.arange(len(frame)))
+            frame = frame.sort_values(["device_id", "order"], kind="stable").reset_index(drop=True)
+            by_device = frame.groupby("device_id", sort=False)
+            is_seed = frame["seed"].to_numpy()
+
+            alerts = []
+            new_state = {}
+            for col in self.columns:
+                mean = self._ewm(frame, col)
+                expected = mean.groupby(frame["device_id"], sort=False).shift(1)
+                diff = frame[col] - expected
+                # v_t = (1 - a) * (v_{t-1} + a * diff^2) is an EWM of (1 - a) * diff^2,
+                # seeded with the stored variance. A device's first reading has no mean to
+                # differ from and starts the variance at 0, so the next step is a(1-a)*diff^2.
+                first = ~frame["seed"] & frame[col].notna() & expected.isna()
+                frame["_w"] = np.where(is_seed, prior[f"var_{col}"].reindex(frame["device_id"]).to_numpy(),
+                                       np.where(first, 0.0, (1 - self.alpha) * diff ** 2))
+                var = self._ewm(frame, "_w")
+                prev_var = var.groupby(frame["device_id"], sort=False).shift(1)
+
+                valid = frame[col].notna() & ~frame["seed"]
+                seen = valid.groupby(frame["device_id"], sort=False).cumsum() - valid
+                seen = seen + prior[f"n_{col}"].reindex(frame["device_id"]).fillna(0).to_numpy()
+                std = np.sqrt(prev_var)
+                z = diff / std
+                flagged = valid & (seen >= self.warmup) & (std > 0) & (z.abs() > self.threshold)
+                if flagged.any():
+                    alerts.append(pd.DataFrame({
+                        "ts": frame.loc[flagged, "ts"], "device_id": frame.loc[flagged, "device_id"],
+                        "sensor": col, "value": frame.loc[flagged, col], "expected": expected[flagged],
+                        "std": std[flagged], "z_score": z[flagged],
+                    }))
+                    METRICS.inc("pipeline_alerts_total", int(flagged.sum()), sensor=col)
+
+                last = by_device.tail(1).index
+                new_state[f"mean_{col}"] = pd.Series(mean[last].to_numpy(), index=frame.loc[last, "device_id"])
+                new_state[f"var_{col}"] = pd.Series(var[last].to_numpy(), index=frame.loc[last, "device_id"])
+                new_state[f"n_{col}"] = (valid.groupby(frame["device_id"], sort=False).sum()
+                                         + prior[f"n_{col}"].fillna(0))
+
+            updated = pd.DataFrame(new_state)[self._state_columns()]
+            previous = self.state.reindex(updated.index)
+            self.state = updated.combine_first(self.state)[self._state_columns()]
+            if undo is not None:
+                undo.append((previous, self.state.loc[updated.index]))
+
+        if not alerts:
+            return pd.DataFrame(columns=ALERT_COLUMNS)
+        out = pd.concat(alerts, ignore_index=True)[ALERT_COLUMNS].sort_values("ts", kind="stable")
+        logger.warning(f"{len(out)} anomalous reading(s) flagged for {out['device_id'].nunique()} device(s)")
+        return out.reset_index(drop=True)
+
+    def revert(self, token):
+        """
+        Takes back the state update of a score() call whose rows were not
+        stored. Devices scored again since then keep their newer state.
+        """
+        previous, applied = token
+        with self._lock:
+            current = self.state.reindex(applied.index)
+            unchanged = ((current == applied) | (current.isna() & applied.isna())).all(axis=1)
+            devices = unchanged.index[unchanged.to_numpy()]
+            restored = previous.loc[devices].dropna(how="all")
+            self.state = pd.concat([self.state.drop(index=devices), restored])[self._state_columns()]
+
+    def snapshot(self, path=ANOMALY_STATE_FILE):
+        """Saves the per-device state so a restart keeps the learned baselines."""
+        with self._lock:
+            pd.to_pickle(self.state, path)
+
+    def restore(self, path=ANOMALY_STATE_FILE):
+        """Loads state saved by snapshot(); sensors no longer scored are dropped."""
+        if not Path(path).exists():
+            return self
+        saved = pd.read_pickle(path)
+        with self._lock:
+            self.state = saved.reindex(columns=self._state_columns())
+        logger.info(f"Restored anomaly baselines of {len(self.state)} devices")
+        return self
+
+
+DETECTOR = AnomalyDetector() if ANOMALY_ENABLED else None
+
+
+def anomaly_rows(transformed, device_col="device"):
+    """The columns of transformed rows the detector needs; None when it is disabled."""
+    if DETECTOR is None or transformed is None or transformed.empty:
+        return None
+    return transformed[[device_col, "ts"] + DETECTOR.columns]
+
+
+def detect_anomalies(rows, undo=None):
+    """
+    Scores rows (see anomaly_rows) with the shared detector; None when
+    disabled or nothing was flagged. See AnomalyDetector.score for undo.
+    """
+    if DETECTOR is None or rows is None or rows.empty:
+        return None
+    alerts = DETECTOR.score(rows, undo=undo)
+    return None if alerts.empty else alerts
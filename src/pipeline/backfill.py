@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from loguru import logger
+
+from src.pipeline import schema
+from src.pipeline.runner import prepare_frame, record_merge
+from src.pipeline.metrics import METRICS, timed
+from src.pipeline.workers import WORKER_PROCESSES, _ignore_sigint
+from src.database.db_utils import db_connection, close_pool, POOL_MAX_SIZE
+from src.database.load_raw_data import drop_raw_indexes, rebuild_raw_indexes
+from src.database.spool import apply_writes
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+STATE_DIR = BASE_DIR / "state"
+STATE_DIR.mkdir(exist_ok=True)
+CHECKPOINT_FILE = STATE_DIR / "backfill.json"
+
+# Rows per shard; each shard is prepared in a worker process and loaded in one transaction
+SHARD_ROWS = int(os.getenv("PIPELINE_BACKFILL_SHARD_ROWS", "100000"))
+# Processes for validate/transform/aggregate
+BACKFILL_PROCESSES = int(os.getenv("PIPELINE_BACKFILL_PROCESSES", str(max(WORKER_PROCESSES, 1))))
+# Parallel DB connections loading shards
+BACKFILL_CONNECTIONS = int(os.getenv("PIPELINE_BACKFILL_CONNECTIONS", str(min(4, POOL_MAX_SIZE))))
+
+
+def plan_shards(path, shard_rows=SHARD_ROWS, block_size=1 << 24):
+    """
+    Splits a CSV into byte ranges of `shard_rows` lines, without parsing it.
+
+    Returns:
+        tuple: (header column names, list of (start, end) byte offsets).
+    """
+    with open(path, "rb") as f:
+        header = schema.parse_header(f.readline())
+        pos = f.tell()
+        offsets = [pos]
+        lines = 0
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            cursor = 0
+            while True:
+                need = shard_rows - lines
+                found = block.count(b"\n", cursor)
+                if found < need:
+                    lines += found
+                    break
+                for _ in range(need):
+                    cursor = block.index(b"\n", cursor) + 1
+                offsets.append(pos + cursor)
+                lines = 0
+            pos += len(block)
+    if pos > offsets[-1]:
+        offsets.append(pos)
+    return header, list(zip(offsets[:-1], offsets[1:]))
+
+
+def shard_name(source, index):
+    """File name stored with the rows of a shard (lineage, error store)."""
+    return f"{Path(source).stem}_part{index + 1:05d}.csv"
+
+
+def prepare_shard(source, index, start, end, header):
+    """Reads and prepares one shard; runs in a worker process."""
+    with open(source, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    with timed("read"):
+        df = schema.read_lines(data, header)
+    # aggregate_df rejects frames where every row is a different device (tiny last shards)
+    aggregate = df["device"].nunique() < len(df)
+    return prepare_frame(df, Path(shard_name(source, index)), aggregate=aggregate)
+
+
+def load_shard(prepared):
+    """Loads a prepared shard's raw rows, aggregates, rollups and sketches in one transaction."""
+    name = prepared["file_path"].name
+    counts = apply_writes([w for w in [
+        ("raw", prepared["df"], name),
+        ("aggregated", prepared["agg_df"], name),
+        ("rollup", prepared["rollups"], name),
+        ("sketch", prepared["sketches"], name),
+    ] if w[1] is not None and not w[1].empty])
+    record_merge(prepared["summary"], counts.get(name))
+    return prepared["summary"]
+
+
+class Checkpoint:
+    """
+    Progress of a backfill: the finished shards of every source, plus the
+    definitions of raw indexes dropped for the load.
+
+    Rewritten atomically after every shard. A source is identified by its
+    path, size, mtime and the shard size, so a changed file or shard size
+    starts that source over.
+    """
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = Path(path)
+        self.data = {"sources": {}, "dropped_indexes": []}
+        if self.path.exists():
+            self.data = json.loads(self.path.read_text())
+
+    def save(self):
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.data, indent=1))
+        os.replace(tmp, self.path)
+
+    def source(self, path, shard_rows):
+        st = os.stat(path)
+        key = str(Path(path).resolve())
+        fingerprint = [st.st_size, st.st_mtime, shard_rows]
+        entry = self.data["sources"].get(key)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            if entry is not None:
+                logger.warning(f"{path} or the shard size changed since the last run; starting it over")
+            entry = self.data["sources"][key] = {"fingerprint": fingerprint, "done": [], "failed": [], "rows": 0}
+        return entry
+
+    def finish(self, entry, index, summary):
+        entry["failed"] = [i for i in entry["failed"] if i != index]
+        entry["done"].append(index)
+        entry["rows"] += summary.get("rows", 0)
+        self.save()
+
+    def fail(self, entry, index):
+        if index not in entry["failed"]:
+            entry["failed"].append(index)
+        self.save()
+
+
+def expand_sources(sources):
+    """CSV files named directly or found in the given directories, in name order."""
+    files = []
+    for source in map(Path, sources):
+        files.extend(sorted(source.glob("*.csv")) if source.is_dir() else [source])
+    return files
+
+
+def backfill(sources, shard_rows=SHARD_ROWS, processes=BACKFILL_PROCESSES, connections=BACKFILL_CONNECTIONS,
+             rebuild_indexes=False, checkpoint=None):
+    """
+    Loads large historical CSVs in parallel, resuming from the checkpoint.
+
+    Every source is cut into shards of `shard_rows` lines by byte offset.
+    Shards are prepared (validate, transform, aggregate, rollups, sketches)
+    in a process pool and loaded by `connections` threads, one transaction
+    per shard. At most a few shards per worker are in flight, so memory
+    stays bounded. With rebuild_indexes the raw table's indexes are dropped
+    first and recreated once every shard is loaded.
+
+    Returns:
+        dict: Shard and row counts.
+    """
+    checkpoint = checkpoint or Checkpoint()
+    totals = {"shards": 0, "skipped": 0, "failed": 0, "rows": 0, "valid": 0, "invalid": 0,
+              "new_rows": 0, "duplicate_rows": 0}
+    started = time.perf_counter()
+
+    if rebuild_indexes and not checkpoint.data["dropped_indexes"]:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                # Saved before the drop commits, so an interrupted run can still rebuild them
+                checkpoint.data["dropped_indexes"] = drop_raw_indexes(cur)
+                checkpoint.save()
+            conn.commit()
+        logger.info(f"Dropped raw indexes: {', '.join(n for n, _ in checkpoint.data['dropped_indexes'])}")
+
+    cpu = ProcessPoolExecutor(max_workers=max(processes, 1), mp_context=multiprocessing.get_context("spawn"),
+                              initializer=_ignore_sigint)
+    io = ThreadPoolExecutor(max_workers=max(connections, 1), thread_name_prefix="backfill-load")
+    max_in_flight = 2 * (max(processes, 1) + max(connections, 1))
+    preparing, loading = {}, {}
+
+    def handle(done):
+        for future in done:
+            if future in preparing:
+                entry, index = preparing.pop(future)
+                try:
+                    prepared = future.result()
+                except Exception as e:
+                    logger.error(f"Backfill shard {index + 1} failed to prepare: {e}")
+                    checkpoint.fail(entry, index)
+                    totals["failed"] += 1
+                    continue
+                if prepared.get("metrics"):
+                    METRICS.merge(prepared.pop("metrics"))
+                loading[io.submit(load_shard, prepared)] = (entry, index)
+            else:
+                entry, index = loading.pop(future)
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    logger.error(f"Backfill shard {index + 1} failed to load: {e}")
+                    checkpoint.fail(entry, index)
+                    totals["failed"] += 1
+                    continue
+                checkpoint.finish(entry, index, summary)
+                totals["shards"] += 1
+                for key in ("rows", "valid", "invalid", "new_rows", "duplicate_rows"):
+                    totals[key] += summary.get(key, 0)
+                elapsed = time.perf_counter() - started
+                logger.info(f"Backfill: {totals['shards']} shards, {totals['rows']} rows "
+                            f"({totals['rows'] / elapsed:,.0f} rows/s)")
+
+    try:
+        for source in expand_sources(sources):
+            entry = checkpoint.source(source, shard_rows)
+            header, shards = plan_shards(source, shard_rows)
+            done = set(entry["done"])
+            logger.info(f"Backfilling {source}: {len(shards)} shards, {len(done)} already loaded")
+            for index, (start, end) in enumerate(shards):
+                if index in done:
+                    totals["skipped"] += 1
+                    continue
+                while len(preparing) + len(loading) >= max_in_flight:
+                    handle(wait(list(preparing) + list(loading), return_when=FIRST_COMPLETED).done)
+                future = cpu.submit(prepare_shard, str(source), index, start, end, header)
+                preparing[future] = (entry, index)
+        while preparing or loading:
+            handle(wait(list(preparing) + list(loading), return_when=FIRST_COMPLETED).done)
+    finally:
+        cpu.shutdown(wait=True)
+        io.shutdown(wait=True)
+
+    if checkpoint.data["dropped_indexes"]:
+        if totals["failed"]:
+            logger.warning("Some shards failed; raw indexes stay dropped until a rerun loads them")
+        else:
+            with timed("rebuild_indexes"), db_connection() as conn:
+                with conn.cursor() as cur:
+                    rebuilt = rebuild_raw_indexes(cur, checkpoint.data["dropped_indexes"])
+                conn.commit()
+            logger.info(f"Rebuilt raw indexes: {', '.join(rebuilt) or 'none missing'}")
+            checkpoint.data["dropped_indexes"] = []
+            checkpoint.save()
+
+    totals["seconds"] = round(time.perf_counter() - started, 1)
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel backfill of large historical CSV files")
+    parser.add_argument("sources", nargs="+", help="CSV files or directories of CSV files")
+    parser.add_argument("--shard-rows", type=int, default=SHARD_ROWS)
+    parser.add_argument("--processes", type=int, default=BACKFILL_PROCESSES)
+    parser.add_argument("--connections", type=int, default=BACKFILL_CONNECTIONS)
+    parser.add_argument("--rebuild-indexes", action="store_true",
+                        help="Drop the raw table's indexes during the load and rebuild them afterwards")
+    parser.add_argument("--checkpoint", default=str(CHECKPOINT_FILE))
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and load everything again")
+    args = parser.parse_args(argv)
+
+    if args.connections > POOL_MAX_SIZE:
+        parser.error(f"--connections {args.connections} exceeds DB_POOL_MAX ({POOL_MAX_SIZE})")
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.data["sources"] = {}
+    try:
+        print(backfill(args.sources, args.shard_rows, args.processes, args.connections,
+                       args.rebuild_indexes, checkpoint))
+    finally:
+        close_pool()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
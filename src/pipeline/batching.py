@@ -0,0 +1,189 @@
+import os
+import time
+import queue
+import threading
+from loguru import logger
+
+from src.pipeline.metrics import timed
+from src.pipeline.runner import WRITE_SIDE_OUTPUTS, start_load, finish_load, move_to_failed, record_merge, file_writes
+from src.pipeline.anomaly import DETECTOR, anomaly_rows, detect_anomalies
+from src.database.db_utils import db_connection, DB_BREAKER, DATABASE_DOWN
+from src.database.load_raw_data import load_raw_batch, register_targets
+from src.database.load_aggregated_data import load_aggregated_batch
+from src.database.load_rollups import upsert_rollups
+from src.database.load_sketches import insert_sketches
+from src.database.load_alerts import insert_alerts
+from src.database.spool import SPOOL, derive_inserted
+
+# How long the first file of a batch waits for others to join it; 0 disables batching
+BATCH_WINDOW_MS = int(os.getenv("PIPELINE_BATCH_WINDOW_MS", "0"))
+# A batch is flushed early once it holds this many files or raw rows
+BATCH_MAX_FILES = int(os.getenv("PIPELINE_BATCH_MAX_FILES", "50"))
+BATCH_MAX_ROWS = int(os.getenv("PIPELINE_BATCH_MAX_ROWS", "500000"))
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    Coalesces prepared files into one bulk load and one commit.
+
+    Files queued by submit() are collected until the batch window expires
+    or the file or row cap is reached, and their raw rows and aggregates are
+    then written in a single transaction. Every row keeps its own file_name.
+    If the batch fails on a data error it is split in halves and retried,
+    so only the offending file ends up in failed/. While the database is
+    unreachable, whole batches go to the local spool instead.
+    """
+
+    def __init__(self, window_ms=BATCH_WINDOW_MS, max_files=BATCH_MAX_FILES, max_rows=BATCH_MAX_ROWS,
+                 side_outputs=WRITE_SIDE_OUTPUTS, queue_size=None):
+        self.window = window_ms / 1000
+        self.max_files = max(max_files, 1)
+        self.max_rows = max_rows
+        self.side_outputs = side_outputs
+        self.queue = queue.Queue(maxsize=queue_size or 2 * self.max_files)
+        self.thread = threading.Thread(target=self._run, name="pipeline-batcher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logger.info(
+            f"Micro-batching enabled: window {self.window * 1000:.0f} ms, "
+            f"up to {self.max_files} files / {self.max_rows} rows per commit"
+        )
+        return self
+
+    def submit(self, prepared, on_done=None):
+        """
+        Queues a prepared file (see prepare_file), blocking while the queue is full.
+
+        on_done(summary) is called from the batcher thread once the file's
+        batch is committed or the file has been split off as failed.
+        """
+        start_load(prepared, self.side_outputs)
+        self.queue.put((prepared, on_done))
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            rows = len(item[0]["df"])
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_files and rows < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                rows += len(item[0]["df"])
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        rows = sum(len(prepared["df"]) for prepared, _ in batch)
+        if SPOOL.bypass():
+            self._spool(batch)
+            return
+        try:
+            counts = self._load(batch, rows)
+        except DATABASE_DOWN as e:
+            # Splitting the batch would not help
+            DB_BREAKER.record_failure()
+            logger.error(f"Failed to load batch of {len(batch)} files: {e}")
+            if SPOOL.enabled:
+                self._spool(batch)
+                return
+            for item in batch:
+                self._fail(item)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"Failed to insert RAW data from {batch[0][0]['file_path']}: {e}")
+                self._fail(batch[0])
+                return
+            logger.warning(f"Batch of {len(batch)} files failed ({e}); splitting it")
+            middle = len(batch) // 2
+            self._flush(batch[:middle])
+            self._flush(batch[middle:])
+            return
+
+        DB_BREAKER.record_success()
+        elapsed = time.perf_counter() - started
+        logger.info(f"Committed batch of {len(batch)} files, {rows} rows in {elapsed:.3f}s")
+        for prepared, on_done in batch:
+            merged = counts.get(prepared["file_path"].name)
+            record_merge(prepared["summary"], merged)
+            self._done(on_done, finish_load(prepared, merged=merged))
+
+    def _load(self, batch, rows):
+        """
+        Loads the raw rows, aggregates, rollups, sketches and alerts of every
+        file in the batch in one transaction. Rollups, sketches and alerts
+        only cover the raw rows that were inserted (see derive_inserted).
+
+        Returns:
+            dict: New and duplicate raw row counts per file name.
+        """
+        # Register new devices and partitions first, so no second connection is needed mid-batch
+        for prepared, _ in batch:
+            register_targets(prepared["df"])
+        undo = []
+        try:
+            with timed("load_batch", rows), db_connection() as conn:
+                with conn.cursor() as cur:
+                    counts = load_raw_batch(cur, [(prepared["df"], prepared["file_path"].name)
+                                                  for prepared, _ in batch])
+                    load_aggregated_batch(cur, [prepared["agg_df"] for prepared, _ in batch])
+                    derived = []
+                    for prepared, _ in batch:
+                        name = prepared["file_path"].name
+                        derived.append({kind: derive_inserted(kind, df, prepared["df"], name, counts.get(name))
+                                        for kind, df in (("rollup", prepared["rollups"]),
+                                                         ("sketch", prepared["sketches"]),
+                                                         ("alert", anomaly_rows(prepared["transformed"])))})
+                    upsert_rollups(cur, [d["rollup"] for d in derived])
+                    for (prepared, _), d in zip(batch, derived):
+                        name = prepared["file_path"].name
+                        insert_sketches(cur, [d["sketch"]], name)
+                        insert_alerts(cur, detect_anomalies(d["alert"], undo), name)
+                conn.commit()
+        except Exception:
+            for token in reversed(undo):
+                DETECTOR.revert(token)
+            raise
+        return counts
+
+    def _spool(self, batch):
+        """Appends every file of a batch to the local spool, one record per file."""
+        for prepared, on_done in batch:
+            SPOOL.append(file_writes(prepared))
+            self._done(on_done, finish_load(prepared, "spooled"))
+        logger.warning(f"Spooled batch of {len(batch)} files")
+
+    def _fail(self, item):
+        prepared, on_done = item
+        move_to_failed(prepared["file_path"])
+        prepared["summary"]["status"] = "failed"
+        self._done(on_done, prepared["summary"])
+
+    def _done(self, on_done, summary):
+        if on_done is None:
+            return
+        try:
+            on_done(summary)
+        except Exception as e:
+            logger.error(f"Batch completion callback failed for {summary.get('file_name')}: {e}")
+
+    def shutdown(self):
+        """Flushes everything still queued and stops the batcher thread."""
+        self.queue.put(_STOP)
+        self.thread.join()
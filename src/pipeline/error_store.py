@@ -0,0 +1,371 @@
+"""
+Indexed SQLite store for validation errors and quarantined rows.
+
+Every validated file adds its error records, its quarantined rows (as JSON)
+and row/invalid counts per device and hour in one transaction. The CLI
+answers the usual questions from the indexes:
+
+    python -m src.pipeline.error_store rate [--device D] [--since 2020-07-12]
+    python -m src.pipeline.error_store errors --device D --column humidity
+    python -m src.pipeline.error_store quarantine --file dirty_1.csv
+    python -m src.pipeline.error_store export --file dirty_1.csv -o fix.csv
+    python -m src.pipeline.error_store resubmit fix.csv
+
+export writes quarantined rows with their quarantine_id to a CSV. After
+the rows are fixed, resubmit drops them into incoming/ as a new file. The
+watcher then validates and loads them like any other file.
+"""
+import os
+import sqlite3
+import argparse
+import threading
+from io import StringIO
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from src.pipeline import schema
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+STATE_DIR = BASE_DIR / "state"
+STATE_DIR.mkdir(exist_ok=True)
+INCOMING_DIR = BASE_DIR / "incoming"
+ERROR_STORE_FILE = Path(os.getenv("PIPELINE_ERROR_STORE", STATE_DIR / "errors.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS errors (
+    id           INTEGER PRIMARY KEY,
+    logged_at    TEXT NOT NULL,
+    file_name    TEXT NOT NULL,
+    row_idx      INTEGER,
+    device_id    TEXT,
+    hour         TEXT,
+    column_name  TEXT NOT NULL,
+    rule         TEXT,
+    value        TEXT,
+    message      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_errors_file ON errors(file_name, row_idx);
+CREATE INDEX IF NOT EXISTS idx_errors_device_hour ON errors(device_id, hour);
+CREATE INDEX IF NOT EXISTS idx_errors_column_device ON errors(column_name, device_id, hour);
+CREATE INDEX IF NOT EXISTS idx_errors_rule ON errors(rule, hour);
+CREATE INDEX IF NOT EXISTS idx_errors_logged_at ON errors(logged_at);
+
+CREATE TABLE IF NOT EXISTS quarantine (
+    id              INTEGER PRIMARY KEY,
+    file_name       TEXT NOT NULL,
+    row_idx         INTEGER,
+    device_id       TEXT,
+    hour            TEXT,
+    quarantined_at  TEXT NOT NULL,
+    data            TEXT NOT NULL,
+    resubmitted_at  TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_quarantine_file ON quarantine(file_name, row_idx);
+CREATE INDEX IF NOT EXISTS idx_quarantine_device_hour ON quarantine(device_id, hour);
+
+CREATE TABLE IF NOT EXISTS row_counts (
+    file_name  TEXT NOT NULL,
+    device_id  TEXT,
+    hour       TEXT,
+    rows       INTEGER NOT NULL,
+    invalid    INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_row_counts_device_hour ON row_counts(device_id, hour);
+CREATE INDEX IF NOT EXISTS idx_row_counts_file ON row_counts(file_name);
+"""
+
+
+def row_hours(df):
+    """Hour of each row's ts ("YYYY-MM-DD HH:00", UTC); None where ts is missing or invalid."""
+    if "ts" not in df.columns:
+        return pd.Series(None, index=df.index, dtype=object)
+    epochs = pd.to_numeric(df["ts"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    epochs = np.where(np.isfinite(epochs), epochs, np.nan)
+    hours = pd.Series(pd.to_datetime(epochs, unit="s", errors="coerce"), index=df.index).dt.floor("h")
+    return hours.dt.strftime("%Y-%m-%d %H:00").astype(object).where(hours.notna(), None)
+
+
+def _devices(df):
+    if "device" not in df.columns:
+        return pd.Series(None, index=df.index, dtype=object)
+    return df["device"].astype(object).where(df["device"].notna(), None)
+
+
+class ErrorStore:
+    """
+    Validation errors, quarantined rows and per-device/hour counts in SQLite.
+
+    Each process opens its own connection on first use (validation can run
+    in worker processes). WAL mode lets readers query while files are being
+    validated, and concurrent writers wait on the busy timeout.
+    """
+
+    def __init__(self, path=ERROR_STORE_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _write(self, statements):
+        """Runs (sql, rows) pairs with executemany in one transaction."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, rows in statements:
+                    if rows:
+                        conn.executemany(sql, rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def add_errors(self, records, hours=None):
+        """
+        Stores error records (file_name, row_idx, device_id, column, value, message[, rule]).
+
+        Args:
+            hours (Series): Hour of each row, indexed by row_idx (see row_hours).
+        """
+        if not records:
+            return
+        self._write([(_INSERT_ERRORS, self._error_rows(records, hours))])
+
+    def _error_rows(self, records, hours):
+        logged_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = []
+        for record in records:
+            file_name, row_idx, device_id, column, value, message = record[:6]
+            rule = record[6] if len(record) > 6 else None
+            hour = hours.get(row_idx) if hours is not None else None
+            rows.append((logged_at, file_name, _int(row_idx), device_id, hour, column, rule,
+                         None if value is None else str(value), message))
+        return rows
+
+    def record_validation(self, df, file_name, valid_mask, records, replace=True):
+        """
+        Stores the outcome of validating a DataFrame in one transaction.
+
+        Args:
+            df (DataFrame): The validated rows (valid and invalid).
+            file_name (str): Source file name.
+            valid_mask (Series): True for rows that passed.
+            records (list): Error records from evaluate_rules.
+            replace (bool): Drop what an earlier run stored for the file first
+                (False when a file is validated chunk by chunk).
+        """
+        hours = row_hours(df)
+        devices = _devices(df)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        invalid = df[~valid_mask]
+        data = invalid.to_json(orient="records", lines=True, date_format="iso").splitlines() if len(invalid) else []
+        quarantined = [
+            (file_name, _int(idx), dev, hour, now, line)
+            for idx, dev, hour, line in zip(invalid.index, devices[~valid_mask], hours[~valid_mask], data)
+        ]
+
+        counts = (
+            pd.DataFrame({"device_id": devices.fillna("").to_numpy(), "hour": hours.fillna("").to_numpy(),
+                          "invalid": (~valid_mask).to_numpy()})
+            .groupby(["device_id", "hour"])["invalid"].agg(["size", "sum"])
+            .reset_index()
+        )
+        count_rows = [
+            (file_name, dev or None, hour or None, int(size), int(bad))
+            for dev, hour, size, bad in counts.itertuples(index=False)
+        ]
+
+        statements = []
+        if replace:
+            statements += [(sql, [(file_name,)]) for sql in _CLEAR_FILE]
+        statements += [
+            (_INSERT_ERRORS, self._error_rows(records, hours)),
+            ("INSERT INTO quarantine (file_name, row_idx, device_id, hour, quarantined_at, data) "
+             "VALUES (?, ?, ?, ?, ?, ?)", quarantined),
+            ("INSERT INTO row_counts (file_name, device_id, hour, rows, invalid) VALUES (?, ?, ?, ?, ?)",
+             count_rows),
+        ]
+        self._write(statements)
+
+    def clear_file(self, file_name):
+        """Drops the errors, counts and not yet resubmitted quarantined rows of a file."""
+        self._write([(sql, [(file_name,)]) for sql in _CLEAR_FILE])
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return pd.read_sql_query(sql, self._connection(), params=params)
+
+    # Questions the CLI answers
+
+    def error_rate(self, device=None, since=None, until=None):
+        """Rows, invalid rows and error rate per device and hour."""
+        where, params = _filters(device=device, since=since, until=until)
+        return self.query(
+            f"""
+            SELECT device_id, hour, SUM(rows) AS rows, SUM(invalid) AS invalid,
+                   ROUND(1.0 * SUM(invalid) / SUM(rows), 4) AS error_rate
+            FROM row_counts {where}
+            GROUP BY device_id, hour ORDER BY device_id, hour
+            """,
+            params,
+        )
+
+    def errors(self, device=None, column=None, rule=None, file_name=None, since=None, until=None, limit=1000):
+        """Individual error records matching every given filter."""
+        where, params = _filters(device=device, column=column, rule=rule, file_name=file_name,
+                                 since=since, until=until)
+        return self.query(
+            f"SELECT logged_at, file_name, row_idx, device_id, hour, column_name, rule, value, message "
+            f"FROM errors {where} ORDER BY hour, file_name, row_idx LIMIT ?",
+            params + [limit],
+        )
+
+    def quarantined(self, file_name=None, device=None, since=None, until=None, include_resubmitted=False):
+        """Quarantined rows with their original values, one column per field."""
+        where, params = _filters(file_name=file_name, device=device, since=since, until=until)
+        if not include_resubmitted:
+            where += (" AND " if where else "WHERE ") + "resubmitted_at IS NULL"
+        meta = self.query(
+            f"SELECT id AS quarantine_id, file_name, row_idx, data FROM quarantine {where} ORDER BY id", params
+        )
+        if meta.empty:
+            return meta.drop(columns="data")
+        rows = pd.read_json(StringIO("\n".join(meta["data"])), lines=True, dtype=False)
+        return pd.concat([meta.drop(columns="data"), rows], axis=1)
+
+    def resubmit(self, csv_path, incoming_dir=INCOMING_DIR):
+        """
+        Drops fixed quarantined rows (an edited export) into the incoming folder.
+
+        Returns:
+            Path: The new incoming file.
+        """
+        fixed = pd.read_csv(csv_path, dtype=str, keep_default_na=False, na_values=schema.NA_VALUES)
+        if "quarantine_id" not in fixed.columns:
+            raise ValueError(f"{csv_path} has no quarantine_id column; create it with the export command")
+        missing = [c for c in schema.COLUMNS if c not in fixed.columns]
+        if missing:
+            raise ValueError(f"Missing columns in {csv_path}: {missing}")
+
+        stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        Path(incoming_dir).mkdir(exist_ok=True)
+        out = Path(incoming_dir) / f"{Path(csv_path).stem}_resubmit_{stamp}.csv"
+        # Written under a temporary name, so the watcher only sees the finished file
+        tmp = out.with_suffix(".tmp")
+        fixed[schema.COLUMNS].to_csv(tmp, index=False)
+        os.replace(tmp, out)
+
+        ids = [(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), int(i)) for i in fixed["quarantine_id"]]
+        self._write([("UPDATE quarantine SET resubmitted_at = ? WHERE id = ?", ids)])
+        logger.info(f"Resubmitted {len(ids)} quarantined rows as {out}")
+        return out
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_INSERT_ERRORS = (
+    "INSERT INTO errors (logged_at, file_name, row_idx, device_id, hour, column_name, rule, value, message) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+_CLEAR_FILE = [
+    "DELETE FROM errors WHERE file_name = ?",
+    "DELETE FROM row_counts WHERE file_name = ?",
+    "DELETE FROM quarantine WHERE file_name = ? AND resubmitted_at IS NULL",
+]
+
+_FILTER_COLUMNS = {"device": "device_id", "column": "column_name", "rule": "rule", "file_name": "file_name"}
+
+
+def _filters(since=None, until=None, **equal):
+    """WHERE clause for equality filters plus an hour range."""
+    clauses, params = [], []
+    for key, value in equal.items():
+        if value is not None:
+            clauses.append(f"{_FILTER_COLUMNS[key]} = ?")
+            params.append(value)
+    if since is not None:
+        clauses.append("hour >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("hour < ?")
+        params.append(until)
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+ERROR_STORE = ErrorStore()
+
+
+def _print(df):
+    print(df.to_string(index=False) if not df.empty else "(no rows)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_range(p):
+        p.add_argument("--since", help="first hour, e.g. 2020-07-12 or '2020-07-12 05:00'")
+        p.add_argument("--until", help="end hour (exclusive)")
+
+    rate = sub.add_parser("rate", help="error rate per device per hour")
+    rate.add_argument("--device")
+    add_range(rate)
+
+    errors = sub.add_parser("errors", help="error records")
+    errors.add_argument("--device")
+    errors.add_argument("--column")
+    errors.add_argument("--rule")
+    errors.add_argument("--file", dest="file_name")
+    errors.add_argument("--limit", type=int, default=1000)
+    add_range(errors)
+
+    for name, help_text in [("quarantine", "quarantined rows"), ("export", "export quarantined rows to CSV")]:
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--file", dest="file_name")
+        p.add_argument("--device")
+        add_range(p)
+        if name == "export":
+            p.add_argument("-o", "--output", required=True)
+
+    resubmit = sub.add_parser("resubmit", help="send fixed rows (an edited export) back through the pipeline")
+    resubmit.add_argument("csv")
+
+    args = parser.parse_args()
+    if args.command == "rate":
+        _print(ERROR_STORE.error_rate(args.device, args.since, args.until))
+    elif args.command == "errors":
+        _print(ERROR_STORE.errors(args.device, args.column, args.rule, args.file_name, args.since, args.until,
+                                  args.limit))
+    elif args.command in ("quarantine", "export"):
+        rows = ERROR_STORE.quarantined(args.file_name, args.device, args.since, args.until)
+        if args.command == "quarantine":
+            _print(rows)
+        else:
+            rows.drop(columns=["file_name", "row_idx"]).to_csv(args.output, index=False)
+            print(f"Exported {len(rows)} quarantined rows to {args.output}")
+    else:
+        print(f"Resubmitted as {ERROR_STORE.resubmit(args.csv)}")
@@ -0,0 +1,200 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+from src.pipeline.aggregation import NUMERIC_COLS, rollup_stats
+
+# Rollup query results kept by the read API
+CACHE_SIZE = int(os.getenv("PIPELINE_API_CACHE_SIZE", "256"))
+# Seconds a cached rollup query is served before it is read again
+CACHE_TTL = float(os.getenv("PIPELINE_API_CACHE_TTL", "60"))
+
+
+def _number(value):
+    """float for JSON, with NaN/NA as None."""
+    if value is None or pd.isna(value):
+        return None
+    return float(value)
+
+
+def _plain(value):
+    """Python scalar for JSON: NaN/NA become None, numpy scalars are unwrapped."""
+    if value is None or pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def finalize_bucket(stats, numeric_cols=NUMERIC_COLS):
+    """
+    Statistics of one bucket -> count/min/max/mean/std per sensor. Takes the
+    count/mean/M2 of partial_stats (the hot state) or the count/sum/sumsq
+    of a rollup table row.
+    """
+    out = {}
+    for col in numeric_cols:
+        n = stats.get(f"{col}_count") or 0
+        if f"{col}_m2" in stats:
+            mean = _number(stats.get(f"{col}_mean")) if n else None
+            var = (stats.get(f"{col}_m2") or 0.0) / (n - 1) if n > 1 else None
+        else:
+            total = stats.get(f"{col}_sum") or 0.0
+            mean = total / n if n else None
+            var = (stats.get(f"{col}_sumsq", 0.0) - total * mean) / (n - 1) if n > 1 else None
+        out[col] = {
+            "count": int(n),
+            "min": _number(stats.get(f"{col}_min")),
+            "max": _number(stats.get(f"{col}_max")),
+            "mean": mean,
+            "std": math.sqrt(max(var, 0.0)) if var is not None else None,
+        }
+    return out
+
+
+class HotState:
+    """
+    Latest reading and current-hour statistics of every device, in memory.
+
+    Updated with the transformed rows of each loaded file, so the read API
+    answers "latest state of device X" without a database query. The
+    current hour is the newest UTC hour of ts seen for the device; rows for
+    older hours only reach the rollup tables.
+    """
+
+    def __init__(self, numeric_cols=NUMERIC_COLS):
+        self.numeric_cols = list(numeric_cols)
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def _device(self, device_id):
+        return self._devices.setdefault(device_id, {"ts": None, "reading": None, "seen_at": None,
+                                                    "hour": None, "stats": None})
+
+    def _merge_hour(self, state, stats):
+        current = state["stats"]
+        for col in self.numeric_cols:
+            # Chan et al.'s parallel update of count, mean and M2
+            n_a, n_b = current.get(f"{col}_count") or 0, stats.get(f"{col}_count") or 0
+            if n_b:
+                mean_a = current.get(f"{col}_mean") if n_a else 0.0
+                delta = stats[f"{col}_mean"] - mean_a
+                n = n_a + n_b
+                current[f"{col}_mean"] = mean_a + delta * n_b / n
+                current[f"{col}_m2"] = ((current.get(f"{col}_m2") if n_a else 0.0) + stats[f"{col}_m2"]
+                                        + delta ** 2 * n_a * n_b / n)
+                current[f"{col}_count"] = n
+            for field, pick in (("min", min), ("max", max)):
+                key = f"{col}_{field}"
+                values = [v for v in (current.get(key), stats.get(key)) if v is not None and not pd.isna(v)]
+                current[key] = pick(values) if values else None
+        current["rows"] = current.get("rows", 0) + stats.get("rows", 0)
+
+    def update(self, df, device_col="device"):
+        """Folds the transformed rows of a file into the hot state."""
+        if df is None or df.empty:
+            return
+        rows = df[df["ts"].notna()]
+        if rows.empty:
+            return
+        latest = rows.sort_values("ts", kind="stable").groupby(device_col, observed=True).tail(1)
+        hours = rollup_stats(rows, device_col).to_dict("index")
+        seen_at = time.time()
+
+        with self._lock:
+            for record in latest.to_dict("records"):
+                state = self._device(str(record.pop(device_col)))
+                state["seen_at"] = seen_at
+                if state["ts"] is None or record["ts"] >= state["ts"]:
+                    state["ts"] = record.pop("ts")
+                    state["reading"] = record
+            for (device_id, hour), stats in sorted(hours.items(), key=lambda item: item[0][1]):
+                state = self._device(str(device_id))
+                if state["hour"] is None or hour > state["hour"]:
+                    state["hour"], state["stats"] = hour, dict(stats)
+                elif hour == state["hour"]:
+                    self._merge_hour(state, stats)
+
+    def devices(self):
+        """Every known device with its last ts and the time it was last loaded."""
+        with self._lock:
+            return {device_id: {"ts": s["ts"], "seen_at": s["seen_at"]} for device_id, s in self._devices.items()}
+
+    def get(self, device_id):
+        """
+        Latest state of one device.
+
+        Returns:
+            dict: ts (UTC), reading, seen_at (epoch seconds) and the current
+            hour's count/min/max/mean/std per sensor; None for an unknown device.
+        """
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is None:
+                return None
+            state = {**state, "reading": dict(state["reading"] or {}), "stats": dict(state["stats"] or {})}
+        return {
+            "device_id": device_id,
+            "ts": state["ts"],
+            "seen_at": state["seen_at"],
+            "reading": {key: _plain(value) for key, value in state["reading"].items()},
+            "hour": state["hour"],
+            "hour_stats": finalize_bucket(state["stats"], self.numeric_cols) if state["stats"] else None,
+        }
+
+
+class TTLCache:
+    """
+    Small LRU cache whose entries also expire after `ttl` seconds.
+
+    Keys are tuples starting with a device id, so invalidate() can drop every
+    entry of the devices whose data changed.
+    """
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, load):
+        """Returns the cached value for key, calling load() on a miss or expiry."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = load()
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, device_ids=None):
+        """Drops the entries of the given devices (all entries for None)."""
+        with self._lock:
+            if device_ids is None:
+                self._entries.clear()
+                return
+            device_ids = set(device_ids)
+            for key in [k for k in self._entries if k[0] in device_ids]:
+                del self._entries[key]
+
+
+HOT_STATE = HotState()
+ROLLUP_CACHE = TTLCache()
+
+
+def record_load(transformed, device_col="device"):
+    """Updates the hot state after a file was loaded and drops its devices' cached rollups."""
+    if transformed is None or transformed.empty:
+        return
+    HOT_STATE.update(transformed, device_col)
+    ROLLUP_CACHE.invalidate(str(d) for d in transformed[device_col].unique())
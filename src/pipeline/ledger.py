@@ -0,0 +1,179 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from pathlib import Path
+from loguru import logger
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+STATE_DIR = BASE_DIR / "state"
+STATE_DIR.mkdir(exist_ok=True)
+LEDGER_FILE = Path(os.getenv("PIPELINE_LEDGER", STATE_DIR / "ledger.db"))
+
+# A file whose content reached one of these stages is never processed again
+# ("spooled": its DB writes are in the local spool and will be replayed)
+DONE_STAGES = ("loaded", "spooled")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    content_hash  TEXT PRIMARY KEY,
+    file_name     TEXT NOT NULL,
+    size          INTEGER NOT NULL,
+    mtime         REAL NOT NULL,
+    stage         TEXT NOT NULL,
+    rows          INTEGER,
+    valid         INTEGER,
+    invalid       INTEGER,
+    aggregates    INTEGER,
+    claimed_at    TEXT,
+    finished_at   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_files_name_size_mtime ON files(file_name, size, mtime);
+
+-- Tail mode: how far each growing file has been processed
+CREATE TABLE IF NOT EXISTS tail_offsets (
+    path        TEXT PRIMARY KEY,
+    inode       INTEGER NOT NULL,
+    offset      INTEGER NOT NULL,
+    rows        INTEGER NOT NULL,
+    header      TEXT,
+    updated_at  TEXT
+);
+"""
+
+
+def file_hash(file_path, block_size=1 << 20):
+    """BLAKE2b digest of a file's content, read in 1 MB blocks."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Ledger:
+    """
+    Durable record of every incoming file, keyed by content hash.
+
+    Stores name, size, mtime, the stage reached and row counts in SQLite,
+    so a restarted watcher neither reprocesses finished files nor misses
+    files that arrived while it was down.
+    """
+
+    def __init__(self, path=LEDGER_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._active = set()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def pending(self, directory, finished=()):
+        """
+        Incoming CSVs that still need processing, in name order.
+
+        A file is skipped without hashing when a finished entry with the same
+        name, size and mtime exists, here or in `finished` (e.g. files other
+        watchers loaded). Anything else is returned, and claim() decides by
+        content.
+        """
+        finished = set(finished)
+        todo = []
+        with self._lock:
+            for path in sorted(Path(directory).glob("*.csv")):
+                st = path.stat()
+                key = (path.name, st.st_size, st.st_mtime)
+                if key in finished:
+                    continue
+                # One lookup per listed file on idx_files_name_size_mtime
+                done = self._conn.execute(
+                    "SELECT 1 FROM files WHERE file_name = ? AND size = ? AND mtime = ? AND stage IN (?, ?) LIMIT 1",
+                    key + tuple(DONE_STAGES),
+                ).fetchone()
+                if done is None:
+                    todo.append(path)
+        return todo
+
+    def claim(self, file_path):
+        """
+        Marks a file as in progress.
+
+        Returns:
+            str: The content hash to pass to finish(), or None if the same
+            content was already loaded or is being processed right now.
+        """
+        st = os.stat(file_path)
+        content_hash = file_hash(file_path)
+        with self._lock:
+            if content_hash in self._active:
+                return None
+            row = self._conn.execute(
+                "SELECT stage FROM files WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if row is not None and row[0] in DONE_STAGES:
+                return None
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO files (content_hash, file_name, size, mtime, stage, claimed_at)
+                VALUES (?, ?, ?, ?, 'queued', ?)
+                """,
+                (content_hash, Path(file_path).name, st.st_size, st.st_mtime, datetime.now().isoformat()),
+            )
+            self._active.add(content_hash)
+        return content_hash
+
+    def finish(self, content_hash, summary):
+        """Records the stage a claimed file reached and its row counts."""
+        with self._lock:
+            self._conn.execute(
+                """
+                UPDATE files
+                SET stage = ?, rows = ?, valid = ?, invalid = ?, aggregates = ?, finished_at = ?
+                WHERE content_hash = ?
+                """,
+                (
+                    summary.get("status", "loaded"),
+                    summary.get("rows"),
+                    summary.get("valid"),
+                    summary.get("invalid"),
+                    summary.get("aggregates"),
+                    datetime.now().isoformat(),
+                    content_hash,
+                ),
+            )
+            self._active.discard(content_hash)
+
+    def release(self, content_hash):
+        """Gives up a claim without finishing it, e.g. when another watcher holds the file."""
+        with self._lock:
+            self._active.discard(content_hash)
+
+    def tail_offset(self, path):
+        """
+        Tail-mode position of a file.
+
+        Returns:
+            dict: inode, offset (bytes consumed), rows and header, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT inode, offset, rows, header FROM tail_offsets WHERE path = ?", (str(path),)
+            ).fetchone()
+        if row is None:
+            return None
+        inode, offset, rows, header = row
+        return {"inode": inode, "offset": offset, "rows": rows, "header": header.split(",") if header else None}
+
+    def save_tail_offset(self, path, inode, offset, rows, header):
+        """Records how far a file has been processed in tail mode."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tail_offsets (path, inode, offset, rows, header, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(path), inode, offset, rows, ",".join(header) if header else None, datetime.now().isoformat()),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,305 @@
+import os
+import time
+import heapq
+import cProfile
+import threading
+import functools
+import multiprocessing
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from loguru import logger
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+LOGS_DIR = BASE_DIR / "logs"
+
+# Port for the Prometheus text endpoint (/metrics); 0 disables it
+METRICS_PORT = int(os.getenv("PIPELINE_METRICS_PORT", "0"))
+# Interface the metrics endpoint listens on
+METRICS_HOST = os.getenv("PIPELINE_METRICS_HOST", "127.0.0.1")
+# Metrics are also written to this file every PIPELINE_METRICS_INTERVAL seconds; empty disables it
+METRICS_FILE = os.getenv("PIPELINE_METRICS_FILE", str(LOGS_DIR / "metrics.prom"))
+METRICS_INTERVAL = float(os.getenv("PIPELINE_METRICS_INTERVAL", "15"))
+# Opt-in cProfile of every file; the PIPELINE_PROFILE_TOP slowest are kept under logs/profiles/
+PROFILE = os.getenv("PIPELINE_PROFILE", "0") == "1"
+PROFILE_TOP = int(os.getenv("PIPELINE_PROFILE_TOP", "5"))
+PROFILE_DIR = LOGS_DIR / "profiles"
+
+# Latency buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+HELP = {
+    "pipeline_stage_seconds": ("histogram", "Time spent in each pipeline stage"),
+    "pipeline_stage_rows_total": ("counter", "Rows handled by each pipeline stage"),
+    "pipeline_stage_rows_per_second": ("gauge", "Throughput of the last call of each stage"),
+    "pipeline_bytes_read_total": ("counter", "Bytes of incoming files read"),
+    "pipeline_files_total": ("counter", "Incoming files by final status"),
+    "pipeline_file_seconds": ("histogram", "Processing time per file, from pickup to DB commit"),
+    "pipeline_file_lag_seconds": ("histogram", "Lag from file creation (mtime) to DB commit"),
+    "pipeline_db_retries_total": ("counter", "Retried DB calls after connection errors"),
+    "pipeline_queue_depth": ("gauge", "Items waiting in the pipeline queues"),
+    "pipeline_tail_chunks_total": ("counter", "Appended parts of tailed files by status"),
+    "pipeline_alerts_total": ("counter", "Readings flagged by the anomaly detector, by sensor"),
+    "pipeline_spool_records_total": ("counter", "Spool records by event (spooled, replayed, failed)"),
+    "pipeline_raw_rows_total": ("counter", "Raw rows merged, by outcome (new, duplicate)"),
+    "pipeline_db_breaker_open_total": ("counter", "Times the DB circuit breaker opened"),
+}
+
+
+def _label_str(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class Metrics:
+    """
+    Thread-safe in-process counters, gauges and histograms.
+
+    render() produces the Prometheus text exposition format. Metrics
+    recorded in a worker process are shipped back with drain() and merge().
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.callbacks = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist[0][i] += 1
+                    break
+            hist[1] += value
+            hist[2] += 1
+
+    def gauge_callback(self, name, func, **labels):
+        """Registers a gauge that is read from func() each time metrics are rendered."""
+        with self._lock:
+            self.callbacks[self._key(name, labels)] = func
+
+    def drain(self):
+        """Returns the counters, gauges and histograms recorded so far and resets them."""
+        with self._lock:
+            state = {"counters": self.counters, "gauges": self.gauges, "histograms": self.histograms}
+            self.counters, self.gauges, self.histograms = {}, {}, {}
+        return state
+
+    def merge(self, state):
+        """Adds metrics drained from another process."""
+        with self._lock:
+            for key, value in state["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.gauges.update(state["gauges"])
+            for key, (counts, total, count) in state["histograms"].items():
+                hist = self.histograms.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+                hist[0] = [a + b for a, b in zip(hist[0], counts)]
+                hist[1] += total
+                hist[2] += count
+
+    def render(self):
+        """Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {key: (list(c), s, n) for key, (c, s, n) in self.histograms.items()}
+            callbacks = dict(self.callbacks)
+        for key, func in callbacks.items():
+            try:
+                gauges[key] = func()
+            except Exception as e:
+                logger.debug(f"Metric callback {key[0]} failed: {e}")
+
+        series = {}
+        for (name, labels), value in sorted(counters.items()):
+            series.setdefault(name, []).append(f"{name}{_label_str(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            series.setdefault(name, []).append(f"{name}{_label_str(labels)} {value}")
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_label_str(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_label_str(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_label_str(labels)} {total}")
+            lines.append(f"{name}_count{_label_str(labels)} {count}")
+
+        out = []
+        for name in sorted(series):
+            kind, text = HELP.get(name, ("untyped", name))
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(series[name])
+        return "\n".join(out) + "\n"
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def timed(stage, rows=0):
+    """Records the latency, row count and rows/sec of one call of a pipeline stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        METRICS.observe("pipeline_stage_seconds", elapsed, stage=stage)
+        if rows:
+            METRICS.inc("pipeline_stage_rows_total", rows, stage=stage)
+            METRICS.set("pipeline_stage_rows_per_second", round(rows / elapsed, 1) if elapsed else 0, stage=stage)
+
+
+def stage(name):
+    """Decorator form of timed(); the row count is the length of the first argument (a DataFrame)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(df, *args, **kwargs):
+            with timed(name, len(df) if df is not None else 0):
+                return func(df, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def in_worker_process():
+    return multiprocessing.current_process().name != "MainProcess"
+
+
+def write_metrics_file(path=METRICS_FILE):
+    """Writes the current metrics atomically, so readers never see a partial file."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(METRICS.render())
+    os.replace(tmp, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsExporter:
+    """Serves /metrics over HTTP and/or rewrites the metrics file periodically."""
+
+    def __init__(self, port=METRICS_PORT, path=METRICS_FILE, interval=METRICS_INTERVAL, host=METRICS_HOST):
+        self.port = port
+        self.host = host
+        self.path = path
+        self.interval = interval
+        self.server = None
+        self._stop = threading.Event()
+        self._writer = None
+
+    def start(self):
+        if self.port:
+            self.server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+            threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+            logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        if self.path:
+            self._writer = threading.Thread(target=self._write_loop, name="metrics-file", daemon=True)
+            self._writer.start()
+            logger.info(f"Writing metrics to {self.path} every {self.interval:g}s")
+        return self
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                write_metrics_file(self.path)
+            except OSError as e:
+                logger.error(f"Failed to write metrics file: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+        if self.path:
+            write_metrics_file(self.path)
+
+
+class SlowestProfiles:
+    """
+    Opt-in cProfile of each file; only the profiles of the slowest files are kept.
+
+    Profiles are written as logs/profiles/<file>.prof and can be read with
+    `python -m pstats` or snakeviz. Only the calling thread is profiled, so
+    CPU stages running in worker processes are not included. One file is
+    profiled at a time: Python allows a single active profiler, so files
+    that start while another is profiled run unprofiled.
+    """
+
+    def __init__(self, top=PROFILE_TOP, directory=PROFILE_DIR, enabled=PROFILE):
+        self.top = top
+        self.directory = Path(directory)
+        self.enabled = enabled and top > 0
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+        self._slowest = []
+
+    @contextmanager
+    def profile(self, name):
+        if not self.enabled or not self._active.acquire(blocking=False):
+            yield
+            return
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                self._keep(time.perf_counter() - started, name, profiler)
+        finally:
+            self._active.release()
+
+    def _keep(self, elapsed, name, profiler):
+        with self._lock:
+            if len(self._slowest) >= self.top and elapsed <= self._slowest[0][0]:
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / f"{Path(name).name}.prof"
+            profiler.dump_stats(path)
+            heapq.heappush(self._slowest, (elapsed, str(path)))
+            if len(self._slowest) > self.top:
+                _, evicted = heapq.heappop(self._slowest)
+                if evicted != str(path):
+                    Path(evicted).unlink(missing_ok=True)
+        logger.info(f"Profiled {name} ({elapsed:.3f}s) -> {path}")
+
+
+PROFILER = SlowestProfiles()
@@ -0,0 +1,152 @@
+import os
+import json
+import threading
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+from loguru import logger
+
+from src.pipeline.hot_state import HOT_STATE, ROLLUP_CACHE, finalize_bucket
+from src.database.db_utils import db_connection, db_retry
+from src.database.load_rollups import ROLLUP_TABLES, STAT_COLUMNS
+from src.database.load_sketches import query_sketch
+from src.pipeline.aggregation import NUMERIC_COLS
+
+# Port of the local HTTP/JSON read API; 0 disables it
+API_PORT = int(os.getenv("PIPELINE_API_PORT", "0"))
+# Interface the read API listens on
+API_HOST = os.getenv("PIPELINE_API_HOST", "127.0.0.1")
+
+# Range returned by /devices/<id>/rollups when no start is given
+DEFAULT_SPAN = {"hour": "24h", "day": "30D"}
+
+
+def _json_default(value):
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+@db_retry
+def query_rollups(device_id, size, start, end):
+    """Rollup rows of one device from the database, finalized to count/min/max/mean/std."""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT r.bucket_start, r.row_count, {', '.join('r.' + c for c in STAT_COLUMNS)} "
+                f"FROM {ROLLUP_TABLES[size]} r JOIN raw.devices d USING (device_key) "
+                f"WHERE d.device_id = %s AND r.bucket_start >= %s AND r.bucket_start < %s "
+                f"ORDER BY r.bucket_start",
+                (device_id, start.to_pydatetime(), end.to_pydatetime()),
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    out = []
+    for bucket_start, row_count, *values in rows:
+        stats = dict(zip(STAT_COLUMNS, (float(v) if v is not None else None for v in values)))
+        out.append({"bucket_start": pd.Timestamp(bucket_start), "rows": row_count, **finalize_bucket(stats)})
+    return out
+
+
+def _range(start, end, span):
+    """Query bounds; the default end is rounded to the minute, so repeated queries share cache entries."""
+    end = pd.Timestamp(end).floor("min") if end else pd.Timestamp.now().floor("min") + pd.Timedelta(minutes=1)
+    return (pd.Timestamp(start) if start else end - pd.Timedelta(span)), end
+
+
+def get_rollups(device_id, size="hour", start=None, end=None):
+    """
+    Rollups of one device through the TTL cache.
+
+    start/end are timestamps in the database session time zone; the default
+    is the last day of hourly or the last 30 days of daily buckets.
+    """
+    if size not in ROLLUP_TABLES:
+        raise ValueError(f"Unknown rollup size: {size}")
+    start, end = _range(start, end, DEFAULT_SPAN[size])
+    return ROLLUP_CACHE.get((device_id, size, start, end), lambda: query_rollups(device_id, size, start, end))
+
+
+def get_quantiles(device_id, sensor, qs=(0.5, 0.95, 0.99), start=None, end=None):
+    """Quantiles of one sensor from the merged hourly sketches, with the merged sketch cached."""
+    if sensor not in NUMERIC_COLS:
+        raise ValueError(f"Unknown sensor: {sensor}")
+    start, end = _range(start, end, DEFAULT_SPAN["hour"])
+    sketch = ROLLUP_CACHE.get((device_id, "sketch", sensor, start, end),
+                              lambda: query_sketch(device_id, sensor, start, end))
+    if sketch is None:
+        return {"count": 0, "quantiles": {}}
+    return {"count": sketch.count, "min": sketch.min, "max": sketch.max,
+            "quantiles": {f"p{q * 100:g}": sketch.quantile(q) for q in qs}}
+
+
+class _ReadHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [unquote(p) for p in url.path.strip("/").split("/") if p]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if parts == ["health"]:
+                self._send(200, {"status": "ok", "devices": len(HOT_STATE.devices()),
+                                 "cache": {"hits": ROLLUP_CACHE.hits, "misses": ROLLUP_CACHE.misses}})
+            elif parts == ["devices"]:
+                self._send(200, HOT_STATE.devices())
+            elif len(parts) == 2 and parts[0] == "devices":
+                state = HOT_STATE.get(parts[1])
+                if state is None:
+                    self._send(404, {"error": f"Unknown device: {parts[1]}"})
+                else:
+                    self._send(200, state)
+            elif len(parts) == 3 and parts[0] == "devices" and parts[2] == "rollups":
+                rows = get_rollups(parts[1], query.get("size", "hour"), query.get("start"), query.get("end"))
+                self._send(200, rows)
+            elif len(parts) == 3 and parts[0] == "devices" and parts[2] == "quantiles":
+                qs = [float(q) for q in query.get("q", "0.5,0.95,0.99").split(",")]
+                self._send(200, get_quantiles(parts[1], query.get("sensor", "temp"), qs,
+                                              query.get("start"), query.get("end")))
+            else:
+                self._send(404, {"error": "Not found"})
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            logger.error(f"Read API request {self.path} failed: {e}")
+            self._send(503, {"error": "Rollups unavailable"})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, default=_json_default).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReadApi:
+    """
+    Local HTTP/JSON API over the hot device state and the rollup tables.
+
+    GET /devices                  known devices, last ts and last load time
+    GET /devices/<id>             latest reading and current-hour stats (memory only)
+    GET /devices/<id>/rollups     ?size=hour|day&start=&end= from the rollup tables, cached
+    GET /devices/<id>/quantiles   ?sensor=&q=0.5,0.95&start=&end= from the merged sketches, cached
+    GET /health                   device count and cache hit/miss counters
+    """
+
+    def __init__(self, port=API_PORT, host=API_HOST):
+        self.port = port
+        self.host = host
+        self.server = None
+
+    def start(self):
+        if self.port:
+            self.server = ThreadingHTTPServer((self.host, self.port), _ReadHandler)
+            threading.Thread(target=self.server.serve_forever, name="read-api", daemon=True).start()
+            logger.info(f"Serving the read API on http://{self.host}:{self.port}/devices")
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
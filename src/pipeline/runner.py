@@ -0,0 +1,248 @@
+import os
+import time
+import shutil
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+from src.pipeline.validation import validate_df, save_archive
+from src.pipeline.transformation import transform_df, save_transformed
+from src.pipeline.aggregation import aggregate_df, save_aggregates, rollup_stats
+from src.pipeline.windowing import process_windows
+from src.pipeline.hot_state import record_load
+from src.pipeline.sketches import sketch_stats, SKETCHES_ENABLED
+from src.pipeline.anomaly import anomaly_rows
+from src.pipeline.metrics import METRICS, timed, in_worker_process
+from src.pipeline import schema
+from src.database.spool import SPOOL, inserted_rows
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+FAILED_DIR = BASE_DIR / "failed"
+FAILED_DIR.mkdir(exist_ok=True)
+
+# archive/, transformed_data/ and aggregated_data/ copies are not needed by any
+# later stage in memory mode, so they are written by a background thread.
+WRITE_SIDE_OUTPUTS = os.getenv("PIPELINE_SIDE_OUTPUTS", "1") == "1"
+
+_side_output_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="side-output")
+
+
+def file_signature(file_path):
+    """(size, mtime in ns) of a file, or None if it cannot be read."""
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def wait_until_stable(file_path, interval=0.05, timeout=10):
+    """
+    Waits until a file's size and mtime stop changing instead of sleeping a fixed time.
+
+    Returns:
+        bool: True if the file became stable before the timeout.
+    """
+    deadline = time.time() + timeout
+    last = None
+    while time.time() < deadline:
+        current = file_signature(file_path)
+        if current is not None and current[0] > 0 and current == last:
+            return True
+        last = current
+        time.sleep(interval)
+    return False
+
+
+def _log_side_output_failure(future):
+    if future.exception() is not None:
+        logger.error(f"Failed to write side output: {future.exception()}")
+
+
+def write_side_output(func, *args):
+    """Queues a side-output write so it runs off the critical path."""
+    future = _side_output_pool.submit(func, *args)
+    future.add_done_callback(_log_side_output_failure)
+    return future
+
+
+def flush_side_outputs():
+    """Blocks until every queued side-output write has finished."""
+    _side_output_pool.shutdown(wait=True)
+
+
+def prepare_file(file_path):
+    """
+    Runs the CPU-bound stages (parse, validate, transform, aggregate) on one file.
+
+    Only picklable values are returned, so this can run in a worker process.
+    The error log and quarantine file are written here; the rest is left to
+    load_prepared.
+
+    Returns:
+        dict: The parsed, valid, transformed and aggregated frames plus a summary.
+    """
+    file_path = Path(file_path)
+
+    # Parse once; every stage below works on this frame
+    with timed("read"):
+        df = schema.read_csv(file_path)
+    return prepare_frame(df, file_path)
+
+
+def prepare_frame(df, file_path, append_quarantine=False, aggregate=True):
+    """
+    prepare_file for a frame that is already parsed, e.g. lines appended to a
+    file in tail mode (append_quarantine=True keeps what earlier parts stored,
+    aggregate=False skips the per-file aggregates).
+    """
+    file_path = Path(file_path)
+    file_name = file_path.name
+    summary = {"file_name": file_name, "rows": len(df), "valid": 0, "invalid": 0, "aggregates": 0}
+
+    # Step 1: Validate
+    valid_rows, invalid_rows = validate_df(df, file_name, write_archive=False,
+                                           append_quarantine=append_quarantine)
+    summary["valid"], summary["invalid"] = len(valid_rows), len(invalid_rows)
+
+    # Step 2 + 3: Transform and aggregate the valid rows
+    transformed = agg_df = rollups = sketches = None
+    if not valid_rows.empty:
+        transformed = transform_df(valid_rows)
+        rollups = rollup_stats(transformed)
+        if SKETCHES_ENABLED:
+            with timed("sketch", len(transformed)):
+                sketches = sketch_stats(transformed)
+        if aggregate:
+            agg_df = aggregate_df(transformed, file_name)
+            summary["aggregates"] = len(agg_df)
+
+    return {
+        "file_path": file_path,
+        "df": df,
+        "valid_rows": valid_rows,
+        "transformed": transformed,
+        "agg_df": agg_df,
+        "rollups": rollups,
+        "sketches": sketches,
+        "summary": summary,
+        # Metrics recorded in a worker process are merged back by start_load
+        "metrics": METRICS.drain() if in_worker_process() else None,
+    }
+
+
+def move_to_failed(file_path):
+    """Moves an incoming file whose raw rows could not be loaded to failed/."""
+    file_path = Path(file_path)
+    if file_path.exists():
+        shutil.move(file_path, FAILED_DIR / file_path.name)
+
+
+def start_load(prepared, side_outputs=WRITE_SIDE_OUTPUTS):
+    """Logs the validation result and queues the side outputs of a prepared file."""
+    file_path = prepared["file_path"]
+    file_name = file_path.name
+    agg_df = prepared["agg_df"]
+
+    if prepared.get("metrics"):
+        METRICS.merge(prepared.pop("metrics"))
+
+    if prepared["summary"]["invalid"] == 0:
+        logger.info(f"All rows in {file_path} valid")
+    else:
+        logger.warning(f"Some rows in {file_path} failed validation")
+
+    if side_outputs and agg_df is not None:
+        write_side_output(save_archive, prepared["valid_rows"], file_name)
+        write_side_output(save_transformed, prepared["transformed"], file_name)
+        write_side_output(save_aggregates, agg_df, file_name)
+
+
+def file_writes(prepared):
+    """
+    The spool writes of a prepared file: raw rows, aggregates, rollups,
+    sketches and the rows to score for anomalies. Anomaly detection keeps
+    shared per-device state, so it runs when the writes are applied, on the
+    rows the raw merge inserted.
+    """
+    name = prepared["file_path"].name
+    return [("raw", prepared["df"], name), ("aggregated", prepared["agg_df"], name),
+            ("rollup", prepared["rollups"], name), ("sketch", prepared["sketches"], name),
+            ("alert", anomaly_rows(prepared["transformed"]), name)]
+
+
+def finish_load(prepared, status="loaded", merged=None):
+    """
+    Updates the cross-file time windows and the read API's hot state once a
+    file's rows are in the database (status "loaded") or in the local spool
+    (status "spooled").
+
+    Args:
+        merged: The file's merge_raw_rows counts; only the rows it inserted
+            are added, so a file loaded again adds nothing.
+    """
+    summary = prepared["summary"]
+    transformed = inserted_rows(prepared["transformed"], merged)
+    record_load(transformed)
+    summary["closed_windows"] = process_windows(transformed, prepared["file_path"].name)
+    summary["status"] = status
+    return summary
+
+
+def record_merge(summary, counts):
+    """Adds the new and duplicate raw row counts of a load to a file summary."""
+    if not counts:
+        return
+    summary["new_rows"] = summary.get("new_rows", 0) + counts["new"]
+    summary["duplicate_rows"] = summary.get("duplicate_rows", 0) + counts["duplicates"]
+
+
+def load_prepared(prepared, side_outputs=WRITE_SIDE_OUTPUTS, on_failed=None):
+    """
+    Queues the side outputs and loads the raw and aggregated rows of a prepared file.
+
+    Args:
+        on_failed: Called with the prepared dict when the rows are rejected;
+            defaults to moving the incoming file to failed/.
+
+    Returns:
+        dict: Row counts for the processed file.
+    """
+    file_path = prepared["file_path"]
+    file_name = file_path.name
+    summary = prepared["summary"]
+
+    start_load(prepared, side_outputs)
+
+    # Step 4: Load raw data, aggregates, rollups, sketches and alerts into the database, in one
+    # transaction; they go to the local spool while the database is down
+    counts = {}
+    try:
+        logger.info(f"Inserting RAW and AGGREGATED data into DB from {file_path}")
+        status = SPOOL.write(file_writes(prepared), counts)
+    except Exception as e:
+        logger.error(f"Failed to insert RAW data: {e}")
+        if on_failed is not None:
+            on_failed(prepared)
+        else:
+            move_to_failed(file_path)
+        summary["status"] = "failed"
+        return summary
+    record_merge(summary, counts.get(file_name))
+
+    # Step 5: Update the cross-file time windows
+    return finish_load(prepared, status, counts.get(file_name))
+
+
+def run_file(file_path, side_outputs=WRITE_SIDE_OUTPUTS):
+    """
+    Runs validate -> transform -> aggregate -> load on a single parsed DataFrame.
+
+    Args:
+        file_path (Path): The incoming CSV file.
+        side_outputs (bool): Whether to write archive/transformed/aggregated copies.
+
+    Returns:
+        dict: Row counts for the processed file.
+    """
+    return load_prepared(prepare_file(file_path), side_outputs)
@@ -0,0 +1,164 @@
+import io
+import os
+import time
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    _HAVE_PYARROW = True
+except ImportError:
+    _HAVE_PYARROW = False
+
+# Columns of an incoming sensor file, in file order
+COLUMNS = ["ts", "device", "co", "humidity", "light", "lpg", "motion", "smoke", "temp"]
+SENSOR_COLS = ["temp", "humidity", "co", "lpg", "smoke"]
+BOOL_COLS = ["light", "motion"]
+
+# In memory: device is dictionary encoded, readings are float32 (the sensors
+# report far fewer significant digits) and ts stays float64 epoch seconds.
+# Statistics are always accumulated in float64.
+DTYPES = {
+    "ts": "float64",
+    "device": "category",
+    "co": "float32",
+    "humidity": "float32",
+    "light": "boolean",
+    "lpg": "float32",
+    "motion": "boolean",
+    "smoke": "float32",
+    "temp": "float32",
+}
+
+# Stage outputs keep the raw dtypes except ts, which is a datetime string there
+STAGE_DTYPES = {col: dtype for col, dtype in DTYPES.items() if col != "ts"}
+
+# aggregated_data/ files: metadata plus min/max/mean/std per sensor column
+AGGREGATE_DTYPES = {
+    "file_name": "str",
+    "processed_at": "str",
+    "device_id": "category",
+    **{f"{col}_{stat}": "float64" for col in SENSOR_COLS for stat in ["min", "max", "mean", "std"]},
+}
+
+# Cells read as missing: the tokens pandas treats as NA by default, made explicit
+NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+# Text accepted for the boolean columns
+BOOL_VALUES = {"TRUE": True, "FALSE": False, "1": True, "0": False}
+
+# Oldest accepted reading time; earlier ts values (e.g. 0) are treated as corrupt
+TS_MIN = pd.Timestamp(os.getenv("PIPELINE_TS_MIN", "2000-01-01"), tz="UTC").timestamp()
+# How far a reading time may lie ahead of the clock
+TS_MAX_FUTURE_DAYS = float(os.getenv("PIPELINE_TS_MAX_FUTURE_DAYS", "1"))
+
+# pyarrow's multithreaded parser when available; PIPELINE_CSV_ENGINE=c forces the pandas parser
+CSV_ENGINE = os.getenv("PIPELINE_CSV_ENGINE", "pyarrow" if _HAVE_PYARROW else "c")
+
+
+def ts_in_window(epochs):
+    """True for epoch seconds between TS_MIN and TS_MAX_FUTURE_DAYS from now; NaN is False."""
+    epochs = np.asarray(epochs, dtype="float64")
+    return (epochs >= TS_MIN) & (epochs <= time.time() + TS_MAX_FUTURE_DAYS * 86400)
+
+
+def read_header(path):
+    """Column names of a CSV file, read from its first line only."""
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def parse_header(line):
+    """Column names from a header line given as bytes (quoted names are unquoted)."""
+    return read_header(io.BytesIO(line.rstrip(b"\r\n") + b"\n"))
+
+
+def _coerce(df, dtypes):
+    """
+    Applies the schema column by column to a frame read as text.
+
+    A column is converted only if every non-missing cell parses, so a
+    malformed value keeps its whole column as text and validation can
+    still quarantine the row with the original value.
+    """
+    for col, dtype in dtypes.items():
+        if col not in df.columns or dtype == "str":
+            continue
+        text = df[col]
+        present = text.notna()
+        if dtype == "category":
+            df[col] = text.astype("category")
+        elif dtype == "boolean":
+            parsed = text.str.strip().str.upper().map(BOOL_VALUES)
+            if parsed[present].notna().all():
+                df[col] = parsed.astype("boolean")
+        else:
+            parsed = pd.to_numeric(text, errors="coerce")
+            if parsed[present].notna().all():
+                df[col] = parsed.astype(dtype)
+    return df
+
+
+def read_csv(path, columns=None, dtypes=DTYPES, chunksize=None, engine=None):
+    """
+    Reads a sensor CSV with the shared column types and NA tokens.
+
+    The typed parse is tried first. If a cell does not fit its column type
+    (e.g. "abc" in temp), the file is read again as text, and only the
+    columns that parse cleanly are converted.
+
+    Args:
+        path (Path): CSV file.
+        columns (list): Columns to read (usecols); None reads every column.
+        dtypes (dict): Column types (DTYPES for incoming files).
+        chunksize (int): Yield frames of this many rows instead (pandas parser).
+        engine (str): "pyarrow" or "c"; defaults to CSV_ENGINE.
+
+    Returns:
+        DataFrame, or an iterator of DataFrames when chunksize is given.
+    """
+    header = read_header(path)
+    usecols = [col for col in header if columns is None or col in columns]
+    options = {
+        "usecols": usecols,
+        "na_values": NA_VALUES,
+        "keep_default_na": False,
+    }
+    typed = {col: dtype for col, dtype in dtypes.items() if col in usecols}
+
+    if chunksize:
+        # The pyarrow engine cannot chunk; text chunks are converted one by one
+        text = {col: "str" for col in usecols}
+        return (_coerce(chunk, typed) for chunk in pd.read_csv(path, dtype=text, chunksize=chunksize, **options))
+
+    return _parse(lambda: path, typed, usecols, engine, options)
+
+
+def read_lines(data, names, dtypes=DTYPES, engine=None):
+    """
+    Parses headerless CSV lines, e.g. the newly appended part of a file.
+
+    Args:
+        data (bytes): Complete CSV lines.
+        names (list): Column names from the file's header line.
+        dtypes (dict): Column types (DTYPES for incoming files).
+        engine (str): "pyarrow" or "c"; defaults to CSV_ENGINE.
+
+    Returns:
+        DataFrame: Typed like read_csv, with the same fallback for malformed cells.
+    """
+    options = {"header": None, "names": names, "na_values": NA_VALUES, "keep_default_na": False}
+    typed = {col: dtype for col, dtype in dtypes.items() if col in names}
+    return _parse(lambda: io.BytesIO(data), typed, names, engine, options)
+
+
+def _parse(source, typed, columns, engine, options):
+    """Typed parse of source() with the text fallback; source() returns a fresh path or buffer."""
+    engine = engine or CSV_ENGINE
+    try:
+        return pd.read_csv(source(), engine=engine, dtype=typed, **options)
+    except (ValueError, TypeError):
+        df = pd.read_csv(source(), engine=engine, dtype={col: "str" for col in columns}, **options)
+        return _coerce(df, typed)
@@ -0,0 +1,226 @@
+import os
+import math
+import zlib
+import struct
+import numpy as np
+import pandas as pd
+
+from src.pipeline.aggregation import NUMERIC_COLS
+
+# "0" skips the quantile sketches
+SKETCHES_ENABLED = os.getenv("PIPELINE_SKETCHES", "1") == "1"
+# Relative accuracy of the quantile sketches: an estimate is within this
+# fraction of the true value of the quantile
+SKETCH_ACCURACY = float(os.getenv("PIPELINE_SKETCH_ACCURACY", "0.01"))
+
+_HEADER = struct.Struct("<BdQdd")
+_VERSION = 1
+
+
+class DDSketch:
+    """
+    Mergeable quantile sketch with relative-error guarantees (DDSketch).
+
+    Every non-zero value falls into a logarithmic bucket
+    ceil(log_gamma(|value|)) with gamma = (1 + a) / (1 - a); positive and
+    negative values have separate buckets and zeros are counted apart.
+    Quantiles are read off the bucket counts and are within a relative error
+    `a` of the exact value. Merging adds bucket counts, so sketches of files,
+    hours or devices combine into the sketch of their union exactly.
+    """
+
+    def __init__(self, accuracy=SKETCH_ACCURACY):
+        if not 0 < accuracy < 1:
+            raise ValueError(f"Sketch accuracy must be between 0 and 1: {accuracy}")
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def count(self):
+        return self.zero + sum(self.positive.values()) + sum(self.negative.values())
+
+    # Building
+
+    @staticmethod
+    def bucket_keys(values, gamma):
+        """Bucket of each value's magnitude (values must be non-zero)."""
+        return np.ceil(np.log(np.abs(values)) / math.log(gamma)).astype("int64")
+
+    def add(self, values):
+        """Adds an array of values (NaN is ignored)."""
+        values = np.asarray(values, dtype="float64")
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return self
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.zero += int((values == 0).sum())
+        for store, part in ((self.positive, values[values > 0]), (self.negative, -values[values < 0])):
+            if part.size:
+                keys, counts = np.unique(self.bucket_keys(part, self.gamma), return_counts=True)
+                _add_counts(store, keys, counts)
+        return self
+
+    def merge(self, other):
+        """Adds another sketch (same accuracy) into this one."""
+        if other.accuracy != self.accuracy:
+            raise ValueError(f"Cannot merge sketches of accuracy {self.accuracy} and {other.accuracy}")
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+        self.zero += other.zero
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    # Queries
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        """Estimated q-quantile (0 <= q <= 1), or None for an empty sketch."""
+        total = self.count
+        if total == 0:
+            return None
+        if not 0 <= q <= 1:
+            raise ValueError(f"Quantile must be between 0 and 1: {q}")
+        rank = q * (total - 1)
+        seen = 0
+        # Ascending order: most negative, ..., zero, ..., largest positive
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return max(-self._value(key), self.min)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return min(self._value(key), self.max)
+        return self.max
+
+    def quantiles(self, qs):
+        return {q: self.quantile(q) for q in qs}
+
+    # Serialization
+
+    def to_bytes(self):
+        """Compact encoding: header, then delta-encoded bucket keys and counts, zlib compressed."""
+        parts = [_HEADER.pack(_VERSION, self.accuracy, self.zero, self.min, self.max)]
+        for store in (self.positive, self.negative):
+            keys = np.array(sorted(store), dtype="int64")
+            counts = np.array([store[k] for k in keys], dtype="<u4")
+            deltas = np.diff(keys, prepend=0).astype("<i4")
+            parts += [struct.pack("<I", len(keys)), deltas.tobytes(), counts.tobytes()]
+        return zlib.compress(b"".join(parts))
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = zlib.decompress(bytes(data))
+        version, accuracy, zero, low, high = _HEADER.unpack_from(data)
+        if version != _VERSION:
+            raise ValueError(f"Unknown sketch version: {version}")
+        sketch = cls(accuracy)
+        sketch.zero, sketch.min, sketch.max = zero, low, high
+        offset = _HEADER.size
+        for store in (sketch.positive, sketch.negative):
+            (n,) = struct.unpack_from("<I", data, offset)
+            offset += 4
+            keys = np.cumsum(np.frombuffer(data, "<i4", n, offset).astype("int64"))
+            offset += 4 * n
+            counts = np.frombuffer(data, "<u4", n, offset)
+            offset += 4 * n
+            _add_counts(store, keys, counts)
+        return sketch
+
+
+def _add_counts(store, keys, counts):
+    for key, count in zip(keys.tolist(), counts.tolist()):
+        store[key] = store.get(key, 0) + count
+
+
+def _sketch_frame(keys, sketches):
+    names = ["device_id", "bucket", "sensor"]
+    if keys:
+        index = pd.MultiIndex.from_tuples(keys, names=names)
+    else:
+        index = pd.MultiIndex.from_arrays([[], [], []], names=names)
+    return pd.DataFrame({"sketch": sketches}, index=index)
+
+
+def sketch_stats(df, device_col="device", numeric_cols=NUMERIC_COLS, accuracy=SKETCH_ACCURACY, freq="h"):
+    """
+    One DDSketch per device, UTC hour of ts and sensor.
+
+    The bucket keys of a whole column are computed at once and counted with
+    a single groupby, so Python only loops over the distinct buckets.
+
+    Returns:
+        DataFrame: Indexed by (device_id, bucket, sensor) with a "sketch"
+        column of DDSketch objects.
+    """
+    gamma = (1 + accuracy) / (1 - accuracy)
+    device = df[device_col].astype(str).to_numpy()
+    bucket = df["ts"].dt.floor(freq).to_numpy()
+    index, sketches = [], []
+    for col in numeric_cols:
+        values = df[col].to_numpy(dtype="float64", na_value=np.nan)
+        ok = np.isfinite(values) & ~pd.isna(bucket)
+        if not ok.any():
+            continue
+        v = values[ok]
+        nonzero = v != 0
+        frame = pd.DataFrame({
+            "device_id": device[ok], "bucket": bucket[ok], "value": v,
+            "sign": np.sign(v).astype("int8"),
+            "key": np.where(nonzero, DDSketch.bucket_keys(np.where(nonzero, v, 1.0), gamma), 0),
+        })
+        bounds = frame.groupby(["device_id", "bucket"])["value"].agg(["min", "max"])
+        counts = frame.groupby(["device_id", "bucket", "sign", "key"]).size()
+        for (device_id, hour), group in counts.groupby(level=[0, 1]):
+            sketch = DDSketch(accuracy)
+            low, high = bounds.loc[(device_id, hour)]
+            sketch.min, sketch.max = float(low), float(high)
+            for sign, part in group.groupby(level=2):
+                keys = part.index.get_level_values(3).to_numpy()
+                if sign == 0:
+                    sketch.zero = int(part.sum())
+                else:
+                    _add_counts(sketch.positive if sign > 0 else sketch.negative, keys, part.to_numpy())
+            index.append((device_id, hour, col))
+            sketches.append(sketch)
+    return _sketch_frame(index, sketches)
+
+
+def merge_sketch_frames(frames):
+    """Combines sketch_stats frames, merging the sketches that share a key."""
+    frames = [f for f in frames if f is not None and not f.empty]
+    if not frames:
+        return None
+    if len(frames) == 1:
+        return frames[0]
+    merged = {}
+    for frame in frames:
+        for key, sketch in frame["sketch"].items():
+            if key in merged:
+                merged[key].merge(sketch)
+            else:
+                merged[key] = DDSketch(sketch.accuracy).merge(sketch)
+    return _sketch_frame(list(merged), list(merged.values()))
+
+
+def merge_sketches(sketches):
+    """One sketch for a range: merges DDSketch objects or their to_bytes() encodings."""
+    result = None
+    for sketch in sketches:
+        if isinstance(sketch, (bytes, bytearray, memoryview)):
+            sketch = DDSketch.from_bytes(sketch)
+        result = DDSketch(sketch.accuracy).merge(sketch) if result is None else result.merge(sketch)
+    return result
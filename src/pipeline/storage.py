@@ -0,0 +1,145 @@
+import os
+import pandas as pd
+from pathlib import Path
+from loguru import logger
+
+from src.pipeline import schema
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # CSV keeps working without pyarrow
+    pa = pq = None
+
+# Format for archive/, transformed_data/ and aggregated_data/: "parquet" or "csv"
+STORAGE_FORMAT = os.getenv("PIPELINE_STORAGE_FORMAT", "parquet")
+PARQUET_COMPRESSION = os.getenv("PIPELINE_PARQUET_COMPRESSION", "zstd")
+
+SUFFIXES = {"parquet": ".parquet", "csv": ".csv"}
+PARQUET_MAGIC = b"PAR1"
+
+
+def _resolve_format(fmt=None):
+    fmt = fmt or STORAGE_FORMAT
+    if fmt not in SUFFIXES:
+        raise ValueError(f"Unknown storage format: {fmt}")
+    if fmt == "parquet" and pq is None:
+        logger.warning("pyarrow is not installed, falling back to CSV storage")
+        return "csv"
+    return fmt
+
+
+def output_path(directory, file_name, fmt=None):
+    """Path of a stage output for a source file, e.g. archive/part_1.parquet."""
+    return Path(directory) / (Path(file_name).stem + SUFFIXES[_resolve_format(fmt)])
+
+
+def find_output(directory, file_name):
+    """Returns the existing stage output for a source file in any format, or None."""
+    for suffix in SUFFIXES.values():
+        path = Path(directory) / (Path(file_name).stem + suffix)
+        if path.exists():
+            return path
+    return None
+
+
+def list_outputs(directory):
+    """All stage outputs in a directory, in any supported format."""
+    return sorted(p for suffix in SUFFIXES.values() for p in Path(directory).glob(f"*{suffix}"))
+
+
+def detect_format(path):
+    """Detects the format from the suffix, falling back to the Parquet magic bytes."""
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return "parquet"
+    if path.suffix == ".csv":
+        return "csv"
+    with open(path, "rb") as f:
+        return "parquet" if f.read(4) == PARQUET_MAGIC else "csv"
+
+
+def _to_arrow_table(df):
+    """Converts a frame to Arrow; columns mixing types (e.g. True and "1") are stored as strings."""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].astype(str).where(df[col].notna(), None)
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_frame(df, directory, file_name, fmt=None, **csv_kwargs):
+    """
+    Writes a stage output in the configured format.
+
+    Args:
+        df (DataFrame): Frame to write.
+        directory (Path): Stage folder.
+        file_name (str): Source file name; the suffix is replaced by the format's.
+        fmt (str): "parquet" or "csv"; defaults to PIPELINE_STORAGE_FORMAT.
+        **csv_kwargs: Extra to_csv arguments (CSV only).
+
+    Returns:
+        Path: The written file.
+    """
+    fmt = _resolve_format(fmt)
+    path = output_path(directory, file_name, fmt)
+    if fmt == "parquet":
+        pq.write_table(_to_arrow_table(df), path, compression=PARQUET_COMPRESSION)
+    else:
+        df.to_csv(path, index=False, **csv_kwargs)
+    return path
+
+
+def read_frame(path, columns=None, dtypes=None):
+    """
+    Reads a stage output, detecting the format automatically.
+
+    Args:
+        path (Path): File to read.
+        columns (list): Optional subset of columns to load.
+        dtypes (dict): Column types for CSV files (see schema); Parquet
+            files carry their own types.
+    """
+    if detect_format(path) == "parquet":
+        if pq is None:
+            raise ImportError(f"pyarrow is required to read {path}")
+        return pq.read_table(path, columns=columns).to_pandas()
+    if dtypes is not None:
+        return schema.read_csv(path, columns=columns, dtypes=dtypes)
+    return pd.read_csv(path, usecols=columns)
+
+
+class FrameWriter:
+    """
+    Appends frames chunk by chunk to a single stage output.
+
+    For Parquet the first chunk fixes the schema and later chunks are cast to it.
+    """
+
+    def __init__(self, directory, file_name, fmt=None, **csv_kwargs):
+        self.fmt = _resolve_format(fmt)
+        self.path = output_path(directory, file_name, self.fmt)
+        self.csv_kwargs = csv_kwargs
+        self._writer = None
+        self._started = False
+
+    def write(self, df):
+        if self.fmt == "parquet":
+            table = _to_arrow_table(df)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema, compression=PARQUET_COMPRESSION)
+            elif table.schema != self._writer.schema:
+                table = table.cast(self._writer.schema)
+            self._writer.write_table(table)
+        else:
+            df.to_csv(self.path, index=False, mode="a" if self._started else "w",
+                      header=not self._started, **self.csv_kwargs)
+        self._started = True
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        return self.path if self._started else None
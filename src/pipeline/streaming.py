@@ -0,0 +1,166 @@
+import os
+import sys
+from pathlib import Path
+from loguru import logger
+
+from src.pipeline.validation import validate_df, reset_quarantine, ARCHIVE_DIR
+from src.pipeline.transformation import transform_df, TRANSFORMED_DIR
+from src.pipeline.aggregation import AggregateState, save_aggregates, rollup_stats
+from src.pipeline.storage import FrameWriter
+from src.pipeline import schema
+from src.pipeline.runner import WRITE_SIDE_OUTPUTS, FAILED_DIR, record_merge
+from src.pipeline.windowing import process_windows
+from src.pipeline.hot_state import record_load
+from src.pipeline.anomaly import anomaly_rows
+from src.pipeline.sketches import sketch_stats, SKETCHES_ENABLED
+from src.pipeline.metrics import timed
+from src.database.spool import SPOOL, inserted_rows
+
+# Rows per chunk; peak memory is bounded by this, not by the file size
+CHUNK_ROWS = int(os.getenv("PIPELINE_CHUNK_ROWS", "50000"))
+# Incoming files larger than this are processed in streaming mode
+STREAMING_THRESHOLD_BYTES = int(float(os.getenv("PIPELINE_STREAMING_THRESHOLD_MB", "256")) * 1024 * 1024)
+
+
+def should_stream(file_path):
+    """True if a file is large enough to be processed chunk by chunk."""
+    return os.path.getsize(file_path) > STREAMING_THRESHOLD_BYTES
+
+
+def _dead_letter_rest(file_path, chunk, reader):
+    """
+    Writes a failed chunk and every chunk after it to failed/, with the
+    header, so only the rows that were not loaded are set aside.
+
+    Returns:
+        Path: The failed/ file.
+    """
+    file_path = Path(file_path)
+    path = FAILED_DIR / f"{file_path.stem}_from{chunk.index[0]}.csv"
+    chunk.to_csv(path, index=False)
+    for rest in reader:
+        rest.to_csv(path, index=False, mode="a", header=False)
+    return path
+
+
+def stream_file(file_path, chunk_rows=CHUNK_ROWS, side_outputs=WRITE_SIDE_OUTPUTS):
+    """
+    Runs the pipeline over a file in fixed-size chunks with bounded memory.
+
+    Every chunk is validated and transformed, and its raw rows, rollups,
+    sketches and alerts are loaded in one transaction (or one spool record).
+    It is then folded into a per-device AggregateState. The aggregates are
+    built from that state once the whole file has been read, so they match
+    aggregate_file for the same rows. The archive copy is written as CSV,
+    because raw chunks can infer different column types.
+
+    If a chunk is rejected, the chunks before it stay loaded. The rejected
+    chunk and the rest of the file are written to failed/<name>_from<row>.csv
+    and the incoming file is removed, so resubmitting that file loads
+    exactly the rows that are missing.
+
+    Args:
+        file_path (Path): The incoming CSV file.
+        chunk_rows (int): Rows read per chunk.
+        side_outputs (bool): Whether to write archive/transformed/aggregated copies.
+
+    Returns:
+        dict: Row counts for the processed file.
+    """
+    file_path = Path(file_path)
+    file_name = file_path.name
+    summary = {"file_name": file_name, "rows": 0, "valid": 0, "invalid": 0, "aggregates": 0,
+               "chunks": 0, "closed_windows": 0}
+    state = AggregateState()
+
+    # Chunks add to the error store, so drop what an earlier run stored
+    reset_quarantine(file_name)
+
+    archive = transformed_out = None
+    if side_outputs:
+        archive = FrameWriter(ARCHIVE_DIR, file_name, fmt="csv")
+        transformed_out = FrameWriter(TRANSFORMED_DIR, file_name, date_format="%Y-%m-%d %H:%M:%S.%f")
+
+    reader = schema.read_csv(file_path, chunksize=chunk_rows)
+    try:
+        for chunk in reader:
+            summary["chunks"] += 1
+            summary["rows"] += len(chunk)
+
+            valid_rows, invalid_rows = validate_df(chunk, file_name, write_archive=False, append_quarantine=True)
+            summary["valid"] += len(valid_rows)
+            summary["invalid"] += len(invalid_rows)
+
+            # Raw rows and what is derived from them share the chunk's transaction, so a
+            # rerun after a crash neither loses nor repeats the rollups, sketches or alerts
+            transformed = None
+            writes = [("raw", chunk, file_name)]
+            if not valid_rows.empty:
+                transformed = transform_df(valid_rows)
+                sketches = None
+                if SKETCHES_ENABLED:
+                    with timed("sketch", len(transformed)):
+                        sketches = sketch_stats(transformed)
+                writes += [("rollup", rollup_stats(transformed), file_name), ("sketch", sketches, file_name),
+                           ("alert", anomaly_rows(transformed), file_name)]
+
+            counts = {}
+            try:
+                # While the database is down the chunk goes to the local spool
+                if SPOOL.write(writes, counts) == "spooled":
+                    summary["spooled"] = True
+            except Exception as e:
+                logger.error(f"Failed to insert RAW data (chunk {summary['chunks']}): {e}")
+                failed = _dead_letter_rest(file_path, chunk, reader)
+                logger.error(f"Rows of {file_name} from chunk {summary['chunks']} on moved to {failed}")
+                summary["failed_rows"] = str(failed)
+                summary["status"] = "failed"
+                break
+
+            record_merge(summary, counts.get(file_name))
+            if transformed is None:
+                continue
+            state.update(transformed)
+            # Windows and hot state only take the rows the merge inserted
+            fresh = inserted_rows(transformed, counts.get(file_name))
+            summary["closed_windows"] += process_windows(fresh, file_name)
+            record_load(fresh)
+
+            if side_outputs:
+                archive.write(valid_rows)
+                transformed_out.write(transformed)
+    finally:
+        if side_outputs:
+            archive.close()
+            transformed_out.close()
+
+    if summary.get("status") == "failed":
+        # Every row is now either loaded or in failed/
+        file_path.unlink(missing_ok=True)
+
+    if summary["invalid"] == 0:
+        logger.info(f"All rows in {file_path} valid")
+    else:
+        logger.warning(f"Some rows in {file_path} failed validation")
+
+    # Aggregates cover the chunks that were loaded
+    if state.rows:
+        agg_df = state.finalize(file_name)
+        summary["aggregates"] = len(agg_df)
+        if side_outputs:
+            save_aggregates(agg_df, file_name)
+        logger.info(f"Inserting AGGREGATED data into DB for {file_name}")
+        try:
+            if SPOOL.write([("aggregated", agg_df, file_name)]) == "spooled":
+                summary["spooled"] = True
+        except Exception as e:
+            logger.error(f"Failed to insert AGGREGATED data for {file_name}: {e}")
+
+    spooled = summary.pop("spooled", False)
+    summary.setdefault("status", "spooled" if spooled else "loaded")
+    return summary
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        print(stream_file(path))
@@ -0,0 +1,235 @@
+import os
+import time
+import threading
+from pathlib import Path
+import pandas as pd
+from loguru import logger
+
+from src.pipeline import schema
+from src.pipeline.runner import prepare_frame, load_prepared, file_signature, FAILED_DIR
+from src.pipeline.metrics import METRICS, timed
+
+# "1" processes appended lines as they arrive instead of waiting for whole files
+TAIL_MODE = os.getenv("PIPELINE_TAIL", "0") == "1"
+# Modify events for a file within this window are handled as one
+TAIL_DEBOUNCE_MS = int(os.getenv("PIPELINE_TAIL_DEBOUNCE_MS", "100"))
+# A trailing line without a newline is taken as complete once the file has not
+# changed for this long (the producer finished without a final newline)
+TAIL_IDLE_SECONDS = float(os.getenv("PIPELINE_TAIL_IDLE_SECONDS", "5"))
+# Upper bound on the bytes parsed in one pass, so a large backlog is processed in parts
+TAIL_MAX_BYTES = int(float(os.getenv("PIPELINE_TAIL_MAX_MB", "64")) * 1024 * 1024)
+
+
+def _add(totals, summary):
+    """Sums the row counts of the parts loaded in one pass."""
+    if totals is None:
+        return dict(summary)
+    for key, value in summary.items():
+        totals[key] = totals.get(key, 0) + value if isinstance(value, int) else value
+    return totals
+
+
+class Tailer:
+    """
+    Incremental ingestion of CSV files that are appended to.
+
+    For every file the ledger keeps the inode, the byte offset up to which
+    complete lines have been loaded, the row count and the header. A pass
+    reads from the offset to the last newline, parses only those lines and
+    runs them through prepare_frame/load_prepared; a partial trailing line
+    stays in the file for the next pass. The offset is saved after the load,
+    so a crash replays at most the last part. A file that was replaced
+    (new inode) or truncated is read again from the start.
+    """
+
+    def __init__(self, ledger, submit, run_cpu=None, debounce=TAIL_DEBOUNCE_MS / 1000,
+                 idle=TAIL_IDLE_SECONDS, max_bytes=TAIL_MAX_BYTES):
+        self.ledger = ledger
+        # Queues a path for process(), e.g. WorkerPool.submit
+        self.submit = submit
+        self.run_cpu = run_cpu
+        self.debounce = debounce
+        self.idle = idle
+        self.max_bytes = max_bytes
+        self._timers = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    # Events
+
+    def notify(self, path, delay=None):
+        """Schedules a pass over a file; repeated calls within the debounce window are merged."""
+        path = str(path)
+        with self._lock:
+            timer = self._timers.pop(path, None)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(self.debounce if delay is None else delay, self._fire, (path,))
+            timer.daemon = True
+            self._timers[path] = timer
+            timer.start()
+
+    def _fire(self, path):
+        with self._lock:
+            self._timers.pop(path, None)
+        self.submit(path)
+
+    def _file_lock(self, path):
+        with self._lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    # Processing
+
+    def process(self, path):
+        """
+        Loads the complete lines appended to a file since the last pass.
+
+        Returns:
+            dict: Row counts for the pass, or None if there was nothing new.
+        """
+        path = Path(path)
+        with self._file_lock(str(path)):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return None
+
+            state = self.ledger.tail_offset(path)
+            if state is None or state["inode"] != st.st_ino or st.st_size < state["offset"]:
+                if state is not None:
+                    logger.info(f"{path} was replaced or truncated; reading it from the start")
+                state = {"inode": st.st_ino, "offset": 0, "rows": 0, "header": None}
+
+            totals = None
+            while True:
+                data, final = self._read(path, state["offset"], st)
+                if data is None:
+                    # A line longer than max_bytes can never be parsed; set it aside and move on
+                    consumed = self._skip_line(path, state, final)
+                    self.ledger.save_tail_offset(path, state["inode"], state["offset"], state["rows"], state["header"])
+                    METRICS.inc("pipeline_bytes_read_total", consumed)
+                    st = os.stat(path)
+                    continue
+                if not data:
+                    break
+                consumed = len(data)
+                if state["header"] is None:
+                    line, _, data = data.partition(b"\n")
+                    state["header"] = schema.parse_header(line)
+                if data.strip():
+                    summary = self._load(path, state, data, final)
+                    state["rows"] += summary["rows"]
+                    totals = _add(totals, summary)
+                state["offset"] += consumed
+                self.ledger.save_tail_offset(path, state["inode"], state["offset"], state["rows"], state["header"])
+                METRICS.inc("pipeline_bytes_read_total", consumed)
+                st = os.stat(path)
+
+            if state["offset"] < st.st_size:
+                # Partial trailing line: look again once the producer has been idle
+                self.notify(path, delay=self.idle)
+            if totals is not None:
+                logger.info(f"Tailed {path}: {totals}")
+            return totals
+
+    def _read(self, path, offset, st):
+        """
+        Reads the complete lines after offset, at most max_bytes of them.
+
+        Returns:
+            tuple: (bytes, final) where final means the last line had no
+            newline and was taken because the file stopped changing. A line
+            longer than max_bytes gives (None, end offset of that line).
+        """
+        if offset >= st.st_size:
+            return b"", False
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(min(st.st_size - offset, self.max_bytes))
+        cut = data.rfind(b"\n")
+        if cut >= 0:
+            return data[:cut + 1], False
+        idle = time.time() - st.st_mtime >= self.idle and file_signature(path) == (st.st_size, st.st_mtime_ns)
+        if len(data) == self.max_bytes:
+            end = self._line_end(path, offset + len(data), st.st_size)
+            if end is not None or idle:
+                return None, end or st.st_size
+            return b"", False
+        # No newline at all: only a finished file's last line is taken
+        if not idle:
+            return b"", False
+        return data, True
+
+    @staticmethod
+    def _line_end(path, offset, size, block=1 << 20):
+        """Offset just past the next newline at or after offset, or None if there is none yet."""
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while offset < size:
+                chunk = f.read(min(block, size - offset))
+                if not chunk:
+                    break
+                cut = chunk.find(b"\n")
+                if cut >= 0:
+                    return offset + cut + 1
+                offset += len(chunk)
+        return None
+
+    def _skip_line(self, path, state, end):
+        """Copies an oversized line to failed/ (with the header) and advances the offset past it."""
+        start = state["offset"]
+        failed = FAILED_DIR / f"{path.stem}_{start}.csv"
+        with open(path, "rb") as src, open(failed, "wb") as dst:
+            if state["header"] is not None:
+                dst.write(",".join(state["header"]).encode() + b"\n")
+            src.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = src.read(min(1 << 20, remaining))
+                if not chunk:
+                    break
+                dst.write(chunk)
+                remaining -= len(chunk)
+        state["offset"] = end
+        METRICS.inc("pipeline_tail_chunks_total", status="skipped")
+        logger.error(f"Line of {end - start} bytes at offset {start} of {path} exceeds "
+                     f"{self.max_bytes} bytes; moved to {failed}")
+        return end - start
+
+    def _load(self, path, state, data, final):
+        """Parses and loads one part of a file; rows are numbered from state["rows"]."""
+        if final:
+            data += b"\n"
+        with timed("read"):
+            df = schema.read_lines(data, state["header"])
+        df.index = pd.RangeIndex(state["rows"], state["rows"] + len(df))
+
+        # Errors and quarantined rows of earlier parts are kept. Per-file
+        # aggregates of a few lines are not meaningful; the windowed
+        # aggregates cover tailed files.
+        append = state["rows"] > 0
+        if self.run_cpu is not None:
+            prepared = self.run_cpu(prepare_frame, df, path, append, False)
+        else:
+            prepared = prepare_frame(df, path, append, False)
+        summary = load_prepared(
+            prepared, side_outputs=False,
+            on_failed=lambda p: self._save_failed(path, state, data),
+        )
+        status = summary.get("status", "error")
+        METRICS.inc("pipeline_tail_chunks_total", status=status)
+        if status in ("loaded", "spooled"):
+            METRICS.observe("pipeline_file_lag_seconds", time.time() - os.stat(path).st_mtime)
+        return summary
+
+    def _save_failed(self, path, state, data):
+        """Keeps a part that the database rejected in failed/, with its header."""
+        failed = FAILED_DIR / f"{path.stem}_{state['offset']}.csv"
+        failed.write_bytes(",".join(state["header"]).encode() + b"\n" + data)
+        logger.error(f"Rows {state['rows']}+ of {path} moved to {failed}")
+
+    def stop(self):
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
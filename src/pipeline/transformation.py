@@ -1,15 +1,20 @@
 import pandas as pd
 from pathlib import Path
+from loguru import logger
+
+from src.pipeline.storage import write_frame, read_frame, list_outputs
+from src.pipeline.schema import COLUMNS, DTYPES, BOOL_COLS, BOOL_VALUES
+from src.pipeline.metrics import stage
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 ARCHIVE_DIR = BASE_DIR / "archive"
 TRANSFORMED_DIR = BASE_DIR / "transformed_data"
 TRANSFORMED_DIR.mkdir(exist_ok=True)
 
-def transform_file(file_path):
-    print(f"Transforming file: {file_path}")
-    df = pd.read_csv(file_path)
-    print(f"[DEBUG] Rows read: {len(df)}")
+@stage("transform")
+def transform_df(df):
+    """Standardizes an already validated DataFrame and returns a new one."""
+    df = df.copy()
 
     # 1. Convert UNIX timestamp to datetime
     if "ts" in df.columns:
@@ -25,32 +30,37 @@ def transform_file(file_path):
     numeric_cols = ["co", "lpg", "smoke"]
     for col in numeric_cols:
         if col in df.columns:
-            df[col] = df[col].astype(str).str.strip()
+            # Only text columns (a file that fell back to the untyped parse) need stripping
+            if df[col].dtype == object:
+                df[col] = df[col].astype(str).str.strip()
             df[col] = pd.to_numeric(df[col], errors="coerce").round(3)
 
     # 3. Standardize boolean columns
-    bool_cols = ["light", "motion"]
-    for col in bool_cols:
-        if col in df.columns:
-            df[col] = (
-                df[col]
-                .astype(str)
-                .str.upper()
-                .map({"TRUE": True, "FALSE": False, "1": True, "0": False})
-            )
+    for col in BOOL_COLS:
+        if col in df.columns and not pd.api.types.is_bool_dtype(df[col]):
+            df[col] = df[col].astype(str).str.upper().map(BOOL_VALUES)
 
     # 4. Column ordering
-    desired_order = ["ts", "device", "co", "humidity", "light", "lpg", "motion", "smoke", "temp"]
-    df = df[[c for c in desired_order if c in df.columns]]
+    return df[[c for c in COLUMNS if c in df.columns]]
+
+def save_transformed(df, file_name):
+    """Writes a transformed DataFrame to the transformed_data folder."""
+    # date_format only applies to CSV; Parquet keeps ts as a typed timestamp
+    return write_frame(df, TRANSFORMED_DIR, file_name, date_format="%Y-%m-%d %H:%M:%S.%f")
+
+def transform_file(file_path):
+    logger.info(f"Transforming file: {file_path}")
+    df = read_frame(file_path, dtypes=DTYPES)
+    logger.debug(f"Rows read: {len(df)}")
+
+    df = transform_df(df)
 
     # 5. Save transformed file
-    transformed_path = TRANSFORMED_DIR / Path(file_path).name
-    df.to_csv(transformed_path, index=False, date_format="%Y-%m-%d %H:%M:%S.%f")
-    return transformed_path
+    return save_transformed(df, Path(file_path).name)
 
 if __name__ == "__main__":
     # Batch process all archive files
-    for file in ARCHIVE_DIR.glob("*.csv"):
+    for file in list_outputs(ARCHIVE_DIR):
         new_path = transform_file(file)
-        print(f"Transformed file saved to {new_path}")
+        logger.info(f"Transformed file saved to {new_path}")
 
@@ -1,141 +1,221 @@
 import pandas as pd
 import os
-from datetime import datetime
 from pathlib import Path
 
+from src.pipeline.storage import write_frame
+from src.pipeline.metrics import stage
+from src.pipeline import schema
+from src.pipeline.error_store import ERROR_STORE
+
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
 LOGS_DIR = BASE_DIR/ "logs"
 QUARANTINE_DIR = BASE_DIR/ "quarantine"
 ARCHIVE_DIR = BASE_DIR/ "archive"
-ERROR_LOG_FILE = os.path.join(LOGS_DIR, "error_log.csv")
+# Quarantined rows also go to quarantine/*_errors.csv besides the error store; "0" skips the CSVs
+QUARANTINE_CSV = os.getenv("PIPELINE_QUARANTINE_CSV", "1") == "1"
 
 for folder in [LOGS_DIR, QUARANTINE_DIR, ARCHIVE_DIR]:
     os.makedirs(folder, exist_ok=True)
 
+# Columns that must never be empty
+NULL_CHECK_COLS = ["device", "ts", "temp", "humidity", "light", "motion", "co"]
+VALID_BOOLEANS = ["TRUE", "FALSE", "0", "1"]
+
+# Declarative rule table. Every rule is evaluated as a whole-column boolean mask.
+#   check:   "not_null" | "numeric" | "range" | "boolean"
+#   gated:   only applied to rows that passed every null check
+#            (same order of checks as the old row-by-row loop)
+RULES = (
+    [
+        {"name": f"{col}_not_null", "column": col, "check": "not_null", "gated": False,
+         "message": f"Null value in {col} column"}
+        for col in NULL_CHECK_COLS
+    ]
+    + [
+        {"name": "ts_window", "column": "ts", "check": "ts_window", "gated": True,
+         "message": "Timestamp outside the accepted range"},
+        {"name": "temp_numeric", "column": "temp", "check": "numeric", "gated": True,
+         "message": "Non-numeric temperature"},
+        {"name": "temp_range", "column": "temp", "check": "range", "gated": True,
+         "min": -50, "max": 50, "message": "Temperature out of range"},
+        {"name": "humidity_numeric", "column": "humidity", "check": "numeric", "gated": True,
+         "message": "Non-numeric humidity"},
+        {"name": "humidity_range", "column": "humidity", "check": "range", "gated": True,
+         "min": 0, "max": 100, "message": "Humidity out of range"},
+        {"name": "co_numeric", "column": "co", "check": "numeric", "gated": True,
+         "message": "Non-numeric CO level"},
+        {"name": "co_range", "column": "co", "check": "range", "gated": True,
+         "min": 0, "max": 1, "message": "CO level out of range"},
+        {"name": "lpg_numeric", "column": "lpg", "check": "numeric", "gated": True,
+         "message": "Non-numeric LPG level"},
+        {"name": "lpg_range", "column": "lpg", "check": "range", "gated": True,
+         "min": 0, "max": 1, "message": "LPG level out of range"},
+        {"name": "smoke_numeric", "column": "smoke", "check": "numeric", "gated": True,
+         "message": "Non-numeric smoke level"},
+        {"name": "smoke_range", "column": "smoke", "check": "range", "gated": True,
+         "min": 0, "max": 1, "message": "Smoke level out of range"},
+    ]
+    + [
+        {"name": f"{col}_boolean", "column": col, "check": "boolean", "gated": True,
+         "message": "Invalid boolean value"}
+        for col in ["light", "motion"]
+    ]
+)
+
+
 def log_error(file_name, row_idx, device_id, column, value, message):
-    """Append error details to CSV log."""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(ERROR_LOG_FILE, "a") as f:
-        f.write(f"{timestamp},{file_name},{row_idx},{device_id},{column},{value},{message}\n")
+    """Store a single error record in the error store."""
+    log_errors([(file_name, row_idx, device_id, column, value, message)])
+
+
+def log_errors(records):
+    """Store a batch of error records in the error store with one transaction."""
+    ERROR_STORE.add_errors(records)
+
+
+def _rule_mask(df, rule, numeric_cache):
+    """Return a boolean Series that is True for rows failing the rule."""
+    col = df[rule["column"]]
+    check = rule["check"]
+
+    if check == "not_null":
+        return col.isna()
+
+    if check == "boolean":
+        # A column the schema parsed as boolean holds only valid values
+        if pd.api.types.is_bool_dtype(col):
+            return pd.Series(False, index=df.index)
+        return ~col.astype(str).str.upper().isin(VALID_BOOLEANS)
+
+    # numeric / range share the same coerced column
+    if rule["column"] not in numeric_cache:
+        numeric_cache[rule["column"]] = pd.to_numeric(col, errors="coerce")
+    numeric = numeric_cache[rule["column"]]
+
+    if check == "numeric":
+        return numeric.isna() & col.notna()
+    if check == "range":
+        return (numeric < rule["min"]) | (numeric > rule["max"])
+    if check == "ts_window":
+        # Corrupt epochs would otherwise create partitions and windows far from the data
+        return pd.Series(~schema.ts_in_window(numeric), index=df.index) & numeric.notna()
+
+    raise ValueError(f"Unknown rule check: {check}")
+
+
+def evaluate_rules(df, file_name, rules=RULES):
+    """
+    Evaluates the rule table against a DataFrame.
+
+    Args:
+        df (DataFrame): The raw sensor rows.
+        file_name (str): Used for the error records.
+        rules (list): Rule table to apply.
+
+    Returns:
+        tuple: (valid_mask, error_records) where error_records are
+        (file_name, row_idx, device_id, column, value, message, rule) tuples
+        ordered by row and then by rule, as the old per-row loop wrote them.
+    """
+    active = [r for r in rules if r["column"] in df.columns]
+    numeric_cache = {}
+
+    null_rules = [r for r in active if not r["gated"]]
+    masks = {r["name"]: _rule_mask(df, r, numeric_cache) for r in null_rules}
+    has_null = pd.Series(False, index=df.index)
+    for r in null_rules:
+        has_null |= masks[r["name"]]
+
+    for r in active:
+        if r["gated"]:
+            masks[r["name"]] = _rule_mask(df, r, numeric_cache) & ~has_null
+
+    invalid = pd.Series(False, index=df.index)
+    for mask in masks.values():
+        invalid |= mask
+
+    # Build error records only for failing cells
+    if "device" in df.columns:
+        devices = df["device"].astype(object).where(df["device"].notna(), None)
+    else:
+        devices = pd.Series(None, index=df.index, dtype=object)
+
+    found = []
+    positions = pd.RangeIndex(len(df))
+    for order, r in enumerate(active):
+        mask = masks[r["name"]].to_numpy()
+        if not mask.any():
+            continue
+        values = ["NaN"] * int(mask.sum()) if r["check"] == "not_null" else df[r["column"]].to_numpy()[mask]
+        found.extend(
+            (pos, order, (file_name, idx, dev, r["column"], val, r["message"], r["name"]))
+            for pos, idx, dev, val in zip(positions[mask], df.index[mask], devices.to_numpy()[mask], values)
+        )
+    found.sort(key=lambda item: (item[0], item[1]))
+    records = [rec for _, _, rec in found]
+
+    return ~invalid, records
+
+
+def quarantine_path(file_name):
+    """Path of the quarantine file holding the invalid rows of a source file."""
+    return os.path.join(QUARANTINE_DIR, file_name.replace(".csv", "_errors.csv"))
+
+
+def reset_quarantine(file_name):
+    """Forgets what an earlier run quarantined and logged for a file."""
+    ERROR_STORE.clear_file(file_name)
+    if os.path.exists(quarantine_path(file_name)):
+        os.remove(quarantine_path(file_name))
+
+
+def save_archive(valid_rows, file_name):
+    """Writes the valid rows of a file to the archive folder."""
+    return write_frame(valid_rows, ARCHIVE_DIR, file_name)
+
+
+@stage("validate")
+def validate_df(df, file_name, write_archive=True, append_quarantine=False):
+    """
+    Validates an already parsed DataFrame against the rule table.
+
+    Errors, invalid rows and per-device/hour counts are written to the error
+    store in one transaction. The archive copy of the valid rows is optional
+    so in-memory callers can write it later.
+
+    Args:
+        df (DataFrame): The raw sensor rows.
+        file_name (str): Name of the source file.
+        write_archive (bool): Whether to save the valid rows to archive/.
+        append_quarantine (bool): Add to what is stored for the file instead of
+            replacing it (used when a file is validated chunk by chunk).
+
+    Returns:
+        tuple: (valid_rows, invalid_rows) DataFrames.
+    """
+    valid_mask, errors = evaluate_rules(df, file_name)
+    ERROR_STORE.record_validation(df, file_name, valid_mask, errors, replace=not append_quarantine)
+
+    valid_rows = df[valid_mask]
+    invalid_rows = df[~valid_mask]
+
+    # Save valid and invalid rows
+    if write_archive and not valid_rows.empty:
+        save_archive(valid_rows, file_name)
+    if QUARANTINE_CSV and not invalid_rows.empty:
+        path = quarantine_path(file_name)
+        append = append_quarantine and os.path.exists(path)
+        invalid_rows.to_csv(path, index=False, mode="a" if append else "w", header=not append)
+
+    return valid_rows, invalid_rows
+
 
 def validate_file(file_path):
-    """Validates each row; saves valid/invalid rows separately."""
+    """Validates all rows against the rule table; saves valid/invalid rows separately."""
     file_name = os.path.basename(file_path)
-    df = pd.read_csv(file_path)
-
-    
-
-    valid_rows = []
-    invalid_rows = []
-
-    for idx, row in df.iterrows():
-        row_valid = True
-
-        # Get the device ID for this row, handle case where it's NaN
-        device_id = row["device"] if "device" in row and pd.notnull(row["device"]) else None
-
-        # A list of columns to check for null values
-        null_check_cols = ["device", "ts", "temp", "humidity", "light", "motion", "co"]
-        for col in null_check_cols:
-            if col in row and pd.isnull(row[col]):
-                log_error(file_name, idx, device_id, col, "NaN", f"Null value in {col} column")
-                row_valid = False
-
-        # Type + range checks (only if row is still valid)
-        if row_valid:
-            # Temperature
-            if "temp" in row:
-                try:
-                    temp = float(row["temp"])
-                    if temp < -50 or temp > 50:
-                        log_error(file_name, idx, device_id, "temp", row["temp"], "Temperature out of range")
-                        row_valid = False
-                except (ValueError, TypeError):
-                    log_error(file_name, idx, device_id, "temp", row["temp"], "Non-numeric temperature")
-                    row_valid = False
-    
-            # Humidity
-            if "humidity" in row:
-                try:
-                    humidity = float(row["humidity"])
-                    if humidity < 0 or humidity > 100:
-                        log_error(file_name, idx, device_id, "humidity", row["humidity"], "Humidity out of range")
-                        row_valid = False
-                except (ValueError, TypeError):
-                    log_error(file_name, idx, device_id, "humidity", row["humidity"], "Non-numeric humidity")
-                    row_valid = False
-    
-            # Boolean checks
-            for bool_col in ["light", "motion"]:
-                if bool_col in row and str(row[bool_col]).upper() not in ["TRUE", "FALSE", "0", "1"]:
-                    log_error(file_name, idx, device_id, bool_col, row[bool_col], "Invalid boolean value")
-                    row_valid = False
-
-        # # Null checks
-        # if pd.isnull(row["device"]):
-        #     log_error(file_name, idx, device_id, "device", None, "Null device ID")
-        #     row_valid = False
-        # if pd.isnull(row["ts"]):
-        #     log_error(file_name, idx, device_id, "ts", None, "Null timestamp")
-        #     row_valid = False
-        # if pd.isnull(row["temp"]):
-        #     log_error(file_name, idx, device_id, "temp", None, "Null temperature")
-        #     row_valid = False
-        # if pd.isnull(row["humidity"]):
-        #     log_error(file_name, idx, device_id, "humidity", None, "Null humidity")
-        #     row_valid = False
-        # if pd.isnull(row["light"]):
-        #     log_error(file_name, idx, device_id, "light", None, "Null light status")
-        #     row_valid = False   
-        # if pd.isnull(row["motion"]):
-        #     log_error(file_name, idx, device_id, "motion", None, "Null motion status")
-        #     row_valid = False
-        # if pd.isnull(row["co"]):
-        #     log_error(file_name, idx, device_id, "co", None, "Null CO level")
-        #     row_valid = False
-
-        # # Type + range checks
-        # # Temperature
-        # try:
-        #     temp = float(row["temp"])
-        #     if temp < -50 or temp > 50:
-        #         log_error(file_name, idx, device_id, "temp", row["temp"], "Temperature out of range")
-        #         row_valid = False
-        # except ValueError:
-        #     log_error(file_name, idx, device_id, "temp", row["temp"], "Non-numeric temperature")
-        #     row_valid = False
-
-        # # Humidity
-        # try:
-        #     humidity = float(row["humidity"])
-        #     if humidity < 0 or humidity > 100:
-        #         log_error(file_name, idx, device_id, "humidity", row["humidity"], "Humidity out of range")
-        #         row_valid = False
-        # except ValueError:
-        #     log_error(file_name, idx, device_id, "humidity", row["humidity"], "Non-numeric humidity")
-        #     row_valid = False
-
-        # # Boolean checks
-        # for bool_col in ["light", "motion"]:
-        #     if str(row[bool_col]).upper() not in ["TRUE", "FALSE", "0", "1"]:
-        #         log_error(file_name, idx, device_id, bool_col, row[bool_col], "Invalid boolean value")
-        #         row_valid = False
-
-        # Add to appropriate list
-        if row_valid:
-            valid_rows.append(row)
-        else:
-            invalid_rows.append(row)
+    df = schema.read_csv(file_path)
 
-    # Save valid and invalid rows
-    if valid_rows:
-        pd.DataFrame(valid_rows).to_csv(
-            os.path.join(ARCHIVE_DIR, file_name), index=False
-        )
-    if invalid_rows:
-        pd.DataFrame(invalid_rows).to_csv(
-            os.path.join(QUARANTINE_DIR, file_name.replace(".csv", "_errors.csv")), index=False
-        )
+    _, invalid_rows = validate_df(df, file_name)
 
-    return len(invalid_rows) == 0  # True if all rows valid
+    return invalid_rows.empty  # True if all rows valid
@@ -7,13 +7,29 @@ from watchdog.events import FileSystemEventHandler
 from loguru import logger
 import threading
 import shutil
+import multiprocessing
 
 from src.pipeline.validation import validate_file
 from src.pipeline.transformation import transform_file 
 from src.pipeline.aggregation import aggregate_file
+from src.pipeline.runner import prepare_file, load_prepared, wait_until_stable, flush_side_outputs
+from src.pipeline.streaming import stream_file, should_stream
+from src.pipeline.workers import WorkerPool
+from src.pipeline.batching import MicroBatcher, BATCH_WINDOW_MS
+from src.pipeline.tailing import Tailer, TAIL_MODE
+from src.pipeline.windowing import WINDOWS
+from src.pipeline.storage import output_path, list_outputs
+from src.pipeline.ledger import Ledger
+from src.pipeline.metrics import METRICS, PROFILER, MetricsExporter
+from src.pipeline.read_api import ReadApi
+from src.pipeline.anomaly import DETECTOR
 
 from ..database.load_raw_data import load_raw_file
 from ..database.load_aggregated_data import load_aggregated_file
+from ..database.db_utils import close_pool
+from ..database.partitions import PARTITIONS, PartitionMaintainer
+from ..database.spool import SPOOL
+from ..database.leases import LEASES
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 sys.path.append(str(BASE_DIR))
@@ -23,119 +39,309 @@ LOGS_DIR = BASE_DIR / "logs"
 os.makedirs(INCOMING_DIR, exist_ok=True)
 os.makedirs(LOGS_DIR, exist_ok=True)
 
-logger.add(LOGS_DIR /"pipeline.log", rotation="1 MB")
+# Worker processes re-import this module (spawn); only the parent writes the log file
+if multiprocessing.current_process().name == "MainProcess":
+    logger.add(LOGS_DIR /"pipeline.log", rotation="1 MB", enqueue=True)
 
-PROCESSED_FILES = set()
-file_lock = threading.Lock()
+# "memory": parse each file once and pass the DataFrame through every stage
+# "files":  legacy mode, every stage reads the previous stage's CSV from disk
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "memory")
 
 class IncomingHandler(FileSystemEventHandler):
+    def __init__(self, workers=None, ledger=None, batcher=None, tailer=None):
+        super().__init__()
+        # With a WorkerPool the observer thread only enqueues paths
+        self.workers = workers
+        # With a MicroBatcher prepared files are loaded in shared transactions
+        self.batcher = batcher
+        # Durable record of processed files (dedup across restarts)
+        self.ledger = ledger or Ledger()
+        # With a Tailer files are loaded incrementally as lines are appended
+        self.tailer = tailer
+
     def on_created(self, event):
         self.process(event)
 
-    # def on_modified(self, event):
-    #     self.process(event)
+    def on_modified(self, event):
+        # Only tail mode reacts to appends; whole-file mode waits for a stable size
+        if self.tailer is not None:
+            self.process(event)
+
+    def on_moved(self, event):
+        # Producers (and the error store's resubmit) write a temp file and rename it into place
+        if not event.is_directory:
+            self.process_path(event.dest_path)
 
     def process(self, event):
-        # A unique identifier for the file to prevent re-processing.
-        file_id = os.path.basename(event.src_path)
-
-        # Check if the file has already been processed in this session.
-         # Use the lock to ensure only one thread checks the set at a time
-        with file_lock:
-            if file_id in PROCESSED_FILES:
-                logger.info(f"Skipping already processed file: {event.src_path}")
-                return
-            
-            # Add the file to the processed set immediately
-            PROCESSED_FILES.add(file_id)
-        
-        if not event.is_directory and event.src_path.endswith(".csv"):
-            time.sleep(0.5)  # Allow time for file to be fully written
-            
-            try:
-                logger.info(f"New or modified file detected: {event.src_path}")
+        if not event.is_directory:
+            self.process_path(event.src_path)
 
-                #step 1: Validate the file
-                all_valid = validate_file(event.src_path)
-                logger.debug(f"Files currently in archive: {list((BASE_DIR / 'archive').glob('*.csv'))}")
+    def process_path(self, src_path):
+        if src_path.endswith(".csv"):
+            if self.tailer is not None:
+                self.tailer.notify(src_path)
+            else:
+                self.submit(src_path)
 
-                if all_valid:
-                    logger.info(f"All rows in {event.src_path} valid")
-                else:
-                    logger.warning(f"Some rows in {event.src_path} failed validation")
-
-                # Step 2: Transformation
-                archive_path = BASE_DIR / "archive" / Path(event.src_path).name
-
-                    # # Wait up to 3 seconds for the archive file to appear
-                    # for _ in range(6):  # 6 x 0.5s = 3 seconds max wait
-                    #     if archive_path.exists():
-                    #         break
-                    #     time.sleep(0.5)
-                logger.debug(f"Looking for archive file: {archive_path}")
-
-                max_wait_time_seconds = 5
-                wait_start = time.time()
-                while not archive_path.exists() and (time.time() - wait_start) < max_wait_time_seconds:
-                    logger.info(f"Waiting for archive file to appear: {archive_path}")
-                    time.sleep(0.5)
-
-                if archive_path.exists():
-                    transformed_path = transform_file(archive_path)
-                    logger.info(f"File transformed and saved to {transformed_path}")
+    def submit(self, src_path):
+        if self.workers is not None:
+            self.workers.submit(src_path)
+        else:
+            self.handle(src_path)
+
+    def handle(self, src_path):
+        """Runs the whole pipeline for one incoming file and records it in the ledger."""
+        if not os.path.exists(src_path):
+            return
+        if self.tailer is not None:
+            with PROFILER.profile(src_path):
+                self.tailer.process(src_path)
+            return
+        if not wait_until_stable(src_path):
+            logger.warning(f"File size still changing, processing anyway: {src_path}")
+
+        # Claim by content hash, so duplicates and already loaded files are skipped
+        content_hash = self.ledger.claim(src_path)
+        if content_hash is None:
+            logger.info(f"Skipping already processed file: {src_path}")
+            return
+
+        st = os.stat(src_path)
+        # With several watchers on one directory, the shared lease decides who loads it
+        if LEASES is not None and not LEASES.acquire(content_hash, Path(src_path).name, st.st_size, st.st_mtime):
+            self.ledger.release(content_hash)
+            logger.info(f"Skipping file leased or loaded by another watcher: {src_path}")
+            return
+
+        started = time.perf_counter()
+        METRICS.inc("pipeline_bytes_read_total", st.st_size)
+
+        def done(summary):
+            self.ledger.finish(content_hash, summary)
+            status = summary.get("status", "error")
+            if LEASES is not None:
+                LEASES.release(content_hash, status)
+            METRICS.inc("pipeline_files_total", status=status)
+            METRICS.observe("pipeline_file_seconds", time.perf_counter() - started)
+            if status == "loaded":
+                METRICS.observe("pipeline_file_lag_seconds", time.time() - st.st_mtime)
+
+        summary = {"status": "error"}
+        try:
+            with PROFILER.profile(src_path):
+                if PIPELINE_MODE == "memory":
+                    summary = self.process_in_memory(src_path, on_done=done)
                 else:
-                    logger.warning(f"Archive file not found for transformation: {archive_path}")
-
-                # Step 3: Aggregation
-
-                transformed_path = BASE_DIR / "transformed_data" / Path(event.src_path).name
-
-                logger.debug(f"Looking for transformed file: {transformed_path}")
-                max_wait_time_seconds = 5
-                wait_start = time.time()
-                while not transformed_path.exists() and (time.time() - wait_start) < max_wait_time_seconds:
-                    logger.info(f"Waiting for transformed file to appear: {transformed_path}")
-                    time.sleep(0.5)
-
-                if transformed_path.exists():
-                    aggregated_file = aggregate_file(transformed_path)
-                    logger.info(f"Aggregated metrics saved to {aggregated_file}")
-                    
-                else:   
-                    logger.warning(f"Transformed file not found for aggregation: {transformed_path}")
-
-                # Step 4: Load raw data and aggregated data into the database
-                try:
-                    logger.info(f"Inserting RAW data into DB from {event.src_path}")
-                    load_raw_file(Path(event.src_path))  # raw data from INCOMING
-                except Exception as e:
-                    logger.error(f"Failed to insert RAW data: {e}")
-                    shutil.move(event.src_path, BASE_DIR / "failed" / Path(event.src_path).name)
-                    return
-
-                try:
-                    logger.info(f"Inserting AGGREGATED data into DB from {aggregated_file}")
-                    load_aggregated_file(Path(aggregated_file))
-                except Exception as e:
-                    logger.error(f"Failed to insert AGGREGATED data: {e}")
-                    shutil.move(aggregated_file, BASE_DIR / "failed" / Path(aggregated_file).name)
+                    summary = self.process_files(src_path)
+        finally:
+            # None: the file was handed to the batcher, which calls done() itself
+            if summary is not None:
+                done(summary)
+
+    def process_files(self, src_path):
+        """Legacy mode: every stage reads the previous stage's output from disk."""
+        try:
+            logger.info(f"New or modified file detected: {src_path}")
+
+            #step 1: Validate the file
+            all_valid = validate_file(src_path)
+            logger.debug(f"Files currently in archive: {list_outputs(BASE_DIR / 'archive')}")
+
+            if all_valid:
+                logger.info(f"All rows in {src_path} valid")
+            else:
+                logger.warning(f"Some rows in {src_path} failed validation")
+
+            # Step 2: Transformation
+            archive_path = output_path(BASE_DIR / "archive", src_path)
+
+                # # Wait up to 3 seconds for the archive file to appear
+                # for _ in range(6):  # 6 x 0.5s = 3 seconds max wait
+                #     if archive_path.exists():
+                #         break
+                #     time.sleep(0.5)
+            logger.debug(f"Looking for archive file: {archive_path}")
+
+            max_wait_time_seconds = 5
+            wait_start = time.time()
+            while not archive_path.exists() and (time.time() - wait_start) < max_wait_time_seconds:
+                logger.info(f"Waiting for archive file to appear: {archive_path}")
+                time.sleep(0.5)
+
+            if archive_path.exists():
+                transformed_path = transform_file(archive_path)
+                logger.info(f"File transformed and saved to {transformed_path}")
+            else:
+                logger.warning(f"Archive file not found for transformation: {archive_path}")
+
+            # Step 3: Aggregation
 
+            transformed_path = output_path(BASE_DIR / "transformed_data", src_path)
+
+            logger.debug(f"Looking for transformed file: {transformed_path}")
+            max_wait_time_seconds = 5
+            wait_start = time.time()
+            while not transformed_path.exists() and (time.time() - wait_start) < max_wait_time_seconds:
+                logger.info(f"Waiting for transformed file to appear: {transformed_path}")
+                time.sleep(0.5)
+
+            aggregated_file = None
+            if transformed_path.exists():
+                aggregated_file = aggregate_file(transformed_path)
+                logger.info(f"Aggregated metrics saved to {aggregated_file}")
                 
-            except PermissionError as e:
-                logger.error(f"Permission error while reading {event.src_path}: {e}")
+            else:   
+                logger.warning(f"Transformed file not found for aggregation: {transformed_path}")
+
+            # Step 4: Load raw data and aggregated data into the database
+            try:
+                logger.info(f"Inserting RAW data into DB from {src_path}")
+                load_raw_file(Path(src_path))  # raw data from INCOMING
             except Exception as e:
-                logger.error(f"Unexpected error while processing {event.src_path}: {e}")
+                logger.error(f"Failed to insert RAW data: {e}")
+                shutil.move(src_path, BASE_DIR / "failed" / Path(src_path).name)
+                return {"status": "failed"}
+
+            if aggregated_file is None:
+                logger.warning(f"No aggregates to insert for {src_path}")
+                return {"status": "loaded"}
+
+            try:
+                logger.info(f"Inserting AGGREGATED data into DB from {aggregated_file}")
+                load_aggregated_file(Path(aggregated_file))
+            except Exception as e:
+                logger.error(f"Failed to insert AGGREGATED data: {e}")
+                shutil.move(aggregated_file, BASE_DIR / "failed" / Path(aggregated_file).name)
+
+            return {"status": "loaded"}
+        except PermissionError as e:
+            logger.error(f"Permission error while reading {src_path}: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error while processing {src_path}: {e}")
+        return {"status": "error"}
+
+    def process_in_memory(self, src_path, on_done=None):
+        """
+        Parses the file once and runs every stage on the in-memory DataFrame.
+
+        Returns None when the load was queued on the batcher; on_done(summary)
+        is then called once the batch is committed.
+        """
+        try:
+            logger.info(f"New or modified file detected: {src_path}")
+            if should_stream(src_path):
+                # Very large file: bounded-memory chunked processing
+                summary = stream_file(src_path)
+            else:
+                if self.workers is not None:
+                    prepared = self.workers.run_cpu(prepare_file, src_path)
+                else:
+                    prepared = prepare_file(src_path)
+                if self.batcher is not None:
+                    self.batcher.submit(prepared, lambda summary: self._batched(src_path, summary, on_done))
+                    return None
+                summary = load_prepared(prepared)
+            logger.info(f"Processed {src_path}: {summary}")
+            return summary
+        except PermissionError as e:
+            logger.error(f"Permission error while reading {src_path}: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error while processing {src_path}: {e}")
+        return {"status": "error"}
+
+    def _batched(self, src_path, summary, on_done):
+        logger.info(f"Processed {src_path}: {summary}")
+        if on_done is not None:
+            on_done(summary)
+
+def queue_backlog(handler):
+    """Queues the files in incoming/ that no watcher has finished yet."""
+    finished = ()
+    if LEASES is not None:
+        try:
+            finished = LEASES.finished()
+        except Exception as e:
+            logger.warning(f"Skipping scan of {INCOMING_DIR}, lease table unavailable: {e}")
+            return
+    backlog = handler.ledger.pending(INCOMING_DIR, finished)
+    if backlog:
+        logger.info(f"Queueing {len(backlog)} unfinished files from {INCOMING_DIR}")
+    for path in backlog:
+        handler.submit(str(path))
+
 
 if __name__ == "__main__":
+    if TAIL_MODE and LEASES is not None:
+        # Tailed files are not leased, so two watchers would both load every appended line
+        logger.error("PIPELINE_TAIL=1 cannot be combined with PIPELINE_LEASES=1: tail mode runs on a single watcher")
+        sys.exit(1)
+    if WINDOWS is not None:
+        WINDOWS.restore()
+    if DETECTOR is not None:
+        DETECTOR.restore()
+    exporter = MetricsExporter().start()
+    # Latest device state and cached rollups over HTTP, if PIPELINE_API_PORT is set
+    read_api = ReadApi().start()
+    # Creates upcoming raw partitions and applies retention, now and then hourly
+    partitions = PartitionMaintainer().start() if PARTITIONS is not None else None
+    # Replays DB writes spooled while the database was unreachable
+    SPOOL.start()
+    if LEASES is not None:
+        LEASES.start()
+    METRICS.gauge_callback("pipeline_queue_depth", lambda: SPOOL.pending, queue="spool")
+
     event_handler = IncomingHandler()
+    workers = WorkerPool(event_handler.handle).start()
+    event_handler.workers = workers
+    if TAIL_MODE:
+        event_handler.tailer = Tailer(event_handler.ledger, workers.submit, workers.run_cpu)
+    METRICS.gauge_callback("pipeline_queue_depth", workers.depth, queue="files")
+    if BATCH_WINDOW_MS > 0:
+        event_handler.batcher = MicroBatcher().start()
+        METRICS.gauge_callback("pipeline_queue_depth", event_handler.batcher.queue.qsize, queue="batch")
+
     observer = Observer()
     observer.schedule(event_handler, INCOMING_DIR, recursive=False)
     observer.start()
     logger.info("Started monitoring incoming folder...")
 
+    # Catch up on files that arrived while the watcher was down
+    if event_handler.tailer is not None:
+        # Every file may have grown; the stored offsets skip what is loaded
+        backlog = sorted(INCOMING_DIR.glob("*.csv"))
+        logger.info(f"Tailing {len(backlog)} files from {INCOMING_DIR}")
+        for path in backlog:
+            event_handler.tailer.notify(path)
+    else:
+        queue_backlog(event_handler)
+
     try:
+        last_scan = time.monotonic()
         while True:
             time.sleep(5)
+            # Files whose lease expired (their worker died) are picked up by a rescan
+            if LEASES is not None and time.monotonic() - last_scan >= LEASES.ttl:
+                queue_backlog(event_handler)
+                last_scan = time.monotonic()
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    if event_handler.tailer is not None:
+        event_handler.tailer.stop()
+    workers.shutdown()
+    if event_handler.batcher is not None:
+        event_handler.batcher.shutdown()
+    if WINDOWS is not None:
+        WINDOWS.snapshot()
+    if DETECTOR is not None:
+        DETECTOR.snapshot()
+    flush_side_outputs()
+    event_handler.ledger.close()
+    if partitions is not None:
+        partitions.stop()
+    SPOOL.stop()
+    if LEASES is not None:
+        LEASES.stop()
+    read_api.stop()
+    close_pool()
+    exporter.stop()
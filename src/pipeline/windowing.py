@@ -0,0 +1,166 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from loguru import logger
+
+from src.pipeline.aggregation import NUMERIC_COLS, partial_stats, merge_stats, finalize_stats
+from src.database.spool import SPOOL
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+STATE_DIR = BASE_DIR / "state"
+STATE_DIR.mkdir(exist_ok=True)
+WINDOW_STATE_FILE = STATE_DIR / "windows.pkl"
+
+# Comma separated windows: "size" is a tumbling window, "size/slide" a sliding one.
+# An empty value disables windowed aggregation.
+WINDOWS_SPEC = os.getenv("PIPELINE_WINDOWS", "1min,5min,1h")
+# How far behind the newest timestamp seen a row may arrive and still be counted
+ALLOWED_LATENESS = os.getenv("PIPELINE_WINDOW_LATENESS", "2min")
+
+
+def parse_windows(spec):
+    """
+    Parses a window spec such as "1min,5min,1h,15min/5min".
+
+    Returns:
+        list: dicts with name, size and slide (pandas Timedeltas).
+    """
+    windows = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        size, _, slide = item.partition("/")
+        size = pd.Timedelta(size)
+        slide = pd.Timedelta(slide) if slide else size
+        if size % slide != pd.Timedelta(0):
+            raise ValueError(f"Window size must be a multiple of the slide: {item}")
+        windows.append({"name": item, "size": size, "slide": slide})
+    return windows
+
+
+class WindowAggregator:
+    """
+    Per-device tumbling and sliding windows keyed on ts, updated file by file.
+
+    Only open windows are kept (mergeable count/mean/M2/min/max per
+    window, device and window start), so each update touches
+    O(devices x windows) state rather than any history. The watermark is the
+    newest ts seen minus the allowed lateness. Windows ending at or before it
+    are closed and returned, and rows that would fall into an already closed
+    window are dropped as late.
+    """
+
+    def __init__(self, windows, lateness=ALLOWED_LATENESS, numeric_cols=NUMERIC_COLS):
+        self.windows = {w["name"]: w for w in windows}
+        self.lateness = pd.Timedelta(lateness)
+        self.numeric_cols = list(numeric_cols)
+        self.state = None
+        self.max_ts = None
+        self.late_rows = 0
+        self._lock = threading.Lock()
+
+    @property
+    def watermark(self):
+        return None if self.max_ts is None else self.max_ts - self.lateness
+
+    def _assign(self, df, window, watermark):
+        """Expands rows to (window start) keys; sliding windows repeat each row size/slide times."""
+        copies = int(window["size"] / window["slide"])
+        starts = df["ts"].dt.floor(window["slide"]).to_numpy()
+        rows = df
+        if copies > 1:
+            offsets = np.arange(copies) * window["slide"].to_timedelta64()
+            starts = (starts[:, None] - offsets[None, :]).ravel()
+            rows = df.iloc[np.repeat(np.arange(len(df)), copies)]
+
+        starts = pd.DatetimeIndex(starts)
+        if watermark is not None:
+            on_time = (starts + window["size"]) > watermark
+            self.late_rows += int((~on_time).sum())
+            rows, starts = rows[on_time], starts[on_time]
+        keys = [
+            pd.Index(np.full(len(rows), window["name"]), name="window_name"),
+            pd.Index(rows["device"].to_numpy(), name="device_id"),
+            pd.Index(starts, name="window_start"),
+        ]
+        return partial_stats(rows, keys, self.numeric_cols)
+
+    def update(self, df):
+        """
+        Folds transformed rows into the open windows.
+
+        Returns:
+            DataFrame: Windows closed by the advanced watermark (may be empty).
+        """
+        df = df[df["ts"].notna()]
+        with self._lock:
+            if not df.empty:
+                watermark = self.watermark
+                parts = [self._assign(df, w, watermark) for w in self.windows.values()]
+                self.state = merge_stats([self.state] + parts, self.numeric_cols)
+                newest = df["ts"].max()
+                self.max_ts = newest if self.max_ts is None else max(self.max_ts, newest)
+            return self._close(self.watermark)
+
+    def flush(self):
+        """Closes every open window (e.g. at the end of a backfill)."""
+        with self._lock:
+            return self._close(None)
+
+    def _close(self, watermark):
+        if self.state is None or self.state.empty:
+            return pd.DataFrame()
+        starts = self.state.index.get_level_values("window_start")
+        sizes = self.state.index.get_level_values("window_name").map(lambda name: self.windows[name]["size"])
+        ends = starts + pd.TimedeltaIndex(sizes)
+        closed = np.ones(len(self.state), dtype=bool) if watermark is None else (ends <= watermark)
+        if not closed.any():
+            return pd.DataFrame()
+
+        done = self.state[closed]
+        self.state = self.state[~closed]
+
+        out = finalize_stats(done, self.numeric_cols).round(4)
+        out.insert(0, "row_count", done["rows"].astype("int64"))
+        out = out.reset_index()
+        out.insert(3, "window_end", out["window_start"] + pd.TimedeltaIndex(
+            out["window_name"].map(lambda name: self.windows[name]["size"])))
+        return out
+
+    def snapshot(self, path=WINDOW_STATE_FILE):
+        """Saves the open windows so a restart can continue where it stopped."""
+        with self._lock:
+            pd.to_pickle({"state": self.state, "max_ts": self.max_ts, "late_rows": self.late_rows}, path)
+
+    def restore(self, path=WINDOW_STATE_FILE):
+        """Loads open windows saved by snapshot(); windows no longer configured are dropped."""
+        if not Path(path).exists():
+            return self
+        saved = pd.read_pickle(path)
+        with self._lock:
+            state = saved["state"]
+            if state is not None and f"{self.numeric_cols[0]}_m2" not in state.columns:
+                logger.warning("Open windows were saved with sums of squares; starting without them")
+                state = None
+            if state is not None:
+                state = state[state.index.get_level_values("window_name").isin(list(self.windows))]
+            self.state, self.max_ts, self.late_rows = state, saved["max_ts"], saved["late_rows"]
+        logger.info(f"Restored {0 if state is None else len(state)} open windows (watermark {self.watermark})")
+        return self
+
+
+WINDOWS = WindowAggregator(parse_windows(WINDOWS_SPEC)) if WINDOWS_SPEC.strip() else None
+
+
+def process_windows(transformed, source):
+    """Updates the shared window state and loads (or spools) the windows it closed."""
+    if WINDOWS is None or transformed is None or transformed.empty:
+        return 0
+    closed = WINDOWS.update(transformed)
+    if closed.empty:
+        return 0
+    try:
+        SPOOL.write([("windowed", closed, source)])
+    except Exception as e:
+        logger.error(f"Failed to insert window rows after {source}: {e}")
+    return len(closed)
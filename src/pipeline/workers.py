@@ -0,0 +1,98 @@
+import os
+import queue
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+
+# Threads pick files off the queue and do the DB I/O; the pandas-heavy
+# stages are handed to a process pool so they can use every core.
+WORKER_THREADS = int(os.getenv("PIPELINE_WORKERS", "4"))
+# 0 runs the CPU stages inline in the worker threads (the default on single-core hosts)
+WORKER_PROCESSES = int(os.getenv("PIPELINE_PROCESSES", str(os.cpu_count() if (os.cpu_count() or 1) > 1 else 0)))
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "100"))
+
+_STOP = object()
+
+
+def _ignore_sigint():
+    # Ctrl+C goes to the whole process group; let the parent drain the queue instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class WorkerPool:
+    """
+    Bounded work queue served by a pool of worker threads.
+
+    submit() blocks while the queue is full, which pushes back on the
+    producer (the watchdog observer thread). shutdown() drains every queued
+    item before stopping the workers.
+    """
+
+    def __init__(self, handler, threads=WORKER_THREADS, processes=WORKER_PROCESSES, queue_size=QUEUE_SIZE):
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = [
+            threading.Thread(target=self._work, name=f"pipeline-worker-{i}", daemon=True)
+            for i in range(max(threads, 1))
+        ]
+        self.process_count = max(processes, 0)
+        # spawn: the parent already runs threads (observer, loguru, side outputs)
+        self.processes = (
+            ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_ignore_sigint,
+            )
+            if processes > 0 else None
+        )
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        logger.info(
+            f"Started {len(self.threads)} worker threads, "
+            f"{self.process_count} worker processes "
+            f"(queue size {self.queue.maxsize})"
+        )
+        return self
+
+    def submit(self, item):
+        """Enqueues an item, blocking while the queue is full."""
+        if self.queue.full():
+            logger.warning(f"Work queue full ({self.queue.maxsize}), waiting to enqueue {item}")
+        self.queue.put(item)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def run_cpu(self, func, *args):
+        """Runs a CPU-bound, picklable function in the process pool (or inline)."""
+        if self.processes is None:
+            return func(*args)
+        return self.processes.submit(func, *args).result()
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self.handler(item)
+            except Exception as e:
+                logger.error(f"Worker failed on {item}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def shutdown(self):
+        """Waits for every queued item to finish, then stops threads and processes."""
+        logger.info(f"Draining work queue ({self.depth()} pending)...")
+        self.queue.join()
+        for _ in self.threads:
+            self.queue.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        if self.processes is not None:
+            self.processes.shutdown(wait=True)
+        logger.info("Worker pool stopped")
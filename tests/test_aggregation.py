@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from src.pipeline.aggregation import (
+    NUMERIC_COLS, AggregateState, aggregate_df, partial_stats, merge_stats, finalize_stats,
+)
+
+
+def sensor_frame(rows=2000, devices=3, seed=0):
+    """Transformed-like rows: device, ts and float32 readings."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "device": pd.Categorical(rng.choice([f"dev{i}" for i in range(devices)], rows)),
+        "ts": pd.to_datetime(1_600_000_000 + np.arange(rows) * 1.3, unit="s"),
+    })
+    for col in NUMERIC_COLS:
+        df[col] = rng.normal(size=rows).astype("float32")
+    return df
+
+
+def test_chunked_state_matches_aggregate_df():
+    df = sensor_frame()
+    df.loc[df.index[:50], "temp"] = np.nan
+
+    state = AggregateState()
+    for start in range(0, len(df), 300):
+        state.update(df.iloc[start:start + 300])
+
+    expected = aggregate_df(df, "f.csv").drop(columns="processed_at")
+    result = state.finalize("f.csv").drop(columns="processed_at")
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True),
+                                  check_exact=False, atol=1e-4, check_dtype=False, check_categorical=False)
+
+
+def test_merged_states_match_one_state():
+    df = sensor_frame(seed=1)
+    whole = AggregateState().update(df)
+    left = AggregateState().update(df.iloc[:700])
+    right = AggregateState().update(df.iloc[700:])
+
+    pd.testing.assert_frame_equal(left.merge(right).state.sort_index(), whole.state.sort_index(),
+                                  check_exact=False, rtol=1e-9, check_dtype=False, check_index_type=False)
+    assert left.rows == len(df)
+
+
+def test_merge_stats_keeps_precision_with_a_large_mean():
+    # A spread of 1e-3 around 1e6: the sum-of-squares formula cancels to noise here
+    df = sensor_frame(rows=5000, devices=2, seed=2)
+    noise = np.random.default_rng(3).normal(scale=1e-3, size=(len(df), len(NUMERIC_COLS)))
+    df[NUMERIC_COLS] = 1e6 + noise
+
+    parts = [partial_stats(df.iloc[i:i + 400], df["device"].iloc[i:i + 400]) for i in range(0, len(df), 400)]
+    result = finalize_stats(merge_stats(parts))
+    expected = df.groupby("device", observed=True)[NUMERIC_COLS].std()
+
+    for col in NUMERIC_COLS:
+        np.testing.assert_allclose(result[f"{col}_std"], expected[col], rtol=1e-6)
+        np.testing.assert_allclose(result[f"{col}_mean"], df.groupby("device", observed=True)[col].mean(), rtol=1e-12)
+
+
+def test_merge_stats_ignores_groups_without_values():
+    df = sensor_frame(rows=10, devices=1)
+    first, second = df.iloc[:5].copy(), df.iloc[5:]
+    first["co"] = np.nan
+
+    merged = merge_stats([partial_stats(first, first["device"]), partial_stats(second, second["device"])])
+    result = finalize_stats(merged).iloc[0]
+
+    assert merged["co_count"].iloc[0] == 5
+    assert np.isclose(result["co_mean"], second["co"].astype("float64").mean())
+    assert np.isclose(result["co_std"], second["co"].astype("float64").std())
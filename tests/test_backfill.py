@@ -0,0 +1,44 @@
+import pytest
+
+from src.pipeline import schema
+from src.pipeline.backfill import plan_shards
+
+HEADER = ",".join(schema.COLUMNS).encode() + b"\n"
+
+
+def write_csv(path, rows, trailing_newline=True):
+    lines = [f"{1_600_000_000 + i},dev{i % 3},0.004,{50 + i % 7}.5,false,0.007,false,0.02,2{i % 10}.1"
+             for i in range(rows)]
+    path.write_bytes(HEADER + "\n".join(lines).encode() + (b"\n" if trailing_newline else b""))
+    return path
+
+
+@pytest.mark.parametrize("rows,shard_rows", [(10, 3), (9, 3), (2, 5), (25, 1)])
+@pytest.mark.parametrize("block_size", [7, 64, 1 << 24])
+def test_shards_cover_the_file_on_line_ends(tmp_path, rows, shard_rows, block_size):
+    path = write_csv(tmp_path / "big.csv", rows)
+    header, shards = plan_shards(path, shard_rows, block_size)
+    data = path.read_bytes()
+
+    assert header == schema.COLUMNS
+    assert shards[0][0] == len(HEADER)
+    assert shards[-1][1] == len(data)
+    assert all(end == start for (_, end), (start, _) in zip(shards, shards[1:]))
+    lines = [data[start:end].count(b"\n") for start, end in shards]
+    assert all(data[end - 1:end] == b"\n" for _, end in shards)
+    assert lines[:-1] == [shard_rows] * (len(shards) - 1)
+    assert sum(lines) == rows
+
+
+def test_last_line_without_newline_is_kept(tmp_path):
+    path = write_csv(tmp_path / "big.csv", 7, trailing_newline=False)
+    _, shards = plan_shards(path, 3, block_size=16)
+
+    assert len(shards) == 3
+    assert shards[-1][1] == path.stat().st_size
+
+
+def test_header_only_file_has_no_shards(tmp_path):
+    path = tmp_path / "empty.csv"
+    path.write_bytes(HEADER)
+    assert plan_shards(path, 3)[1] == []
@@ -0,0 +1,66 @@
+import pandas as pd
+
+from src.pipeline import schema
+from src.pipeline.aggregation import rollup_stats
+from src.pipeline.sketches import sketch_stats
+from src.pipeline.transformation import transform_df
+from src.database.spool import derive_inserted, inserted_rows
+
+
+def raw_file(rows=40):
+    """Raw rows of one file as the pipeline reads them, spread over two hours and three devices."""
+    lines = [f"{1_600_000_000 + i * 180},dev{i % 3},0.00{i % 9},{40 + i % 20}.5,false,0.007,false,0.02,2{i % 10}.1"
+             for i in range(rows)]
+    lines[-3] = lines[-3].replace(",false,0.007,", ",maybe,0.007,")  # one invalid row among the new ones
+    return schema.read_lines("\n".join(lines).encode() + b"\n", schema.COLUMNS)
+
+
+def half_overlap(raw):
+    """The merge counts of a file whose first half is already stored."""
+    half = len(raw) // 2
+    return {"new": len(raw) - half, "duplicates": half, "duplicate_index": list(raw.index[:half])}
+
+
+def test_rollups_of_a_half_overlapping_file_count_only_new_rows():
+    raw = raw_file()
+    merged = half_overlap(raw)
+    whole = rollup_stats(transform_df(raw))
+
+    result = derive_inserted("rollup", whole, raw, "f.csv", merged)
+
+    expected = rollup_stats(transform_df(raw.iloc[len(raw) // 2:].drop(index=raw.index[-3])))
+    pd.testing.assert_frame_equal(result, expected)
+    assert result["rows"].sum() == merged["new"] - 1
+
+
+def test_sketches_of_a_half_overlapping_file_count_only_new_rows():
+    raw = raw_file()
+    merged = half_overlap(raw)
+
+    result = derive_inserted("sketch", sketch_stats(transform_df(raw)), raw, "f.csv", merged)
+
+    expected = sketch_stats(transform_df(raw.iloc[len(raw) // 2:].drop(index=raw.index[-3])))
+    assert list(result.index) == list(expected.index)
+    assert [s.to_bytes() for s in result["sketch"]] == [s.to_bytes() for s in expected["sketch"]]
+
+
+def test_alert_rows_are_filtered_by_index():
+    raw = raw_file()
+    merged = half_overlap(raw)
+    alerts = transform_df(raw)[["device", "ts", "temp"]]
+
+    result = derive_inserted("alert", alerts, raw, "f.csv", merged)
+    assert list(result.index) == list(raw.index[len(raw) // 2:])
+
+
+def test_full_and_no_overlap():
+    raw = raw_file()
+    rollups = rollup_stats(transform_df(raw))
+    none_new = {"new": 0, "duplicates": len(raw), "duplicate_index": list(raw.index)}
+    all_new = {"new": len(raw), "duplicates": 0, "duplicate_index": []}
+
+    assert derive_inserted("rollup", rollups, raw, "f.csv", none_new) is None
+    assert derive_inserted("rollup", rollups, raw, "f.csv", all_new) is rollups
+    assert derive_inserted("rollup", rollups, raw, "f.csv", None) is rollups
+    assert inserted_rows(raw, none_new) is None
+    assert inserted_rows(raw, all_new) is raw
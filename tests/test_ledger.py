@@ -0,0 +1,62 @@
+import shutil
+
+from src.pipeline.ledger import Ledger
+
+
+def incoming(tmp_path, *names):
+    directory = tmp_path / "incoming"
+    directory.mkdir()
+    for name in names:
+        (directory / name).write_text(f"ts,device\n1600000000,{name}\n")
+    return directory
+
+
+def test_claim_once_per_content(tmp_path):
+    directory = incoming(tmp_path, "a.csv")
+    ledger = Ledger(tmp_path / "ledger.db")
+
+    content_hash = ledger.claim(directory / "a.csv")
+    assert content_hash is not None
+    # In progress: neither the same file nor a copy under another name is handed out
+    shutil.copy(directory / "a.csv", directory / "copy.csv")
+    assert ledger.claim(directory / "a.csv") is None
+    assert ledger.claim(directory / "copy.csv") is None
+
+    ledger.finish(content_hash, {"status": "loaded", "rows": 1, "valid": 1, "invalid": 0})
+    assert ledger.claim(directory / "copy.csv") is None
+    ledger.close()
+
+
+def test_failed_file_can_be_claimed_again(tmp_path):
+    directory = incoming(tmp_path, "a.csv")
+    ledger = Ledger(tmp_path / "ledger.db")
+
+    ledger.finish(ledger.claim(directory / "a.csv"), {"status": "failed"})
+    assert ledger.claim(directory / "a.csv") is not None
+    ledger.close()
+
+
+def test_pending_skips_finished_files(tmp_path):
+    directory = incoming(tmp_path, "b.csv", "a.csv", "c.csv")
+    ledger = Ledger(tmp_path / "ledger.db")
+    assert [p.name for p in ledger.pending(directory)] == ["a.csv", "b.csv", "c.csv"]
+
+    ledger.finish(ledger.claim(directory / "a.csv"), {"status": "loaded"})
+    ledger.finish(ledger.claim(directory / "b.csv"), {"status": "spooled"})
+    st = (directory / "c.csv").stat()
+    assert [p.name for p in ledger.pending(directory)] == ["c.csv"]
+    # Files other watchers finished are skipped too
+    assert ledger.pending(directory, finished=[("c.csv", st.st_size, st.st_mtime)]) == []
+    ledger.close()
+
+
+def test_ledger_survives_a_restart(tmp_path):
+    directory = incoming(tmp_path, "a.csv")
+    ledger = Ledger(tmp_path / "ledger.db")
+    ledger.finish(ledger.claim(directory / "a.csv"), {"status": "loaded"})
+    ledger.close()
+
+    ledger = Ledger(tmp_path / "ledger.db")
+    assert ledger.pending(directory) == []
+    assert ledger.claim(directory / "a.csv") is None
+    ledger.close()
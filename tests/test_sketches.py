@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from src.pipeline.sketches import DDSketch
+
+QUANTILES = [0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1]
+
+
+def readings(rows=5000, seed=0):
+    """Positive, negative and zero values over several orders of magnitude."""
+    rng = np.random.default_rng(seed)
+    values = rng.lognormal(sigma=2, size=rows) * rng.choice([-1, 1], rows, p=[0.2, 0.8])
+    values[:50] = 0
+    return values
+
+
+@pytest.mark.parametrize("accuracy", [0.01, 0.05])
+def test_quantiles_within_relative_error(accuracy):
+    values = readings()
+    sketch = DDSketch(accuracy).add(values)
+    ordered = np.sort(values)
+
+    assert sketch.count == len(values)
+    for q in QUANTILES:
+        exact = ordered[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= accuracy * abs(exact) + 1e-12
+
+
+def test_merge_equals_sketch_of_union():
+    left, right = readings(seed=1), readings(seed=2)
+    merged = DDSketch().add(left).merge(DDSketch().add(right))
+    whole = DDSketch().add(np.concatenate([left, right]))
+
+    assert merged.count == whole.count
+    assert merged.quantiles(QUANTILES) == whole.quantiles(QUANTILES)
+
+
+def test_serialization_round_trip():
+    sketch = DDSketch().add(readings())
+    restored = DDSketch.from_bytes(sketch.to_bytes())
+    assert restored.quantiles(QUANTILES) == sketch.quantiles(QUANTILES)
+
+
+def test_empty_sketch_and_mismatched_accuracy():
+    assert DDSketch().add([np.nan]).quantile(0.5) is None
+    with pytest.raises(ValueError):
+        DDSketch(0.01).merge(DDSketch(0.05))
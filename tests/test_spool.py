@@ -0,0 +1,107 @@
+import pickle
+
+import pandas as pd
+import psycopg2
+import pytest
+
+from src.database import spool
+from src.database.db_utils import CircuitBreaker
+
+
+class FakeDatabase:
+    """Stands in for apply_writes: records what it applied, fails while down."""
+
+    def __init__(self):
+        self.down = False
+        self.applied = []
+
+    def __call__(self, writes):
+        if self.down:
+            raise psycopg2.OperationalError("connection refused")
+        if any(source == "bad.csv" for _, _, source in writes):
+            raise ValueError("value out of range for column")
+        self.applied.append([source for _, _, source in writes])
+        return {}
+
+
+def write(source):
+    return [("raw", pd.DataFrame({"device": ["dev0"], "ts": [1_600_000_000]}), source)]
+
+
+def make_spool(tmp_path, monkeypatch, segment_bytes=1 << 20):
+    monkeypatch.setattr(spool, "FAILED_DIR", tmp_path / "failed")
+    database = FakeDatabase()
+    queue = spool.Spool(tmp_path / "spool", segment_bytes=segment_bytes,
+                        breaker=CircuitBreaker(failures=1, reset=0), enabled=True, apply=database)
+    return queue, database
+
+
+def test_writes_go_straight_to_the_database(tmp_path, monkeypatch):
+    queue, database = make_spool(tmp_path, monkeypatch)
+    assert queue.write(write("a.csv")) == "loaded"
+    assert queue.write([("raw", pd.DataFrame(), "empty.csv")]) == "loaded"
+    assert database.applied == [["a.csv"]]
+    assert queue.pending == 0
+
+
+def test_spooled_while_down_and_replayed_in_order(tmp_path, monkeypatch):
+    queue, database = make_spool(tmp_path, monkeypatch, segment_bytes=1)
+    database.down = True
+    assert queue.write(write("a.csv")) == "spooled"
+    assert queue.breaker.is_open()
+    # Once anything is spooled, later writes queue behind it even if the database is back
+    database.down = False
+    assert queue.write(write("b.csv")) == "spooled"
+    assert queue.pending == 2
+    assert database.applied == []
+
+    assert queue.drain() == 2
+    assert database.applied == [["a.csv"], ["b.csv"]]
+    assert queue.pending == 0
+    assert queue._segments() == []
+    assert queue.write(write("c.csv")) == "loaded"
+    queue.stop()
+
+
+def test_replay_pauses_while_down_and_resumes_from_the_cursor(tmp_path, monkeypatch):
+    queue, database = make_spool(tmp_path, monkeypatch)
+    database.down = True
+    queue.write(write("a.csv"))
+    queue.write(write("b.csv"))
+    assert queue.drain() == 0
+    assert queue.pending == 2
+    queue.stop()
+
+    # A restarted process finds the spooled records on disk
+    database.down = False
+    restarted = spool.Spool(tmp_path / "spool", breaker=CircuitBreaker(failures=1, reset=0),
+                            enabled=True, apply=database)
+    assert restarted.pending == 2
+    assert restarted.drain() == 2
+    assert database.applied == [["a.csv"], ["b.csv"]]
+    restarted.stop()
+
+
+def test_data_errors_are_dead_lettered(tmp_path, monkeypatch):
+    queue, database = make_spool(tmp_path, monkeypatch)
+    database.down = True
+    for source in ("a.csv", "bad.csv", "c.csv"):
+        queue.write(write(source))
+    database.down = False
+
+    assert queue.drain() == 2
+    assert database.applied == [["a.csv"], ["c.csv"]]
+    assert queue.pending == 0
+    failed = list((tmp_path / "failed").glob("spool-*.pkl"))
+    assert len(failed) == 1
+    assert [source for _, _, source in pickle.loads(failed[0].read_bytes())] == ["bad.csv"]
+    queue.stop()
+
+
+def test_disabled_spool_raises_when_down(tmp_path, monkeypatch):
+    queue, database = make_spool(tmp_path, monkeypatch)
+    queue.enabled = False
+    database.down = True
+    with pytest.raises(psycopg2.OperationalError):
+        queue.write(write("a.csv"))
+    assert queue.pending == 0
@@ -0,0 +1,43 @@
+import pandas as pd
+
+from src.pipeline.validation import evaluate_rules
+
+
+def raw_frame():
+    """Raw rows as read from an incoming file, one problem per row after the first."""
+    return pd.DataFrame({
+        "ts": [1_600_000_000, 1_600_000_001, 1_600_000_002, 1_600_000_003],
+        "device": ["dev0", "dev0", "dev1", "dev1"],
+        "co": [0.004, 0.004, 0.005, 0.005],
+        "humidity": [51.0, 52.0, None, 50.0],
+        "light": ["FALSE", "TRUE", "FALSE", "maybe"],
+        "lpg": [0.007, 0.007, 0.008, 0.008],
+        "motion": ["FALSE", "FALSE", "TRUE", "FALSE"],
+        "smoke": [0.02, 0.02, 0.02, 0.02],
+        "temp": ["22.7", "99", "abc", "21.0"],
+    })
+
+
+def test_valid_mask_and_errors_in_row_order():
+    valid, records = evaluate_rules(raw_frame(), "f.csv")
+
+    assert valid.tolist() == [True, False, False, False]
+    assert [(r[1], r[-1]) for r in records] == [
+        (1, "temp_range"),
+        (2, "humidity_not_null"),
+        (3, "light_boolean"),
+    ]
+    assert records[0][:6] == ("f.csv", 1, "dev0", "temp", "99", "Temperature out of range")
+
+
+def test_null_rows_skip_gated_rules():
+    # Row 2 has a null humidity and a non-numeric temperature; only the null is reported
+    _, records = evaluate_rules(raw_frame(), "f.csv")
+    assert [r[-1] for r in records if r[1] == 2] == ["humidity_not_null"]
+
+
+def test_rules_for_missing_columns_are_skipped():
+    df = raw_frame().drop(columns=["light", "motion"])
+    valid, records = evaluate_rules(df, "f.csv")
+    assert valid.tolist() == [True, False, False, True]
+    assert all(r[3] not in ("light", "motion") for r in records)
@@ -0,0 +1,51 @@
+import pandas as pd
+
+from src.pipeline.windowing import WindowAggregator, parse_windows
+
+
+def rows(*readings):
+    """(seconds after midnight, temp) pairs for one device."""
+    return pd.DataFrame({
+        "device": ["dev0"] * len(readings),
+        "ts": [pd.Timestamp("2024-01-01") + pd.Timedelta(seconds=s) for s, _ in readings],
+        "temp": [temp for _, temp in readings],
+    })
+
+
+def test_windows_close_at_the_watermark():
+    windows = WindowAggregator(parse_windows("1min"), lateness="10s", numeric_cols=["temp"])
+
+    assert windows.update(rows((10, 20.0), (50, 22.0))).empty
+    # Watermark 00:01:05 is past the end of the first minute
+    closed = windows.update(rows((75, 30.0)))
+
+    assert len(closed) == 1
+    window = closed.iloc[0]
+    assert window["window_start"] == pd.Timestamp("2024-01-01")
+    assert window["window_end"] == pd.Timestamp("2024-01-01 00:01")
+    assert window["row_count"] == 2
+    assert window["temp_mean"] == 21.0
+    assert window["temp_min"] == 20.0 and window["temp_max"] == 22.0
+
+
+def test_late_rows_are_dropped():
+    windows = WindowAggregator(parse_windows("1min"), lateness="0s", numeric_cols=["temp"])
+    windows.update(rows((10, 20.0), (90, 25.0)))
+
+    assert windows.update(rows((20, 99.0))).empty
+    assert windows.late_rows == 1
+
+    remaining = windows.flush()
+    assert remaining["window_start"].tolist() == [pd.Timestamp("2024-01-01 00:01")]
+    assert remaining["row_count"].tolist() == [1]
+
+
+def test_sliding_windows_count_each_row_once_per_window():
+    windows = WindowAggregator(parse_windows("2min/1min"), lateness="0s", numeric_cols=["temp"])
+    windows.update(rows((30, 1.0), (90, 3.0)))
+    closed = windows.flush().set_index("window_start")
+
+    assert closed.loc[pd.Timestamp("2023-12-31 23:59"), "row_count"] == 1
+    assert closed.loc[pd.Timestamp("2024-01-01 00:00"), "row_count"] == 2
+    assert closed.loc[pd.Timestamp("2024-01-01 00:00"), "temp_mean"] == 2.0
+    assert closed.loc[pd.Timestamp("2024-01-01 00:01"), "row_count"] == 1